@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Valuation analytics over the stored PE series
+- Rolling 3/5/10-year percentile rank, z-score, mean and mean ±1σ/±2σ bands
+- Drawdown from the running PE peak
+
+Windows are calendar-based ("1095D", ...) so daily and monthly sources are treated alike; a
+window only reports once the series covers MIN_COVERAGE of it. Input is the PE column of the wide
+store (series_store.py); results go to data/analytics/<KEY>.csv. A full rebuild runs the pandas
+rolling operations over the whole series (compute); an incremental update only evaluates the days
+after the last stored row (extend), each on its own window sliced out of the in-memory series by
+binary search, and appended to the CSV, so a daily run costs O(window) for the one new day
+instead of a rolling pass over the whole history and a rewrite of the file.
+"""
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+WINDOWS = {"3y": 3, "5y": 5, "10y": 10}
+MIN_COVERAGE = 0.8
+PRUNE_SLACK_DAYS = 365  # rows older than the stored history tolerated before a rewrite
+
+def _columns() -> list:
+    cols = ["date", "pe", "peak", "drawdown"]
+    for tag in WINDOWS:
+        cols += [f"pct_{tag}", f"z_{tag}", f"mean_{tag}", f"lo2_{tag}", f"lo1_{tag}", f"hi1_{tag}", f"hi2_{tag}"]
+    return cols
+
+def compute(pe: pd.Series, first_date: pd.Timestamp, prev_peak: float = -np.inf) -> pd.DataFrame:
+    """
+    Vectorized analytics for a date-indexed PE series. `first_date` is the start of the whole
+    stored history (for the coverage rule); `prev_peak` carries the running peak across updates.
+    """
+    pe = pe.astype("float64")
+    out = pd.DataFrame(index=pe.index)
+    out["pe"] = pe
+    peak = np.maximum.accumulate(np.maximum(pe.to_numpy(), prev_peak)) if len(pe) else np.empty(0)
+    out["peak"] = peak
+    out["drawdown"] = pe.to_numpy() / peak - 1.0
+    age_days = (pe.index - first_date).days.to_numpy()
+    for tag, years in WINDOWS.items():
+        days = int(round(365.25 * years))
+        roll = pe.rolling(f"{days}D", min_periods=2)
+        mean = roll.mean()
+        std = roll.std(ddof=0)
+        covered = age_days >= MIN_COVERAGE * days
+        out[f"pct_{tag}"] = roll.rank(pct=True).where(covered)
+        out[f"z_{tag}"] = ((pe - mean) / std.replace(0.0, np.nan)).where(covered)
+        out[f"mean_{tag}"] = mean.where(covered)
+        for k, name in ((-2, "lo2"), (-1, "lo1"), (1, "hi1"), (2, "hi2")):
+            out[f"{name}_{tag}"] = (mean + k * std).where(covered)
+    out.index.name = "date"
+    return out.reset_index()
+
+def extend(pe: pd.Series, first_date: pd.Timestamp, prev_peak: float, start: int) -> pd.DataFrame:
+    """
+    Analytics rows for pe.iloc[start:] only, matching compute() on the whole series: each window
+    (t - N days, t] is located with searchsorted and reduced directly, percentile rank using
+    pandas' average method for ties.
+    """
+    values = pe.to_numpy(dtype="float64")
+    days = pe.index.values.astype("datetime64[D]").view("int64")
+    new = values[start:]
+    out = pd.DataFrame(index=pe.index[start:])
+    out["pe"] = new
+    peak = np.maximum.accumulate(np.maximum(new, prev_peak)) if len(new) else np.empty(0)
+    out["peak"] = peak
+    out["drawdown"] = new / peak - 1.0
+    age_days = days[start:] - np.datetime64(first_date.date(), "D").view("int64")
+    for tag, years in WINDOWS.items():
+        span = int(round(365.25 * years))
+        lows = np.searchsorted(days, days[start:] - span, side="right")
+        stats = np.full((7, len(new)), np.nan)
+        for i, lo in enumerate(lows):
+            hi = start + i + 1
+            if hi - lo < 2 or age_days[i] < MIN_COVERAGE * span:
+                continue
+            window, x = values[lo:hi], values[hi - 1]
+            mean, std = window.mean(), window.std()
+            rank = (np.count_nonzero(window < x) + (np.count_nonzero(window == x) + 1) / 2) / len(window)
+            stats[:, i] = (rank, (x - mean) / std if std > 0 else np.nan, mean,
+                           mean - 2 * std, mean - std, mean + std, mean + 2 * std)
+        for row, name in zip(stats, ("pct", "z", "mean", "lo2", "lo1", "hi1", "hi2")):
+            out[f"{name}_{tag}"] = row
+    out.index.name = "date"
+    return out.reset_index()
+
+def _clean(pe: pd.Series) -> pd.Series:
+    s = pd.Series(pe.to_numpy(dtype="float64"), index=pd.to_datetime(pe.index))
+    return s[~s.index.duplicated(keep="last")].sort_index().dropna()
+
+def _ends(path: str) -> tuple:
+    """Header, first and last data row of an analytics CSV (as field lists), without reading the rows between."""
+    with open(path, "rb") as f:
+        head = [l.decode("utf-8").split(",") for l in (f.readline().strip(), f.readline().strip())]
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 4096))
+        lines = [l for l in f.read().splitlines() if l.strip()]
+    return head[0], head[1], lines[-1].decode("utf-8").split(",")
+
+def update_analytics(key: str, pe: pd.Series, data_dir: str, incremental: bool = True) -> Optional[pd.DataFrame]:
+    """
+    Refresh data/analytics/<key>.csv from the date-indexed PE series `pe`. Returns the rows
+    written (all rows on a full rebuild, only the new ones when appending), or None if no PE data.
+    Appending reads only the file's first and last rows; rows that aged out of the stored PE history
+    are dropped by a rewrite once they span more than PRUNE_SLACK_DAYS.
+    """
+    pe = _clean(pe)
+    if pe.empty:
+        return None
+    out_dir = os.path.join(data_dir, "analytics")
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{key}.csv")
+    first_date = pe.index[0]
+
+    last = None
+    if incremental and os.path.exists(path):
+        header, first, tail = _ends(path)
+        if header == _columns() and len(first) == len(tail) == len(header) and tail != header:
+            last, stored_first = pd.Timestamp(tail[0]), pd.Timestamp(first[0])
+            if last > pe.index[-1] or stored_first < first_date - pd.Timedelta(days=PRUNE_SLACK_DAYS):
+                last = None
+
+    if last is None:
+        kept = compute(pe, first_date)[_columns()]
+        mode = "w"
+    else:
+        if pe.index[-1] <= last:
+            return extend(pe, first_date, -np.inf, len(pe))[_columns()]
+        peak = float(tail[_columns().index("peak")] or "-inf")
+        kept = extend(pe, first_date, peak, int(pe.index.searchsorted(last, side="right")))[_columns()]
+        mode = "a"
+
+    if mode == "w":
+        tmp = path + ".tmp"
+        kept.to_csv(tmp, index=False, float_format="%.6g", date_format="%Y-%m-%d", encoding="utf-8")
+        os.replace(tmp, path)
+    else:
+        with open(path, "a", encoding="utf-8", newline="") as f:
+            kept.to_csv(f, header=False, index=False, float_format="%.6g", date_format="%Y-%m-%d")
+    print(f"Wrote {path}  new={len(kept)}" + (" (rebuilt)" if mode == "w" else ""))
+    return kept
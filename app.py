@@ -1,95 +1,132 @@
-import yfinance as yf
+import os
 import json
-from datetime import datetime, timedelta
-import time
-import pandas as pd
+from datetime import datetime, timedelta, date
 
-def fetch_index_data(symbol, name):
+import metrics
+import ratelimit
+import symbols
+from publish import publish_file
+
+# yfinance、pandas（bar_cache）和 requests（http_session）在用到它们的函数内导入，
+# 只做状态检查等轻量操作时无需承担这些导入耗时
+
+YAHOO_HOST = "query1.finance.yahoo.com"
+
+def fetch_index_data(symbol, name, currency="USD"):
     """
-    获取指定指数的市场数据，包含数据验证
+    获取指定指数的市场数据，包含数据验证（逐个请求，作为批量下载失败时的回退）
+    币种等静态信息来自本地元数据注册表（symbols.json），不再请求 ticker.info
     """
     try:
-        ticker = yf.Ticker(symbol)
-        info = ticker.info
-        
-        # 获取最近2天的历史数据用于验证
-        history = ticker.history(period="2d")
-        
-        if history.empty or len(history) < 2:
-            print(f"警告: {name} 历史数据不足")
-            return create_error_data(name, "历史数据不足")
-        
-        # 使用历史数据计算更可靠的价格信息
-        current_price = history['Close'].iloc[-1]
-        previous_close = history['Close'].iloc[-2]
+        import yfinance as yf
+        from http_session import yf_session
+        # 按 Yahoo 主机的令牌桶限速（替代固定 sleep）
+        ratelimit.acquire(YAHOO_HOST)
+        ticker = yf.Ticker(symbol, session=yf_session())
         
-        # 验证价格数据的合理性
-        if not validate_price_data(current_price, previous_close, name):
-            return create_error_data(name, "价格数据异常")
-        
-        # 计算涨跌幅（限制在合理范围内）
-        change_percent = calculate_safe_change_percent(current_price, previous_close)
-        
-        # 获取52周数据
-        yearly_history = ticker.history(period="1y")
-        if not yearly_history.empty:
-            fifty_two_week_high = yearly_history['High'].max()
-            fifty_two_week_low = yearly_history['Low'].min()
-        else:
-            fifty_two_week_high = None
-            fifty_two_week_low = None
-        
-        # 获取成交额
-        volume = history['Volume'].iloc[-1] if 'Volume' in history.columns else None
-        
-        return {
-            "current_price": round(current_price, 2),
-            "previous_close": round(previous_close, 2),
-            "change_percent": round(change_percent, 2),
-            "fifty_two_week_high": round(fifty_two_week_high, 2) if fifty_two_week_high else None,
-            "fifty_two_week_low": round(fifty_two_week_low, 2) if fifty_two_week_low else None,
-            "volume": int(volume) if volume else None,
-            "currency": info.get('currency', 'USD'),
-            "data_quality": "good"
-        }
+        # 一次请求获取一年历史数据，价格、涨跌幅与52周数据均由此计算
+        with metrics.stage("fetch", "yahoo", symbol) as st:
+            yearly_history = ticker.history(period="1y")
+            st.rows = len(yearly_history)
+        with metrics.stage("validate", "yahoo", symbol):
+            return summarize_history(yearly_history, name, currency)
         
     except Exception as e:
         print(f"获取{name}数据失败: {e}")
+        report_yahoo_error(e)
         return create_error_data(name, str(e))
 
-def validate_price_data(current_price, previous_close, name):
-    """验证价格数据的合理性"""
-    if current_price is None or previous_close is None:
-        print(f"警告: {name} 价格数据为空")
-        return False
-    
-    if current_price <= 0 or previous_close <= 0:
-        print(f"警告: {name} 价格数据为负值或零")
-        return False
-    
-    # 检查单日涨跌幅是否在合理范围内（±20%以内）
-    if previous_close > 0:
-        daily_change = abs((current_price - previous_close) / previous_close)
-        if daily_change > 0.20:  # 超过20%的日涨跌幅需要特别检查
-            print(f"警告: {name} 日涨跌幅异常: {daily_change:.2%}")
-            # 这里可以添加更复杂的验证逻辑
-            # 暂时仍然返回True，但标记为需要验证
-    
-    return True
+def report_yahoo_error(error):
+    """yfinance 以异常形式暴露限流，识别后让 Yahoo 主机的令牌桶退避"""
+    text = f"{type(error).__name__} {error}"
+    if "RateLimit" in text or "Too Many Requests" in text or "429" in text:
+        ratelimit.report(YAHOO_HOST, 429)
 
-def calculate_safe_change_percent(current_price, previous_close):
-    """安全计算涨跌幅，处理异常情况"""
-    if previous_close is None or previous_close == 0:
-        return None
+def summarize_history(history, name, currency):
+    """
+    由一年期日线数据计算最新价、涨跌幅、52周高低点及成交量
+    """
+    import validation
+    from bar_cache import window_extremes
+    history = history.dropna(subset=['Close'])
+    
+    # 乱序、重复日期的K线不剔除：按日期稳定排序，同一天保留最后一个有效值，只记为提示
+    order_flags = ((0 if history.index.is_monotonic_increasing else validation.NON_MONOTONIC)
+                   | (validation.DUPLICATE if history.index.has_duplicates else 0))
+    if order_flags:
+        history = history.sort_index(kind='stable').groupby(level=0).last()
+    
+    # 整段收盘价一次性校验（见 validation.py）：非正值直接剔除，
+    # 单日涨跌超过±20%、离群值、数据过期只标记，数据质量记为 warning
+    mask = validation.check(history.index.values, history['Close'].to_numpy(),
+                            validation.RULES["price"], asof=date.today())
+    kept = (mask & validation.HARD) == 0
+    history = history[kept]
+    
+    if history.empty or len(history) < 2:
+        print(f"警告: {name} 历史数据不足")
+        return create_error_data(name, "历史数据不足")
+    
+    flags = validation.flag_names(mask[-1] | mask[kept][-1] | order_flags)
+    if flags:
+        print(f"警告: {name} 数据校验未通过: {', '.join(flags)}")
+    
+    # 使用最近两个交易日的收盘价
+    current_price = history['Close'].iloc[-1]
+    previous_close = history['Close'].iloc[-2]
+    change_percent = (current_price / previous_close - 1) * 100
     
-    change_percent = ((current_price - previous_close) / previous_close) * 100
+    # 52周数据：最近365天K线的最高价/最低价
+    fifty_two_week_high, fifty_two_week_low = window_extremes(history)
     
-    # 如果涨跌幅异常，进行限制或标记
-    if abs(change_percent) > 20:  # 超过20%的涨跌幅
-        print(f"警告: 异常涨跌幅: {change_percent:.2f}%")
-        # 这里可以添加数据验证或使用替代计算方法
+    # 获取成交额
+    volume = history['Volume'].iloc[-1] if 'Volume' in history.columns else None
+    if volume is None or volume != volume:  # NaN
+        volume = None
     
-    return change_percent
+    return {
+        "current_price": round(current_price, 2),
+        "previous_close": round(previous_close, 2),
+        "change_percent": round(change_percent, 2),
+        "fifty_two_week_high": round(fifty_two_week_high, 2) if fifty_two_week_high else None,
+        "fifty_two_week_low": round(fifty_two_week_low, 2) if fifty_two_week_low else None,
+        "volume": int(volume) if volume else None,
+        "currency": currency,
+        "data_quality": "warning" if flags else "good",
+        "quality_flags": flags,
+        "as_of": history.index[-1].strftime("%Y-%m-%d"),
+    }
+
+def download_history_batch(symbols, period="1y", start=None):
+    """
+    一次批量请求下载所有指数的日线 OHLCV 数据，返回以 symbol 为键的 DataFrame 字典
+    指定 start 时只下载该日期（含）之后的K线
+    """
+    import yfinance as yf
+    from http_session import yf_session
+    ratelimit.acquire(YAHOO_HOST)
+    range_args = {"start": start.isoformat()} if start is not None else {"period": period}
+    frame = yf.download(
+        symbols,
+        **range_args,
+        group_by="ticker",
+        auto_adjust=True,
+        threads=True,
+        progress=False,
+        session=yf_session(),
+    )
+    histories = {}
+    if frame is None or frame.empty:
+        return histories
+    for symbol in symbols:
+        if frame.columns.nlevels > 1:
+            if symbol not in frame.columns.get_level_values(0):
+                continue
+            histories[symbol] = frame[symbol]
+        else:
+            # 只有一个 symbol 时 yfinance 返回单层列
+            histories[symbol] = frame
+    return histories
 
 def create_error_data(name, error_message):
     """创建错误数据记录"""
@@ -105,50 +142,122 @@ def create_error_data(name, error_message):
         "error": error_message
     }
 
-def fetch_global_indices_data():
+def fetch_histories_cached(cache, symbols):
     """
-    获取全球主要指数数据
+    增量更新本地K线缓存后返回各指数最近一年的日线数据：
+    没有缓存的指数批量下载一年；已有缓存的指数按各自的最后缓存日期分组，每组只批量下载该日期（含，覆盖盘中未收盘K线）之后的数据，
+    某个指数缓存落后不会让其他指数跟着重下缺口
     """
-    global_indices = {
-        "沪深300": {"symbol": "000300.SS", "region": "中国"},
-        "上证指数": {"symbol": "000001.SS", "region": "中国"},
-        "深证成指": {"symbol": "399001.SZ", "region": "中国"},
-        "恒生指数": {"symbol": "^HSI", "region": "香港"},
-        "标普500": {"symbol": "^GSPC", "region": "美国"},
-        "纳斯达克": {"symbol": "^IXIC", "region": "美国"},
-        "道琼斯": {"symbol": "^DJI", "region": "美国"},
-        "日经225": {"symbol": "^N225", "region": "日本"},
-        "台湾加权": {"symbol": "^TWII", "region": "台湾"},
-        "韩国KOSPI": {"symbol": "^KS11", "region": "韩国"},
-        "印度SENSEX": {"symbol": "^BSESN", "region": "印度"},
-        "德国DAX": {"symbol": "^GDAXI", "region": "欧洲"},
-        "英国富时100": {"symbol": "^FTSE", "region": "欧洲"},
-        "法国CAC40": {"symbol": "^FCHI", "region": "欧洲"},
-        "澳大利亚ASX200": {"symbol": "^AXJO", "region": "澳大利亚"},
-    }
+    since = date.today() - timedelta(days=365)
+    last_dates = cache.last_dates(symbols)
+    fresh = [s for s in symbols if s not in last_dates]
+    cached = [s for s in symbols if s in last_dates]
+    # 超过一年未更新的缓存也只需补最近一年
+    groups = {}
+    for s in cached:
+        groups.setdefault(max(last_dates[s], since), []).append(s)
     
+    # 指标中 cache_misses 记整年下载的指数数，cache_hits 记只补增量的指数数
+    if fresh:
+        with metrics.stage("fetch", "yahoo", "batch_1y") as st:
+            st.cache_misses = len(fresh)
+            for symbol, frame in download_history_batch(fresh, period="1y").items():
+                cache.upsert(symbol, frame)
+                st.rows += len(frame)
+    for start, group in sorted(groups.items()):
+        with metrics.stage("fetch", "yahoo", "batch_delta") as st:
+            st.cache_hits = len(group)
+            for symbol, frame in download_history_batch(group, start=start).items():
+                cache.upsert(symbol, frame)
+                st.rows += len(frame)
+    
+    with metrics.stage("parse", "bar_cache") as st:
+        histories = {symbol: cache.load(symbol, since) for symbol in symbols}
+        st.rows = sum(len(h) for h in histories.values())
+    return histories
+
+def store_quotes(data):
+    """把各指数快照按最新K线日期写入时序库（tsdb.py），序列名 quotes.<指数名>.<字段>"""
+    from tsdb import TimeSeriesDB
+    rows = []
+    for name, info in data.items():
+        if name == "last_updated" or not info.get("as_of"):
+            continue
+        for field, key in (("close", "current_price"), ("change_percent", "change_percent"), ("volume", "volume")):
+            if info.get(key) is not None:
+                rows.append((f"quotes.{name}.{field}", info["as_of"], float(info[key])))
+    with TimeSeriesDB() as db:
+        return db.upsert_rows(rows)
+
+def fetch_symbol_info(symbol):
+    """读取 Yahoo 的 ticker.info，仅供元数据注册表每周后台刷新使用"""
+    import yfinance as yf
+    from http_session import yf_session
+    ratelimit.acquire(YAHOO_HOST)
+    return yf.Ticker(symbol, session=yf_session()).info
+
+def fetch_global_indices_data(batch=True):
+    """
+    获取全球主要指数数据
+    batch=True 时批量增量更新本地K线缓存（见 fetch_histories_cached），仅对批量结果缺失的指数逐个回退请求
+    """
     results = {}
+    histories = {}
     
-    for name, info in global_indices.items():
+    indices = symbols.get_indices()
+    
+    if batch:
+        symbol_list = [info["symbol"] for info in indices.values()]
+        print(f"正在批量获取{len(symbol_list)}个指数数据...")
+        try:
+            from bar_cache import BarCache
+            cache = BarCache()
+            histories = fetch_histories_cached(cache, symbol_list)
+            cache.prune()
+            cache.close()
+        except Exception as e:
+            print(f"批量获取失败，改为逐个获取: {e}")
+            report_yahoo_error(e)
+    
+    for name, info in indices.items():
         symbol = info["symbol"]
         region = info["region"]
         
-        print(f"正在获取{name}数据...")
-        data = fetch_index_data(symbol, name)
+        history = histories.get(symbol)
+        if history is not None and history['Close'].notna().sum() >= 2:
+            with metrics.stage("validate", "yahoo", symbol):
+                data = summarize_history(history, name, info["currency"])
+        else:
+            print(f"正在获取{name}数据...")
+            data = fetch_index_data(symbol, name, info["currency"])
         data["region"] = region
         results[name] = data
-        
-        time.sleep(1)
     
     results["last_updated"] = datetime.utcnow().isoformat()
     return results
 
-if __name__ == "__main__":
+def main():
+    """获取全部指数行情，写入并发布 data.json"""
     print("开始获取全球主要指数市场数据...")
-    data = fetch_global_indices_data()
-    
-    with open("data.json", "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    # 分阶段耗时与请求统计写入 .cache/metrics（见 metrics.py）
+    metrics.start_run("quotes")
+    try:
+        # 元数据注册表超过一周未刷新时在后台线程更新，不阻塞行情获取
+        refresh_thread = symbols.refresh_in_background(fetch_symbol_info)
+        data = fetch_global_indices_data()
+        
+        with metrics.stage("write", "data.json") as st:
+            with open("data.json", "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            
+            # 发布带内容哈希的副本（assets/ + manifest.json），页面只需重新验证 manifest
+            publish_file(".", "data.json", "data.json")
+            st.rows = len(data) - 1
+            st.bytes = os.path.getsize("data.json")
+        with metrics.stage("write", "tsdb") as st:
+            st.rows = store_quotes(data)
+    finally:
+        metrics.finish_run()
     
     print("全球指数市场数据已更新并保存到 data.json")
     
@@ -166,3 +275,10 @@ if __name__ == "__main__":
         elif name != "last_updated":
             change_str = f"{info.get('change_percent', 0):+.2f}%" if info.get("change_percent") is not None else "N/A"
             print(f"✅ {name}: {info.get('current_price')} {info.get('currency', '')} | 涨跌: {change_str}")
+    
+    if refresh_thread is not None:
+        refresh_thread.join()
+        print("指数元数据注册表已刷新")
+
+if __name__ == "__main__":
+    main()
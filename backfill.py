@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Chunked, resumable historical backfill (python cli.py backfill ...)
+- The requested range is split per index into chunks of `chunk_years` calendar years for sources
+  that can request a date range (Data Link start_date / end_date); sources that only serve their
+  whole history (CSIndex via AkShare, hedged JSON / page / CSV feeds) form a single chunk
+- Chunks run on a thread pool, at most `per_source` in flight per source; every request still
+  goes through the host's token bucket (ratelimit.py), so parallel chunks share the source's rate
+  instead of multiplying it
+- Each finished chunk is validated (normalize.canonical) and written to
+  <checkpoint_dir>/<KEY>/<start>_<end>.csv; running the same backfill again skips the chunks
+  already on disk, so an interrupted backfill resumes where it stopped. When only some metrics of a
+  chunk came back (e.g. PE but not PB), the ones that did are checkpointed and the rest are listed
+  in <start>_<end>.missing; the chunk counts as failed and a rerun fetches only those metrics
+- Once every chunk of an index is in, its chunks are merged (overlapping rows de-duplicated by
+  date, the later chunk winning) into the wide store (data/series.csv, still trimmed to
+  history_years) and the indexed store (data/timeseries.sqlite, full depth); views, analytics,
+  relative valuation and the site are then rebuilt for the merged indices. Checkpoints are removed
+  once a run finishes without failed chunks; after a failure they all stay, so the rerun fetches
+  only the failed chunks
+"""
+import os
+import threading
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import metrics
+import update_data as u
+from normalize import canonical, widen
+from series_store import WideStore, column
+from tsdb import TimeSeriesDB
+
+SETTINGS = u.CONFIG.get("backfill", {})
+CHECKPOINT_DIR = SETTINGS.get("checkpoint_dir", os.path.join(".cache", "backfill"))
+
+Chunk = Tuple[str, dt.date, dt.date]  # (index key, first day, last day)
+
+def _datalink_chunk(spec, start: dt.date, end: dt.date, wanted: List[str]):
+    failed = {}
+    return u.datalink_range(spec, start, end, metrics=wanted, failed=failed), failed
+
+def _whole_history(spec, start: dt.date, end: dt.date, wanted: List[str]):
+    return u.LOADER_MAP[spec["loader"]]([spec], {spec["key"]: None})[spec["key"]], {}
+
+# loader -> chunk fetcher (spec, first day, last day, metrics) -> (frame or error, metric -> error
+# of the metrics that failed); loaders missing here can only be fetched whole
+RANGE_FETCHERS = {"datalink": _datalink_chunk}
+
+def plan(keys: List[str], start: dt.date, end: dt.date, chunk_years: int = 2) -> List[Chunk]:
+    """
+    Chunks covering start..end for each key. Boundaries fall on a fixed grid of calendar years
+    (years divisible by chunk_years start a chunk), so the same range always yields the same
+    chunks and checkpoint names.
+    """
+    chunks = []
+    for key in keys:
+        if u.SPECS[key]["loader"] not in RANGE_FETCHERS:
+            chunks.append((key, start, end))
+            continue
+        lo = start
+        while lo <= end:
+            hi = min(dt.date(lo.year - lo.year % chunk_years + chunk_years - 1, 12, 31), end)
+            chunks.append((key, lo, hi))
+            lo = hi + dt.timedelta(days=1)
+    return chunks
+
+def chunk_path(chunk: Chunk, root: str = CHECKPOINT_DIR) -> str:
+    key, lo, hi = chunk
+    return os.path.join(root, key, f"{lo.isoformat()}_{hi.isoformat()}.csv")
+
+def missing_path(chunk: Chunk, root: str = CHECKPOINT_DIR) -> str:
+    """Sidecar of a partial checkpoint: the metrics still to fetch, one per line."""
+    return os.path.splitext(chunk_path(chunk, root))[0] + ".missing"
+
+def missing_metrics(chunk: Chunk, root: str = CHECKPOINT_DIR) -> List[str]:
+    """Metrics a chunk still needs: all of them when not checkpointed, none ([]) when complete."""
+    if not os.path.exists(chunk_path(chunk, root)):
+        return list(u.SPECS[chunk[0]]["metrics"])
+    try:
+        with open(missing_path(chunk, root), "r", encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def remove_chunk(chunk: Chunk, root: str = CHECKPOINT_DIR):
+    for path in (chunk_path(chunk, root), missing_path(chunk, root)):
+        if os.path.exists(path):
+            os.remove(path)
+
+def fetch_chunk(chunk: Chunk, root: str = CHECKPOINT_DIR) -> int:
+    """
+    Fetch, validate and checkpoint the metrics a chunk still needs (missing_metrics); returns its
+    row count. Raises after checkpointing what came back when some metrics failed.
+    """
+    key, lo, hi = chunk
+    spec = u.SPECS[key]
+    wanted = missing_metrics(chunk, root)
+    with metrics.stage("backfill", spec["source"], key) as st:
+        raw, failed = RANGE_FETCHERS.get(spec["loader"], _whole_history)(spec, lo, hi, wanted)
+        if isinstance(raw, Exception):
+            raise raw
+        df, rejected = canonical(raw, [m for m in wanted if m in raw.columns], start=lo, end=hi)
+        for metric, counts in rejected.items():
+            print(f"[WARN] {key}.{metric} {lo}..{hi} rejected: " + ", ".join(f"{k}={n}" for k, n in counts.items()))
+        path = chunk_path(chunk, root)
+        if os.path.exists(path):
+            # resuming a partial checkpoint: add the newly fetched metrics to the stored ones
+            stored = pd.read_csv(path, parse_dates=["date"])
+            df = stored.drop(columns=[m for m in df.columns if m != "date" and m in stored.columns]) \
+                .merge(df, on="date", how="outer", sort=True)
+            df = df[["date"] + [m for m in spec["metrics"] if m in df.columns]]
+        missing = [m for m in wanted if m in failed]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if missing:
+            # listed before the data lands, so a crash in between cannot leave a partial chunk looking complete
+            with open(missing_path(chunk, root), "w", encoding="utf-8") as f:
+                f.write("\n".join(missing) + "\n")
+        tmp = path + ".tmp"
+        df.to_csv(tmp, index=False, date_format="%Y-%m-%d", float_format="%.7g")
+        os.replace(tmp, path)
+        st.rows = len(df)
+        if missing:
+            raise RuntimeError("metrics failed, rerun to fetch them: "
+                               + "; ".join(f"{m}: {failed[m]}" for m in missing))
+        if os.path.exists(missing_path(chunk, root)):
+            os.remove(missing_path(chunk, root))
+    return len(df)
+
+def run_chunks(chunks: List[Chunk], root: str = CHECKPOINT_DIR, workers: int = 4,
+               per_source: int = 2) -> Dict[str, List[str]]:
+    """Fetch the chunks not (fully) checkpointed yet; returns key -> errors of its failed chunks."""
+    todo = [c for c in chunks if missing_metrics(c, root)]
+    print(f"Backfill: {len(chunks)} chunks, {len(chunks) - len(todo)} already checkpointed, {len(todo)} to fetch")
+    gates: Dict[str, threading.BoundedSemaphore] = {}
+    for key, _, _ in todo:
+        gates.setdefault(u.SPECS[key]["source"], threading.BoundedSemaphore(per_source))
+
+    def task(chunk: Chunk) -> int:
+        with gates[u.SPECS[chunk[0]]["source"]]:
+            return fetch_chunk(chunk, root)
+
+    errors: Dict[str, List[str]] = {}
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill") as pool:
+        futures = {pool.submit(task, c): c for c in todo}
+        for fut in as_completed(futures):
+            key, lo, hi = futures[fut]
+            done += 1
+            try:
+                rows = fut.result()
+                print(f"[{done}/{len(todo)}] {key} {lo}..{hi}: rows={rows}")
+            except Exception as e:
+                errors.setdefault(key, []).append(f"{lo}..{hi}: {type(e).__name__}: {e}")
+                print(f"[{done}/{len(todo)}] [WARN] {key} {lo}..{hi} failed: {e}")
+    return errors
+
+def load_chunks(key: str, chunks: List[Chunk], root: str = CHECKPOINT_DIR) -> pd.DataFrame:
+    """
+    One canonical frame from a key's checkpointed chunks. Chunks are concatenated in date order, so
+    for a date present in two chunks canonical keeps the later chunk's value unless it is NaN.
+    """
+    parts = [pd.read_csv(chunk_path(c, root)) for c in sorted(chunks, key=lambda c: c[1])]
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        return pd.DataFrame({"date": []})
+    frame = pd.concat(parts, ignore_index=True)
+    return canonical(frame, [c for c in frame.columns if c != "date"])[0]
+
+def merge(frames: Dict[str, pd.DataFrame], store: WideStore) -> int:
+    """Overlay the backfilled frames on the wide store and upsert them into the indexed store."""
+    for key, df in frames.items():
+        store.merge(key, df)
+    store.flush()
+    store.trim(u.HISTORY_YEARS)
+    store.save()
+    upserted = 0
+    with TimeSeriesDB() as db:
+        for key, df in frames.items():
+            if not len(df):
+                continue
+            wide = pd.DataFrame({column(key, m): widen(df[m].to_numpy()) for m in df.columns if m != "date"},
+                                index=pd.DatetimeIndex(df["date"], name="date"))
+            upserted += db.upsert_frame(wide)
+    return upserted
+
+def main(keys: Optional[List[str]] = None, start: Optional[dt.date] = None, end: Optional[dt.date] = None,
+         years: Optional[int] = None, chunk_years: Optional[int] = None, workers: Optional[int] = None,
+         fresh: bool = False, keep_chunks: bool = False) -> int:
+    keys = [k for k in u.ALL_KEYS if k in keys] if keys else u.ALL_KEYS
+    # default bounds are whole calendar years, so a backfill resumed on a later day (up to the
+    # year end) plans the same chunks and finds its checkpoints
+    today = dt.date.today()
+    end = end or dt.date(today.year, 12, 31)
+    start = start or dt.date(min(end.year, today.year) - (years or u.HISTORY_YEARS), 1, 1)
+    chunks = plan(keys, start, end, chunk_years or SETTINGS.get("chunk_years", 2))
+    if fresh:
+        for c in chunks:
+            remove_chunk(c)
+    if start < u.history_start().date():
+        print(f"[NOTE] data before {u.history_start().date()} goes to the indexed store only "
+              f"(the wide store keeps history_years={u.HISTORY_YEARS})")
+    u.ensure_dirs()
+    metrics.start_run("backfill")
+    try:
+        errors = run_chunks(chunks, workers=workers or SETTINGS.get("max_workers", 4),
+                            per_source=SETTINGS.get("per_source", 2))
+        frames = {k: load_chunks(k, [c for c in chunks if c[0] == k]) for k in keys if k not in errors}
+        store = WideStore(u.DATA_DIR)
+        with metrics.stage("write", "backfill") as st:
+            st.rows = merge(frames, store)
+        print(f"Merged {', '.join(f'{k}={len(df)}' for k, df in frames.items()) or 'nothing'}; "
+              f"{st.rows} points upserted")
+        if not keep_chunks and not errors:
+            # after a partial failure every checkpoint stays, so the rerun fetches only the failed chunks
+            for c in chunks:
+                remove_chunk(c)
+            for key in keys:
+                try:
+                    os.rmdir(os.path.dirname(chunk_path((key, start, end))))
+                except OSError:
+                    pass
+        if frames:
+            # backfilled rows can land anywhere in the history: rebuild the derived outputs in full
+            with metrics.stage("validate", "series"):
+                u.write_quality(store)
+            try:
+                with metrics.stage("write", "relative"):
+                    u.write_relative(store, incremental=False)
+            except Exception as e:
+                print(f"[WARN] relative valuation failed: {e}")
+            for key in frames:
+                try:
+                    with metrics.stage("write", "analytics", key):
+                        u.update_analytics(key, store.series(key, "pe"), u.DATA_DIR, incremental=False)
+                except Exception as e:
+                    print(f"[WARN] {key} analytics failed: {e}")
+            with metrics.stage("write", "site"):
+                u.build_site(store, list(frames))
+    finally:
+        metrics.finish_run()
+    for key, errs in errors.items():
+        print(f"[WARN] {key}: {len(errs)} chunk(s) failed, rerun to resume: " + "; ".join(errs[:3]))
+    return 1 if errors else 0
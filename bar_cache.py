@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Persistent per-symbol daily OHLCV cache (SQLite) for app.py
+- bars(symbol, date, open, high, low, close, volume), one row per symbol and trading day
+- last_dates() tells the fetcher where each symbol's delta download starts
+- window_extremes() gives the 52-week high/low as a plain windowed max/min over the loaded bars
+"""
+import os
+import sqlite3
+import threading
+import datetime as dt
+from typing import Dict, Iterable, Optional, Tuple
+
+import pandas as pd
+
+DB_PATH = os.getenv("BAR_CACHE_DB", os.path.join(".cache", "bars.sqlite"))
+RETAIN_DAYS = 800
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bars (
+    symbol TEXT NOT NULL,
+    date   TEXT NOT NULL,
+    open   REAL, high REAL, low REAL, close REAL, volume REAL,
+    PRIMARY KEY (symbol, date)
+) WITHOUT ROWID
+"""
+
+class BarCache:
+    def __init__(self, path: str = DB_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(SCHEMA)
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.conn.close()
+
+    def last_dates(self, symbols: Iterable[str]) -> Dict[str, dt.date]:
+        symbols = list(symbols)
+        if not symbols:
+            return {}
+        marks = ",".join("?" * len(symbols))
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT symbol, MAX(date) FROM bars WHERE symbol IN ({marks}) GROUP BY symbol", symbols).fetchall()
+        return {sym: dt.date.fromisoformat(d) for sym, d in rows if d}
+
+    def upsert(self, symbol: str, frame: pd.DataFrame) -> int:
+        """Insert or replace daily bars from a yfinance-style frame (DatetimeIndex, OHLCV columns)."""
+        frame = frame.dropna(subset=["Close"])
+        if frame.empty:
+            return 0
+        dates = pd.DatetimeIndex(frame.index).strftime("%Y-%m-%d")
+        # NaN binds as NULL in SQLite
+        cols = [frame[c].astype("float64") if c in frame.columns else [None] * len(frame)
+                for c in ("Open", "High", "Low", "Close", "Volume")]
+        rows = [(symbol, d, *vals) for d, *vals in zip(dates, *cols)]
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO bars VALUES (?,?,?,?,?,?,?)", rows)
+        return len(rows)
+
+    def load(self, symbol: str, since: Optional[dt.date] = None) -> pd.DataFrame:
+        """Cached bars for `symbol` from `since` (inclusive), as a frame shaped like yfinance history."""
+        sql = "SELECT date, open, high, low, close, volume FROM bars WHERE symbol = ?"
+        args = [symbol]
+        if since is not None:
+            sql += " AND date >= ?"
+            args.append(since.isoformat())
+        with self.lock:
+            rows = self.conn.execute(sql + " ORDER BY date", args).fetchall()
+        frame = pd.DataFrame(rows, columns=["Date", "Open", "High", "Low", "Close", "Volume"])
+        frame.index = pd.to_datetime(frame.pop("Date"))
+        return frame
+
+    def prune(self, keep_days: int = RETAIN_DAYS):
+        cutoff = (dt.date.today() - dt.timedelta(days=keep_days)).isoformat()
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM bars WHERE date < ?", (cutoff,))
+
+def window_extremes(frame: pd.DataFrame, window_days: int = 365) -> Tuple[Optional[float], Optional[float]]:
+    """
+    max(High) / min(Low) of the bars in the `window_days` calendar days up to the last bar
+    (window (last - window_days, last]); None where the window has no value. One vectorized
+    pass over the rows already loaded from the cache.
+    """
+    if frame.empty:
+        return None, None
+    index = pd.DatetimeIndex(frame.index)
+    window = frame[index > index[-1] - pd.Timedelta(days=window_days)]
+    high, low = window["High"].max(), window["Low"].min()
+    return (None if pd.isna(high) else float(high)), (None if pd.isna(low) else float(low))
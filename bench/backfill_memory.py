@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Memory / time benchmark of the loader normalization stage on a deep backfill
+- Replays `--series` synthetic loader outputs of `--years` of business days each (CSIndex shape:
+  ISO date strings, PE / PB / dividend yield), normalizes them and queues them into a WideStore,
+  then flushes the store once, as update_data.main does on a --full run
+- "canonical": the current path (normalize.canonical -> WideStore.merge / flush)
+- "legacy": the chain it replaced, kept here as the reference: date objects from the parser,
+  validation clean (to_numeric / copy / sort / dedupe), last_n_years (copy, to_datetime, sort),
+  rows_after, a merge that copied and re-parsed the dates a third time, and a float64 concat flush
+- Each mode runs in a fresh interpreter so its peak RSS (ru_maxrss) is its own; the report shows
+  RSS after imports, peak RSS, and the time spent normalizing, merging and flushing
+
+Usage (from the repo root):
+  python -m bench.backfill_memory [--years 30] [--series 500] [--modes legacy,canonical] [--out report.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+
+METRICS = ["pe", "pb", "dy"]
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+def _raw_frames(years: int, series: int):
+    """Loader outputs one at a time (date strings shared, values per series), like a source batch."""
+    import numpy as np
+    import pandas as pd
+    end = pd.Timestamp.today().normalize()
+    dates = pd.bdate_range(end - pd.DateOffset(years=years), end).strftime("%Y-%m-%d").to_numpy(dtype=object)
+    for i in range(series):
+        rng = np.random.default_rng(i)
+        pe = np.round(15 + np.cumsum(rng.normal(0, 0.08, len(dates))).clip(-10, None), 2)
+        yield f"S{i}", pd.DataFrame({"date": dates, "pe": pe, "pb": np.round(pe / 9, 2), "dy": np.round(30 / pe, 2)})
+
+# ---------- legacy chain (before normalize.py) ----------
+
+def _legacy_clean(df):
+    import numpy as np
+    import pandas as pd
+    import validation
+    dates = pd.to_datetime(df["date"]).to_numpy()
+    values = df[METRICS].apply(pd.to_numeric, errors="coerce")
+    for m in METRICS:
+        flags = validation.check(dates, values[m].to_numpy(), validation.RULES[m]) & validation.HARD
+        values.loc[flags != 0, m] = np.nan
+    out = values.assign(date=df["date"].to_numpy(), _t=dates)[["date", "_t"] + METRICS]
+    out = out.dropna(subset=METRICS, how="all").sort_values("_t", kind="stable")
+    return out.drop_duplicates("_t", keep="last").drop(columns="_t").reset_index(drop=True)
+
+def _legacy_normalize(df, years: int):
+    import pandas as pd
+    df = df.copy()
+    df["date"] = pd.to_datetime(df["date"]).dt.date  # parser
+    df = df.dropna(subset=["pe"]).sort_values("date")
+    df = _legacy_clean(df)
+    df = df.copy()  # last_n_years
+    df["date"] = pd.to_datetime(df["date"])
+    cutoff = pd.Timestamp.today().normalize() - pd.DateOffset(years=years)
+    return df[df["date"] >= cutoff].sort_values("date")
+
+def _legacy_merge(store, key, df):
+    import pandas as pd
+    from series_store import column
+    part = df.copy()
+    part.index = pd.DatetimeIndex(pd.to_datetime(part.pop("date")), name="date")
+    part = part[~part.index.duplicated(keep="last")].apply(pd.to_numeric, errors="coerce")
+    part.columns = [column(key, m) for m in part.columns]
+    store._pending.append((key, part, True))
+
+def _legacy_flush(store):
+    import pandas as pd
+    pending, store._pending = store._pending, []
+    update = pd.concat([part for _, part, _ in pending], axis=1)
+    update = update.loc[:, ~update.columns.duplicated(keep="last")]
+    store.frame = update.combine_first(store.frame)[list(update.columns)].sort_index()
+
+# ---------- child ----------
+
+def child(mode: str, years: int, series: int, work: str) -> dict:
+    import pandas as pd
+    from normalize import canonical
+    from series_store import WideStore
+    store = WideStore(work)
+    start = pd.Timestamp.today().normalize() - pd.DateOffset(years=years)
+    rss_start = _peak_rss_mb()
+    normalize_s = merge_s = 0.0
+    rows = 0
+    for key, raw in _raw_frames(years, series):
+        t0 = time.perf_counter()
+        if mode == "legacy":
+            df = _legacy_normalize(raw, years)
+        else:
+            df, _ = canonical(raw, METRICS, start=start)
+        t1 = time.perf_counter()
+        if mode == "legacy":
+            _legacy_merge(store, key, df)
+        else:
+            store.merge(key, df, replace=True)
+        merge_s += time.perf_counter() - t1
+        normalize_s += t1 - t0
+        rows += len(df)
+    t0 = time.perf_counter()
+    _legacy_flush(store) if mode == "legacy" else store.flush()
+    flush_s = time.perf_counter() - t0
+    return {
+        "mode": mode,
+        "rows": rows,
+        "store_shape": list(store.frame.shape),
+        "store_mb": round(store.frame.memory_usage(deep=True).sum() / 2**20, 1),
+        "rss_after_imports_mb": round(rss_start, 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "normalize_s": round(normalize_s, 3),
+        "merge_s": round(merge_s, 3),
+        "flush_s": round(flush_s, 3),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Peak RSS / time of loader normalization on a deep backfill")
+    ap.add_argument("--years", type=int, default=30)
+    ap.add_argument("--series", type=int, default=500)
+    ap.add_argument("--modes", default="legacy,canonical")
+    ap.add_argument("--out", help="write the results as JSON")
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        import tempfile
+        with tempfile.TemporaryDirectory(prefix="pe-backfill-") as work:
+            print(json.dumps(child(args.child, args.years, args.series, work)))
+        return 0
+
+    results = []
+    for mode in [m for m in args.modes.split(",") if m]:
+        proc = subprocess.run([sys.executable, "-m", "bench.backfill_memory", "--child", mode,
+                               "--years", str(args.years), "--series", str(args.series)],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(proc.stderr, file=sys.stderr)
+            return proc.returncode
+        res = json.loads(proc.stdout.strip().splitlines()[-1])
+        results.append(res)
+        print(f"{mode:10s} rows={res['rows']} peak_rss={res['peak_rss_mb']:.0f}MB "
+              f"(after imports {res['rss_after_imports_mb']:.0f}MB, store {res['store_mb']:.0f}MB)  "
+              f"normalize={res['normalize_s']:.2f}s merge={res['merge_s']:.2f}s flush={res['flush_s']:.2f}s")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"years": args.years, "series": args.series, "python": platform.python_version(),
+                       "results": results}, f, indent=2)
+        print(f"Wrote {args.out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark harness for the fetch/parse pipelines
+- Replays fixtures for every source through a local stand-in HTTP server
+- Times each loader's fetch, parse, normalize and write stages separately
+- Runs at 1x / 10x / 100x scale, where scale is the number of series replayed per run
+  (each one a full-history fixture behind its own URL, so the HTTP cache never short-circuits)
+- Writes a JSON report; with --baseline, exits non-zero when a stage median regresses
+
+Fixtures live in bench/fixtures/. `--record` captures real responses there (needs network, and
+NASDAQ_API_KEY for Data Link); sources without a recorded file get a synthetic fixture of the
+same shape.
+
+Usage (from the repo root):
+  python -m bench.run_bench [--scales 1,10,100] [--repeat 3] [--out bench_report.json]
+                            [--baseline old_report.json --tolerance 0.25] [--record]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import threading
+import statistics
+import datetime as dt
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+YF_SYMBOL = "^GSPC"
+
+# ---------- Fixtures ----------
+
+def _bdays(years: int) -> pd.DatetimeIndex:
+    end = pd.Timestamp.today().normalize()
+    return pd.bdate_range(end - pd.DateOffset(years=years), end)
+
+def _walk(n: int, start: float, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return np.round(start + np.cumsum(rng.normal(0, 0.08, n)), 2)
+
+def synthetic_datalink() -> bytes:
+    d = _bdays(30)[::-1]  # Data Link returns newest first
+    return pd.DataFrame({"Date": d.strftime("%Y-%m-%d"), "Value": _walk(len(d), 20, 1)}).to_csv(index=False).encode()
+
+def synthetic_csindex() -> bytes:
+    d = _bdays(20)
+    pe = _walk(len(d), 12, 2)
+    df = pd.DataFrame({"日期": d.strftime("%Y-%m-%d"), "指数代码": "000300", "指数中文全称": "沪深300指数",
+                       "市盈率1": pe, "市盈率2": pe * 1.02, "市盈率TTM": pe, "市净率": np.round(pe / 9, 2),
+                       "股息率": np.round(30 / pe, 2)})
+    return df.to_csv(index=False).encode("utf-8")
+
+def synthetic_gurufocus() -> bytes:
+    d = _bdays(20)
+    arr = [[x, float(v)] for x, v in zip(d.strftime("%Y-%m-%d"), _walk(len(d), 10, 3))]
+    filler = "<div class='nav'>" + "<a href='#'>link</a>" * 2000 + "</div>"
+    return f"<html><head><script>var chart = {{\"name\":\"HSI PE\",\"data\": {json.dumps(arr)}}};</script></head><body>{filler}</body></html>".encode()
+
+def synthetic_sina() -> bytes:
+    def table(tid, seed):
+        rng = np.random.default_rng(seed)
+        rows = "".join(f"<tr><td>{y}.{m}</td><td>{rng.normal(1, 1.5):.1f}</td><td>-</td></tr>"
+                       for y in range(2025, 1995, -1) for m in range(12, 0, -1))
+        return f"<table id='{tid}'><tr><th>统计时间</th><th>同比</th><th>环比</th></tr>{rows}</table>"
+    filler = "".join(f"<div class='blk'><span>{i}</span><a href='#'>item</a></div>" for i in range(1000))
+    return f"<html><body>{filler}{table('table_cpi', 4)}{filler}{table('table_ppi', 5)}{filler}</body></html>".encode("utf-8")
+
+def synthetic_yahoo_chart() -> bytes:
+    d = _bdays(1)
+    close = _walk(len(d), 5000, 6) * 10
+    quote = {"open": close.tolist(), "high": (close * 1.01).tolist(), "low": (close * 0.99).tolist(),
+             "close": close.tolist(), "volume": [4_000_000_000] * len(d)}
+    ts = (d.tz_localize("America/New_York").astype("int64") // 10**9).tolist()
+    res = {"meta": {"currency": "USD", "symbol": YF_SYMBOL}, "timestamp": ts, "indicators": {"quote": [quote]}}
+    return json.dumps({"chart": {"result": [res], "error": None}}).encode()
+
+SOURCES = {
+    "datalink": ("datalink.csv", synthetic_datalink),
+    "csindex": ("csindex.csv", synthetic_csindex),
+    "gurufocus": ("gurufocus.html", synthetic_gurufocus),
+    "sina": ("sina_macro.html", synthetic_sina),
+    "yahoo": ("yahoo_chart.json", synthetic_yahoo_chart),
+}
+
+def load_fixtures() -> dict:
+    out = {}
+    for name, (fname, make) in SOURCES.items():
+        path = os.path.join(FIXTURE_DIR, fname)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                out[name] = (f.read(), "recorded")
+        else:
+            out[name] = (make(), "synthetic")
+    return out
+
+def record_fixtures():
+    """Capture real upstream responses into bench/fixtures (best-effort per source)."""
+    import update_data
+    from http_session import cached_get
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+
+    def save(name, data: bytes):
+        with open(os.path.join(FIXTURE_DIR, SOURCES[name][0]), "wb") as f:
+            f.write(data)
+        print(f"recorded {name}: {len(data)} bytes")
+
+    jobs = {
+        "datalink": lambda: cached_get(update_data.DATALINK_URL.format(
+            dataset=update_data.SPECS["SP500"]["datasets"]["pe"][0]),
+            params={"api_key": os.environ["NASDAQ_API_KEY"]}, ttl=0).content,
+        "csindex": lambda: __import__("akshare").stock_zh_index_value_csindex(
+            symbol=update_data.SPECS["CSI300"]["code"]).to_csv(index=False).encode("utf-8"),
+        "gurufocus": lambda: cached_get(next(f["pages"]["pe"] for f in update_data.SPECS["HSI"]["feeds"]
+                                            if f["kind"] == "pages"), ttl=0).content,
+        "sina": lambda: cached_get("http://finance.sina.com.cn/mac/", ttl=0).content,
+        "yahoo": lambda: cached_get(f"https://query1.finance.yahoo.com/v8/finance/chart/{YF_SYMBOL}",
+                                    params={"range": "1y", "interval": "1d"}, ttl=0).content,
+    }
+    for name, job in jobs.items():
+        try:
+            save(name, job())
+        except Exception as e:
+            print(f"[WARN] could not record {name}: {e}")
+
+# ---------- Stand-in server ----------
+
+class FixtureServer:
+    """Serves fixture bytes at /<source>/<anything> on 127.0.0.1."""
+    def __init__(self, fixtures: dict):
+        blobs = {name: data for name, (data, _) in fixtures.items()}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                name = self.path.strip("/").split("/", 1)[0]
+                body = blobs.get(name)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+
+# ---------- Targets ----------
+
+class Timer:
+    def __init__(self):
+        self.stages = {}
+
+    def __call__(self, stage: str, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        out = fn(*args, **kwargs)
+        self.stages[stage] = self.stages.get(stage, 0.0) + time.perf_counter() - t0
+        return out
+
+def _urls(base: str, source: str, scale: int, run: int) -> list:
+    return [f"{base}/{source}/{run}/{i}" for i in range(scale)]
+
+def _save_store(t: Timer, store):
+    """Apply the queued series to the wide store in one pass and write it (the pipeline's write step)."""
+    t("write", lambda: (store.flush(), store.save()))
+
+def bench_datalink(base, scale, run, out_dir):
+    import update_data as u
+    t, rows, nbytes, store = Timer(), 0, 0, u.WideStore(out_dir)
+    for i, url in enumerate(_urls(base, "datalink", scale, run)):
+        r = t("fetch", u.http_get, url)
+        nbytes += len(r.content)
+        df = t("parse", u.parse_datalink_csv, r.text)
+        df = t("normalize", lambda d: u.canonical(d, ["pe"], start=u.history_start(10))[0], df)
+        t("write", store.merge, f"DL{i}", df)
+        rows += len(df)
+    _save_store(t, store)
+    return t.stages, rows, nbytes
+
+def bench_csindex(base, scale, run, out_dir):
+    import io
+    import update_data as u
+    t, rows, nbytes, store = Timer(), 0, 0, u.WideStore(out_dir)
+    for i, url in enumerate(_urls(base, "csindex", scale, run)):
+        r = t("fetch", u.http_get, url)
+        nbytes += len(r.content)
+        raw = t("parse", pd.read_csv, io.BytesIO(r.content))
+        df = t("normalize", lambda d: u.canonical(u.normalize_csindex(d), ["pe", "pb", "dy"],
+                                                  start=u.history_start(10))[0], raw)
+        t("write", store.merge, f"CSI{i}", df)
+        rows += len(df)
+    _save_store(t, store)
+    return t.stages, rows, nbytes
+
+def bench_gurufocus(base, scale, run, out_dir):
+    import update_data as u
+    t, rows, nbytes, store = Timer(), 0, 0, u.WideStore(out_dir)
+    for i, url in enumerate(_urls(base, "gurufocus", scale, run)):
+        r = t("fetch", u.http_get, url)
+        nbytes += len(r.content)
+        df = t("parse", u.parse_gurufocus_data, r.text)
+        df = t("normalize", lambda d: u.canonical(d, ["pe"], start=u.history_start(10))[0], df)
+        t("write", store.merge, f"HSI{i}", df)
+        rows += len(df)
+    _save_store(t, store)
+    return t.stages, rows, nbytes
+
+def bench_sina(base, scale, run, out_dir):
+    import contextlib
+    import goods
+    from http_session import cached_get
+    t, rows, nbytes = Timer(), 0, 0
+    for i, url in enumerate(_urls(base, "sina", scale, run)):
+        r = t("fetch", cached_get, url, ttl=0)
+        r.encoding = "utf-8"
+        nbytes += len(r.content)
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            data = t("parse", lambda: {ind: goods.parse_indicator_table(r.text, f"table_{ind.lower()}", ind)
+                                      for ind in ("CPI", "PPI")})
+        path = os.path.join(out_dir, f"goods{i}.json")
+        t("write", lambda: json.dump(data, open(path, "w", encoding="utf-8"), ensure_ascii=False, indent=2))
+        rows += sum(len(v or []) for v in data.values())
+    return t.stages, rows, nbytes
+
+def _chart_frame(js: dict) -> pd.DataFrame:
+    """Yahoo chart API JSON -> OHLCV frame, the same shape yfinance hands to app.summarize_history."""
+    res = js["chart"]["result"][0]
+    q = res["indicators"]["quote"][0]
+    idx = pd.to_datetime(res["timestamp"], unit="s")
+    return pd.DataFrame({"Open": q["open"], "High": q["high"], "Low": q["low"],
+                         "Close": q["close"], "Volume": q["volume"]}, index=idx)
+
+def bench_yahoo(base, scale, run, out_dir):
+    import app
+    from http_session import cached_get
+    t, rows, nbytes = Timer(), 0, 0
+    results = {}
+    for i, url in enumerate(_urls(base, "yahoo", scale, run)):
+        r = t("fetch", cached_get, url, ttl=0)
+        nbytes += len(r.content)
+        frame = t("parse", lambda: _chart_frame(r.json()))
+        results[f"S{i}"] = t("normalize", app.summarize_history, frame, f"S{i}", "USD")
+        rows += len(frame)
+    path = os.path.join(out_dir, "data.json")
+    t("write", lambda: json.dump(results, open(path, "w", encoding="utf-8"), ensure_ascii=False, indent=2, default=float))
+    return t.stages, rows, nbytes
+
+TARGETS = {
+    "sp500_datalink": ("datalink", bench_datalink),
+    "csi300_csindex": ("csindex", bench_csindex),
+    "hsi_gurufocus": ("gurufocus", bench_gurufocus),
+    "macro_sina": ("sina", bench_sina),
+    "quotes_yahoo": ("yahoo", bench_yahoo),
+}
+
+# ---------- Runner ----------
+
+def run(scales, repeat, only=None) -> dict:
+    fixtures = load_fixtures()
+    server = FixtureServer(fixtures)
+    import ratelimit
+    # The stand-in server is local; politeness limits would only measure sleep time
+    ratelimit.HOST_LIMITS[server.base.split("://", 1)[1]] = (1e9, 1e9)
+    work = tempfile.mkdtemp(prefix="pe-bench-")
+    import http_session
+    http_session.CACHE_DIR = os.path.join(work, "http-cache")
+    report = {
+        "generated_at": dt.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "scales": scales,
+        "repeat": repeat,
+        "fixtures": {name: {"kind": kind, "bytes": len(data)} for name, (data, kind) in fixtures.items()},
+        "results": {},
+    }
+    run_id = 0
+    try:
+        for target, (source, fn) in TARGETS.items():
+            if only and target not in only:
+                continue
+            per_scale = {}
+            for scale in scales:
+                samples, rows, nbytes = {}, 0, 0
+                try:
+                    for _ in range(repeat):
+                        run_id += 1
+                        out_dir = os.path.join(work, f"{target}-{run_id}")
+                        os.makedirs(out_dir)
+                        with open(os.devnull, "w") as devnull:
+                            stdout, sys.stdout = sys.stdout, devnull
+                            try:
+                                stages, rows, nbytes = fn(server.base, scale, run_id, out_dir)
+                            finally:
+                                sys.stdout = stdout
+                        for stage, secs in stages.items():
+                            samples.setdefault(stage, []).append(secs)
+                        shutil.rmtree(out_dir, ignore_errors=True)
+                except ImportError as e:
+                    per_scale = {"skipped": f"missing dependency: {e.name}"}
+                    break
+                per_scale[str(scale)] = {
+                    "rows": rows,
+                    "bytes": nbytes,
+                    "stages": {s: {"median_s": round(statistics.median(v), 6), "min_s": round(min(v), 6)}
+                               for s, v in samples.items()},
+                    "total_median_s": round(sum(statistics.median(v) for v in samples.values()), 6),
+                }
+                print(f"{target:16s} x{scale:<4d} " + "  ".join(
+                    f"{s}={v['median_s'] * 1000:.1f}ms" for s, v in per_scale[str(scale)]["stages"].items()))
+            if "skipped" in per_scale:
+                print(f"{target:16s} skipped ({per_scale['skipped']})")
+            report["results"][target] = per_scale
+    finally:
+        server.close()
+        shutil.rmtree(work, ignore_errors=True)
+    return report
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Stage medians slower than baseline by more than `tolerance` (fractional)."""
+    regressions = []
+    for target, scales in report["results"].items():
+        for scale, res in scales.items():
+            if not isinstance(res, dict):
+                continue
+            old = baseline.get("results", {}).get(target, {}).get(scale)
+            if not isinstance(old, dict):
+                continue
+            for stage, cur in res["stages"].items():
+                prev = old.get("stages", {}).get(stage)
+                if prev and prev["median_s"] > 0 and cur["median_s"] > prev["median_s"] * (1 + tolerance):
+                    regressions.append(f"{target} x{scale} {stage}: {prev['median_s'] * 1000:.1f}ms -> {cur['median_s'] * 1000:.1f}ms")
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark fetch/parse/normalize/write stages against replayed fixtures")
+    ap.add_argument("--scales", default="1,10,100", help="comma-separated series counts per run")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--only", default="", help=f"comma-separated subset of: {','.join(TARGETS)}")
+    ap.add_argument("--out", default="bench_report.json")
+    ap.add_argument("--baseline", help="previous report to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed fractional slowdown per stage")
+    ap.add_argument("--record", action="store_true", help="record real upstream responses into bench/fixtures and exit")
+    args = ap.parse_args()
+
+    if args.record:
+        record_fixtures()
+        return 0
+    scales = [int(s) for s in args.scales.split(",") if s]
+    only = {s for s in args.only.split(",") if s}
+    report = run(scales, args.repeat, only)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Wrote {args.out}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"[REGRESSION] {line}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
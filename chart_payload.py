@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Ready-to-plot chart payload for the PE dashboard
+- Merges every series onto one sorted date index (computed once here, not in the browser)
+- Builds zoom levels: level 0 is the full range LTTB-downsampled to ~TILE_POINTS points;
+  each deeper level halves the tile span, until a tile holds raw daily points
+
+Layout under <data_dir>/chart:
+  index.json           {"series": [{key, name}], "levels": [{"tile_days", "tiles": [{file, start, end}]}]}
+  L<level>_<tile>.json {"start", "end", "dates": [...], "series": {KEY: [value|null, ...]}}
+"""
+import os
+import json
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+TILE_POINTS = 800
+MAX_LEVELS = 8
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling. Returns the indices of the kept points
+    (first and last always kept). x must be increasing.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nxt_lo, nxt_hi = edges[i + 1], (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x = x[nxt_lo:nxt_hi].mean()
+        avg_y = y[nxt_lo:nxt_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+def align(frames: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """Outer-join date,pe frames on one sorted date index; columns are the series keys."""
+    cols = {}
+    for key, df in frames.items():
+        if df is None or df.empty:
+            continue
+        s = pd.Series(df["pe"].to_numpy(dtype="float64"), index=pd.to_datetime(df["date"]))
+        cols[key] = s[~s.index.duplicated(keep="last")]
+    if not cols:
+        return pd.DataFrame()
+    return pd.DataFrame(cols).sort_index()
+
+def _tile(wide: pd.DataFrame, n_out: int) -> dict:
+    """Downsample each column of `wide` independently and keep the union of chosen dates."""
+    x = wide.index.values.astype("datetime64[D]").astype(np.int64).astype(np.float64)
+    picked = np.zeros(len(wide), dtype=bool)
+    for key in wide.columns:
+        y = wide[key].to_numpy()
+        pos = np.flatnonzero(~np.isnan(y))
+        if len(pos):
+            picked[pos[lttb(x[pos], y[pos], n_out)]] = True
+    sub = wide[picked]
+    return {
+        "start": wide.index[0].strftime("%Y-%m-%d"),
+        "end": wide.index[-1].strftime("%Y-%m-%d"),
+        "dates": sub.index.strftime("%Y-%m-%d").tolist(),
+        "series": {k: [None if np.isnan(v) else round(float(v), 2) for v in sub[k].to_numpy()] for k in sub.columns},
+    }
+
+def build_chart_payload(frames: Dict[str, pd.DataFrame], labels: Dict[str, str], out_dir: str) -> dict:
+    """Write index.json plus one JSON per (level, tile) under out_dir; returns the index."""
+    os.makedirs(out_dir, exist_ok=True)
+    wide = align(frames)
+    index = {"series": [{"key": k, "name": labels.get(k, k)} for k in wide.columns], "levels": []}
+    if wide.empty:
+        _write_json(os.path.join(out_dir, "index.json"), index)
+        return index
+    first, last = wide.index[0], wide.index[-1]
+    span_days = max(1, (last - first).days + 1)
+    for level in range(MAX_LEVELS):
+        n_tiles = 2 ** level
+        tile_days = int(np.ceil(span_days / n_tiles))
+        tiles: List[dict] = []
+        for t in range(n_tiles):
+            lo = first + pd.Timedelta(days=t * tile_days)
+            hi = lo + pd.Timedelta(days=tile_days)
+            part = wide[(wide.index >= lo) & (wide.index < hi)]
+            if part.empty:
+                continue
+            tile = _tile(part, TILE_POINTS)
+            name = f"L{level}_{t}.json"
+            _write_json(os.path.join(out_dir, name), tile)
+            tiles.append({"file": name, "start": tile["start"], "end": tile["end"]})
+        index["levels"].append({"tile_days": tile_days, "tiles": tiles})
+        # Stop once every tile already carries its raw daily points
+        if all(len(wide[(wide.index >= t["start"]) & (wide.index <= t["end"])]) <= TILE_POINTS for t in tiles):
+            break
+    _write_json(os.path.join(out_dir, "index.json"), index)
+    return index
+
+def _write_json(path: str, obj):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
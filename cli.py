@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Command-line entry point for the updaters
+  python cli.py pe [--full] [--keys SP500,CSI300]   valuation series (update_data.py)
+  python cli.py quotes                               index quotes -> data.json (app.py)
+  python cli.py quotes --intraday [--interval 15]    keep polling open markets (intraday.py)
+        [--budget 120] [--concurrency 8]             within a per-minute request budget
+  python cli.py backfill [--keys K1,K2] [--years N]   deep history in resumable chunks (backfill.py)
+        [--start D] [--end D] [--chunk-years 2]      rerun after an interruption to resume
+        [--workers 4] [--fresh] [--keep-chunks]
+  python cli.py macro                                CPI / PPI -> goods.json (goods.py)
+  python cli.py site                                 rebuild site/ from the stored series, no fetching
+  python cli.py status [--json] [--max-age-hours N]  artifact freshness, last failures, feed health
+  python cli.py query SERIES [--start D] [--end D]   one slice of the indexed store (tsdb.py) as CSV;
+        [--asof D] [--resample W|M|Q|Y --how last]   --asof prints the latest value on or before D
+  python cli.py query --list [PREFIX]                series names in the store
+  python cli.py --startup-report <command> ...       re-run <command> under -X importtime and
+                                                     summarize where startup time goes
+
+Only the standard library is imported up front. Each command imports its pipeline (and with it
+pandas / requests / yfinance) when it runs, so status and health checks start in milliseconds.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime as dt
+
+REPORT_TOP = 15
+
+def cmd_pe(args) -> int:
+    import update_data
+    keys = [k for k in args.keys.split(",") if k] if args.keys else None
+    update_data.main(incremental=not args.full, keys=keys)
+    return 0
+
+def cmd_quotes(args) -> int:
+    if args.intraday:
+        import intraday
+        intraday.main(interval=args.interval, budget=args.budget, concurrency=args.concurrency)
+        return 0
+    import app
+    app.main()
+    return 0
+
+def cmd_backfill(args) -> int:
+    import backfill
+    keys = [k for k in args.keys.split(",") if k] if args.keys else None
+    day = lambda s: dt.date.fromisoformat(s) if s else None
+    return backfill.main(keys=keys, start=day(args.start), end=day(args.end), years=args.years,
+                         chunk_years=args.chunk_years, workers=args.workers, fresh=args.fresh,
+                         keep_chunks=args.keep_chunks)
+
+def cmd_macro(args) -> int:
+    import goods
+    goods.main()
+    return 0
+
+def cmd_site(args) -> int:
+    import update_data
+    update_data.build_site()
+    return 0
+
+def cmd_query(args) -> int:
+    from tsdb import TimeSeriesDB
+    with TimeSeriesDB() as db:
+        if args.list:
+            for name, last in sorted(db.last_dates(args.series or "").items()):
+                print(f"{name},{last}")
+            return 0
+        if not args.series:
+            print("query: SERIES is required (or --list)", file=sys.stderr)
+            return 2
+        if args.asof:
+            hit = db.asof(args.series, args.asof)
+            print(f"{hit[0]},{hit[1]:g}" if hit else "")
+            return 0 if hit else 1
+        if args.resample:
+            s = db.resample(args.series, args.resample, args.how, args.start, args.end)
+        else:
+            s = db.range(args.series, args.start, args.end)
+    print(f"date,{args.series}")
+    for day, value in s.items():
+        print(f"{day:%Y-%m-%d},{value:g}")
+    return 0
+
+def _last_csv_date(path: str):
+    """First field of the last line of a date-sorted CSV, read from the file tail only."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 4096))
+        lines = [l for l in f.read().splitlines() if l.strip()]
+    return lines[-1].split(b",", 1)[0].decode("utf-8", "ignore") if len(lines) > 1 else None
+
+def _read_json(path: str):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def collect_status() -> dict:
+    from sources import load_config
+    config = load_config()
+    data_dir = config["output"]["data_dir"]
+    site_dir = config["output"]["site_dir"]
+    now = time.time()
+    artifacts = {}
+    for name, path in (("series", os.path.join(data_dir, "series.csv")), ("quotes", "data.json"),
+                       ("macro", "goods.json"), ("site", os.path.join(site_dir, "index.html"))):
+        if not os.path.exists(path):
+            artifacts[name] = {"path": path, "exists": False}
+            continue
+        info = {"path": path, "exists": True, "age_hours": round((now - os.path.getmtime(path)) / 3600, 2)}
+        if name == "series":
+            info["last_date"] = _last_csv_date(path)
+        elif name in ("quotes", "macro"):
+            info["last_updated"] = (_read_json(path) or {}).get("last_updated")
+        artifacts[name] = info
+    site_status = _read_json(os.path.join(site_dir, "status.json")) or {}
+    schedule = config.get("schedule", {})
+    feeds = _read_json(config.get("hedge", {}).get("state_path", os.path.join(".cache", "source_health.json"))) or {}
+    return {
+        "checked_at": dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "artifacts": artifacts,
+        "pe_failures": site_status.get("failures", []),
+        "schedule": _read_json(schedule.get("state_path", os.path.join(".cache", "schedule.json"))) or {},
+        "feeds": feeds,
+    }
+
+def cmd_status(args) -> int:
+    status = collect_status()
+    unhealthy = [name for name, a in status["artifacts"].items()
+                 if not a["exists"] or (args.max_age_hours is not None and a["age_hours"] > args.max_age_hours)]
+    if args.json:
+        print(json.dumps(dict(status, unhealthy=unhealthy), ensure_ascii=False, indent=2))
+    else:
+        for name, a in status["artifacts"].items():
+            if not a["exists"]:
+                print(f"{name:7s} missing ({a['path']})")
+                continue
+            extra = a.get("last_date") or a.get("last_updated") or ""
+            print(f"{name:7s} {a['age_hours']:8.2f}h old  {extra}")
+        for key, err in status["pe_failures"]:
+            print(f"[WARN] pe {key}: {err}")
+        for job, done in sorted(status["schedule"].items()):
+            print(f"schedule {job}: " + ", ".join(f"{n}={d}" for n, d in sorted(done.items())))
+        for name, h in sorted(status["feeds"].items()):
+            state = "OPEN" if h.get("open_until", 0) > time.time() else "ok"
+            print(f"feed {name}: {state} success={h['success']:.2f} latency={h['latency']:.2f}s"
+                  + (f"  last_error={h['last_error']}" if h.get("last_error") else ""))
+    return 1 if unhealthy else 0
+
+def startup_report(argv) -> int:
+    """Re-run `argv` under `python -X importtime` and print the slowest top-level imports."""
+    import subprocess
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", os.path.abspath(__file__), *argv],
+                          stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - t0
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            print(line, file=sys.stderr)
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            continue  # column header
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), self_us, cumulative_us, depth))
+    top = sorted((r for r in rows if r[3] == 0), key=lambda r: -r[2])
+    total_ms = sum(r[2] for r in top) / 1000
+    print(f"\n=== startup report: {' '.join(argv) or '(no command)'} ===")
+    print(f"wall {wall * 1000:.0f} ms (incl. interpreter start), imports {total_ms:.0f} ms in {len(rows)} modules")
+    for name, self_us, cumulative_us, _ in top[:REPORT_TOP]:
+        print(f"{cumulative_us / 1000:9.1f} ms  {name}")
+    return proc.returncode
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(description="PE / quotes / macro updaters")
+    ap.add_argument("--startup-report", action="store_true",
+                    help="run the command under -X importtime and summarize import cost")
+    sub = ap.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("pe", help="refresh valuation series (update_data.py)")
+    p.add_argument("--full", action="store_true", help="re-download full history instead of appending")
+    p.add_argument("--keys", default="", help="comma-separated index keys (default: all registered)")
+    p.set_defaults(func=cmd_pe)
+    p = sub.add_parser("quotes", help="refresh index quotes (app.py)")
+    p.add_argument("--intraday", action="store_true", help="poll latest prices until interrupted")
+    p.add_argument("--interval", type=float, default=15.0, help="seconds between polls of one symbol")
+    p.add_argument("--budget", type=float, default=120.0, help="max requests per minute")
+    p.add_argument("--concurrency", type=int, default=8, help="max requests in flight")
+    p.set_defaults(func=cmd_quotes)
+    p = sub.add_parser("backfill", help="fetch deep history in parallel, checkpointed chunks (backfill.py)")
+    p.add_argument("--keys", default="", help="comma-separated index keys (default: all registered)")
+    p.add_argument("--years", type=int, help="calendar years of history before this one (default: history_years)")
+    p.add_argument("--start", help="first day (overrides --years)")
+    p.add_argument("--end", help="last day (default: end of the current year)")
+    p.add_argument("--chunk-years", type=int, help="calendar years per chunk (config backfill.chunk_years)")
+    p.add_argument("--workers", type=int, help="chunks fetched in parallel (config backfill.max_workers)")
+    p.add_argument("--fresh", action="store_true", help="discard checkpoints of an earlier run")
+    p.add_argument("--keep-chunks", action="store_true", help="keep checkpoints after merging")
+    p.set_defaults(func=cmd_backfill)
+    sub.add_parser("macro", help="refresh CPI / PPI (goods.py)").set_defaults(func=cmd_macro)
+    sub.add_parser("site", help="rebuild site/ from stored series without fetching").set_defaults(func=cmd_site)
+    p = sub.add_parser("status", help="artifact freshness and last failures (no heavy imports)")
+    p.add_argument("--json", action="store_true")
+    p.add_argument("--max-age-hours", type=float, help="exit 1 when an artifact is older than this")
+    p.set_defaults(func=cmd_status)
+    p = sub.add_parser("query", help="read one series slice from the indexed store (tsdb.py)")
+    p.add_argument("series", nargs="?", help='e.g. CSI300.pe, "quotes.沪深300.close", macro.CPI')
+    p.add_argument("--list", action="store_true", help="list series names (SERIES is a prefix)")
+    p.add_argument("--start")
+    p.add_argument("--end")
+    p.add_argument("--asof", help="latest value on or before this date")
+    p.add_argument("--resample", choices=["W", "M", "Q", "Y"])
+    p.add_argument("--how", default="last", choices=["last", "first", "mean", "min", "max"])
+    p.set_defaults(func=cmd_query)
+    return ap
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if "--startup-report" in argv:
+        return startup_report([a for a in argv if a != "--startup-report"])
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
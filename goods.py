@@ -1,131 +1,231 @@
-import requests
-from bs4 import BeautifulSoup
+import os
 import json
+import codecs
 from datetime import datetime
-import time
+from html.parser import HTMLParser
+from urllib.parse import urldefrag
+from dataclasses import replace
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import numpy as np
+import pandas as pd
 
-def fetch_cpi_data():
+import metrics
+import validation
+from http_session import stream_get
+from tsdb import TimeSeriesDB, month_start
+from publish import publish_file
+
+SINA_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
+    "Referer": "http://finance.sina.com.cn/"
+}
+
+# 新浪宏观页面每月更新，缓存 6 小时内直接复用，过期后用 ETag/Last-Modified 条件请求
+MACRO_CACHE_TTL = 6 * 3600
+
+# 宏观指标注册表：新增 PMI、M2、社融等指标只需在此登记一项
+# url 的 #片段 不会发送到服务器，同一页面上的多个表格只请求并解析一次
+MACRO_INDICATORS = {
+    "CPI": {
+        "url": "http://finance.sina.com.cn/mac/#price-0-0-31-2",
+        "table_id": "table_cpi",
+        "period_col": 0,
+        "value_col": 1,
+        "unit": "%",
+        "valid_range": (-10, 10),  # CPI和PPI通常不会出现极端波动
+    },
+    "PPI": {
+        "url": "http://finance.sina.com.cn/mac/#invest_4",
+        "table_id": "table_ppi",
+        "period_col": 0,
+        "value_col": 1,
+        "unit": "%",
+        "valid_range": (-10, 10),
+    },
+}
+
+
+class TableLexer(HTMLParser):
     """
-    从新浪财经获取CPI数据
+    增量表格词法解析器：逐块 feed 页面内容，只收集目标 id 表格中各行的 td 文本，
+    所有目标表格闭合后 done 为 True，调用方即可停止读取响应
     """
-    try:
-        url = "http://finance.sina.com.cn/mac/#price-0-0-31-2"
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
-            "Referer": "http://finance.sina.com.cn/"
-        }
-        response = requests.get(url, headers=headers)
-        response.encoding = "utf-8"
-        if response.status_code != 200:
-            print(f"警告: CPI数据请求失败，状态码: {response.status_code}")
-            return create_error_data("CPI", f"请求失败，状态码: {response.status_code}")
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        cpi_table = soup.find("table", attrs={"id": "table_cpi"})
-        if not cpi_table:
-            print("警告: 未找到CPI数据表格")
-            return create_error_data("CPI", "未找到数据表格")
-        
-        cpi_data = []
-        rows = cpi_table.find_all('tr')
-        for index, row in enumerate(rows):
-            if index == 0:  # 跳过表头
-                continue
-            cols = row.find_all('td')
-            period = cols[0].text.strip()
-            value = cols[1].text.strip()
-            if validate_economic_data(value, "CPI", period):
-                cpi_data.append({
-                    "period": period,
-                    "value": float(value) if value else None,
-                    "unit": "%"
-                })
-        
-        if not cpi_data:
-            print("警告: 未解析到有效CPI数据")
-            return create_error_data("CPI", "未解析到有效数据")
-        
-        return {
-            "data": cpi_data,
-            "data_quality": "good"
-        }
-    except Exception as e:
-        print(f"获取CPI数据失败: {e}")
-        return create_error_data("CPI", str(e))
 
+    def __init__(self, table_ids):
+        super().__init__(convert_charrefs=True)
+        self.pending = set(table_ids)
+        self.tables = {}
+        self._current = None
+        self._nested = 0
+        self._row = None
+        self._cell = None
 
-def fetch_ppi_data():
+    @property
+    def done(self):
+        return not self.pending
+
+    def _close_cell(self):
+        if self._cell is not None:
+            self._row.append("".join(self._cell).strip())
+            self._cell = None
+
+    def _close_row(self):
+        self._close_cell()
+        if self._row is not None:
+            self.tables[self._current].append(self._row)
+            self._row = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "table":
+            if self._current is not None:
+                self._nested += 1
+            elif dict(attrs).get("id") in self.pending:
+                self._current = dict(attrs)["id"]
+                self.tables[self._current] = []
+            return
+        if self._current is None or self._nested:
+            return
+        if tag == "tr":
+            self._close_row()
+            self._row = []
+        elif tag in ("td", "th") and self._row is not None:
+            self._close_cell()
+            # 表头单元格不计入数据列
+            self._cell = [] if tag == "td" else None
+
+    def handle_endtag(self, tag):
+        if self._current is None:
+            return
+        if tag == "table":
+            if self._nested:
+                self._nested -= 1
+                return
+            self._close_row()
+            self.pending.discard(self._current)
+            self._current = None
+        elif self._nested:
+            return
+        elif tag == "td":
+            self._close_cell()
+        elif tag == "tr":
+            self._close_row()
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def extract_tables(chunks, table_ids, encoding="utf-8"):
     """
-    从新浪财经获取PPI数据
+    从字节块流中提取目标表格的行（每行为 td 文本列表），所有目标表格闭合后立即停止读取。
+    返回 {table_id: rows}，页面中不存在的表格不出现在结果里
+    """
+    lexer = TableLexer(table_ids)
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    for chunk in chunks:
+        lexer.feed(decoder.decode(chunk))
+        if lexer.done:
+            break
+    else:
+        lexer.feed(decoder.decode(b"", final=True))
+    if hasattr(chunks, "close"):
+        chunks.close()
+    return lexer.tables
+
+
+def rows_to_data(rows, indicator, spec):
+    """
+    按注册表中的列位置把表格行转换为 [{"period", "value", "unit"}]，
+    数值整列一次性转换并做合理性校验（见 validation.py），空值、格式错误和超出范围的行被剔除
     """
+    width = max(spec["period_col"], spec["value_col"])
+    body = [cols for cols in rows[1:] if len(cols) > width]  # 跳过表头
+    periods = [cols[spec["period_col"]] for cols in body]
+    values = pd.to_numeric(pd.Series([cols[spec["value_col"]] for cols in body], dtype=object),
+                           errors="coerce").to_numpy(dtype="float64")
+    low, high = spec.get("valid_range") or (float("-inf"), float("inf"))
+    mask = validation.check(None, values, replace(validation.RULES["macro"], low=low, high=high))
+    missing = np.isnan(values)
+    if missing.any() or mask.any():
+        print(f"警告: {indicator} 剔除 {int(missing.sum())} 条空值或格式错误、"
+              f"{int(np.count_nonzero(mask))} 条超出范围 {low}~{high} 的数据")
+    return [{"period": period, "value": float(value), "unit": spec["unit"]}
+            for period, value, bad, flags in zip(periods, values, missing, mask) if not bad and not flags]
+
+
+def parse_indicator_table(html, table_id, indicator):
+    """
+    解析页面中 id 为 table_id 的指标表格，返回 [{"period", "value", "unit"}]；未找到表格时返回 None
+    """
+    spec = dict(MACRO_INDICATORS.get(indicator, {}), table_id=table_id)
+    spec.setdefault("period_col", 0)
+    spec.setdefault("value_col", 1)
+    spec.setdefault("unit", "%")
+    rows = extract_tables([html.encode("utf-8")], [table_id]).get(table_id)
+    if rows is None:
+        return None
+    return rows_to_data(rows, indicator, spec)
+
+
+def fetch_indicator_group(url, names):
+    """
+    流式请求一个页面并一次性提取其中多个已登记指标的表格，返回 {指标名: 结果}
+    """
+    specs = {name: MACRO_INDICATORS[name] for name in names}
     try:
-        url = "http://finance.sina.com.cn/mac/#invest_4"
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
-            "Referer": "http://finance.sina.com.cn/"
-        }
-        response = requests.get(url, headers=headers)
-        response.encoding = "utf-8"
-        if response.status_code != 200:
-            print(f"警告: PPI数据请求失败，状态码: {response.status_code}")
-            return create_error_data("PPI", f"请求失败，状态码: {response.status_code}")
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        ppi_table = soup.find("table", attrs={"id": "table_ppi"})
-        if not ppi_table:
-            print("警告: 未找到PPI数据表格")
-            return create_error_data("PPI", "未找到数据表格")
-        
-        ppi_data = []
-        rows = ppi_table.find_all('tr')
-        for index, row in enumerate(rows):
-            if index == 0:  # 跳过表头
-                continue
-            cols = row.find_all('td')
-            period = cols[0].text.strip()
-            value = cols[1].text.strip()
-            if validate_economic_data(value, "PPI", period):
-                ppi_data.append({
-                    "period": period,
-                    "value": float(value) if value else None,
-                    "unit": "%"
-                })
-        
-        if not ppi_data:
-            print("警告: 未解析到有效PPI数据")
-            return create_error_data("PPI", "未解析到有效数据")
-        
-        return {
-            "data": ppi_data,
+        # 流式下载与表格解析交织进行，合计为一个 fetch 阶段
+        with metrics.stage("fetch", "sina", "/".join(names)) as st:
+            chunks = stream_get(url, headers=SINA_HEADERS, ttl=MACRO_CACHE_TTL)
+            tables = extract_tables(chunks, [spec["table_id"] for spec in specs.values()])
+            st.rows = sum(len(rows) for rows in tables.values())
+    except Exception as e:
+        print(f"获取{'/'.join(names)}数据失败: {e}")
+        return {name: create_error_data(name, str(e)) for name in names}
+    
+    results = {}
+    for name, spec in specs.items():
+        rows = tables.get(spec["table_id"])
+        if rows is None:
+            print(f"警告: 未找到{name}数据表格")
+            results[name] = create_error_data(name, "未找到数据表格")
+            continue
+        with metrics.stage("validate", "sina", name) as st:
+            data = rows_to_data(rows, name, spec)
+            st.rows = len(data)
+        if not data:
+            print(f"警告: 未解析到有效{name}数据")
+            results[name] = create_error_data(name, "未解析到有效数据")
+            continue
+        results[name] = {
+            "data": data,
             "data_quality": "good"
         }
-    except Exception as e:
-        print(f"获取PPI数据失败: {e}")
-        return create_error_data("PPI", str(e))
+    return results
 
 
-def validate_economic_data(value, indicator, period):
-    """验证经济数据的合理性"""
-    if not value or value == "-":
-        print(f"警告: {indicator} {period} 数据为空")
-        return False
-    
-    try:
-        value_float = float(value)
-        # CPI和PPI通常不会出现极端波动，设置合理范围
-        if not (-10 <= value_float <= 10):
-            print(f"警告: {indicator} {period} 数据异常: {value}%")
-            return False
-        return True
-    except ValueError:
-        print(f"警告: {indicator} {period} 数据格式错误: {value}")
-        return False
+def fetch_indicator(name):
+    """获取单个已登记指标的数据"""
+    url = urldefrag(MACRO_INDICATORS[name]["url"])[0]
+    return fetch_indicator_group(url, [name])[name]
+
+
+def fetch_cpi_data():
+    """
+    从新浪财经获取CPI数据
+    """
+    return fetch_indicator("CPI")
+
+
+def fetch_ppi_data():
+    """
+    从新浪财经获取PPI数据
+    """
+    return fetch_indicator("PPI")
 
 
 def create_error_data(indicator, error_message):
     """创建错误数据记录"""
-    indicator_name = "CPI" if indicator == "CPI" else "PPI"
     return {
         "data": [],
         "data_quality": "error",
@@ -133,31 +233,64 @@ def create_error_data(indicator, error_message):
     }
 
 
+def store_macro(data):
+    """把各指标按月写入时序库（tsdb.py），序列名 macro.<指标名>，日期取当月1日"""
+    rows = []
+    for name, info in data.items():
+        if name == "last_updated":
+            continue
+        for item in info.get("data", []):
+            day = month_start(item["period"])
+            if day is not None:
+                rows.append((f"macro.{name}", day, item["value"]))
+    with TimeSeriesDB() as db:
+        return db.upsert_rows(rows)
+
+
 def fetch_economic_indicators():
     """
-    获取CPI和PPI经济指标数据
+    获取注册表中全部宏观指标数据；同一页面上的指标合并为一次请求，不同页面并发获取
     """
-    results = {}
-    
-    print("正在获取CPI数据...")
-    cpi_data = fetch_cpi_data()
-    results["CPI"] = cpi_data
-    time.sleep(2)  # 避免请求过于频繁
+    groups = {}
+    for name, spec in MACRO_INDICATORS.items():
+        groups.setdefault(urldefrag(spec["url"])[0], []).append(name)
     
-    print("正在获取PPI数据...")
-    ppi_data = fetch_ppi_data()
-    results["PPI"] = ppi_data
+    # 不同页面并发请求；同一主机的请求频率由 ratelimit 中的令牌桶控制，无需固定 sleep
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(groups)))) as pool:
+        futures = {}
+        for url, names in groups.items():
+            print(f"正在获取{'、'.join(names)}数据...")
+            futures[pool.submit(fetch_indicator_group, url, names)] = names
+        for future in as_completed(futures):
+            results.update(future.result())
     
+    # 保持注册表中的顺序
+    results = {name: results[name] for name in MACRO_INDICATORS}
     results["last_updated"] = datetime.utcnow().isoformat()
     return results
 
 
-if __name__ == "__main__":
+def main():
+    """获取全部宏观指标，写入并发布 goods.json"""
     print("开始获取CPI和PPI经济指标数据...")
-    data = fetch_economic_indicators()
-    
-    with open("goods.json", "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    # 分阶段耗时与请求统计写入 .cache/metrics（见 metrics.py）
+    metrics.start_run("macro")
+    try:
+        data = fetch_economic_indicators()
+        
+        with metrics.stage("write", "goods.json") as st:
+            with open("goods.json", "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            
+            # 发布带内容哈希的副本（assets/ + goods.manifest.json）；与 data.json 的工作流各用一个清单，推送互不冲突
+            publish_file(".", "goods.json", "goods.json", "goods.manifest.json")
+            st.rows = len(data) - 1
+            st.bytes = os.path.getsize("goods.json")
+        with metrics.stage("write", "tsdb") as st:
+            st.rows = store_macro(data)
+    finally:
+        metrics.finish_run()
     
     print("CPI和PPI数据已更新并保存到 goods.json")
     
@@ -179,4 +312,7 @@ if __name__ == "__main__":
                     print(f"✅ {name}: 最新 {latest_data.get('period')} 为 {latest_data.get('value')}%")
                 else:
                     print(f"ℹ️ {name}: 无可用数据")
-    
+
+
+if __name__ == "__main__":
+    main()
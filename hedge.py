@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Hedged requests across alternative feeds of the same series (e.g. HSI: valuation JSON / GuruFocus)
+- race() starts the healthiest feed first and the next one `delay` seconds later, or as soon as a
+  running one fails; delay=0 fires every feed at once. The first valid result wins and
+  slower feeds finish in the background (their outcome still updates health, and the book is saved
+  again once the last of them has finished), so a dead feed costs at most `delay` instead of its
+  whole retry / timeout budget.
+- gather() runs every feed at once and waits for all of them, for indices whose feeds are
+  cross-checked against each other (validation.cross_check) rather than raced
+- HealthBook keeps an EWMA success rate and latency per feed, which orders the candidates. After
+  `failure_threshold` consecutive failures a feed's circuit opens for `cooldown` seconds; once that
+  passes it gets one trial call (half-open) and either closes again or re-opens.
+- Health is persisted to .cache/source_health.json so the ordering and open circuits survive runs.
+"""
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Optional, Tuple
+
+STATE_PATH = os.path.join(".cache", "source_health.json")
+ALPHA = 0.3  # EWMA weight of the newest outcome
+
+class FeedsFailed(RuntimeError):
+    def __init__(self, errors: Dict[str, str]):
+        self.errors = errors
+        super().__init__("all feeds failed: " + "; ".join(f"{k}: {v}" for k, v in errors.items()))
+
+class HealthBook:
+    def __init__(self, path: str = STATE_PATH, failure_threshold: int = 3, cooldown: float = 6 * 3600):
+        self.path = path
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._feeds = None
+        self._lock = threading.Lock()
+
+    def _state(self) -> dict:
+        if self._feeds is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._feeds = json.load(f)
+            except (FileNotFoundError, ValueError):
+                self._feeds = {}
+        return self._feeds
+
+    def get(self, name: str) -> dict:
+        with self._lock:
+            return dict(self._state().get(name) or {"success": 1.0, "latency": 0.0, "failures": 0, "open_until": 0.0})
+
+    def available(self, name: str, now: Optional[float] = None) -> bool:
+        """False while the feed's circuit is open."""
+        return self.get(name)["open_until"] <= (now or time.time())
+
+    def order(self, names: List[str], now: Optional[float] = None) -> List[str]:
+        """Feeds with a closed (or half-open) circuit, best first: success rate, then latency, then config order."""
+        now = now or time.time()
+        ranked = [(n, self.get(n)) for n in names]
+        ready = [(n, h) for n, h in ranked if h["open_until"] <= now]
+        return [n for n, _ in sorted(ready, key=lambda nh: (-round(nh[1]["success"], 2), nh[1]["latency"]))]
+
+    def record(self, name: str, ok: bool, latency: float, error: Optional[str] = None):
+        with self._lock:
+            h = self._state().setdefault(name, {"success": 1.0, "latency": 0.0, "failures": 0, "open_until": 0.0})
+            h["success"] = (1 - ALPHA) * h["success"] + ALPHA * (1.0 if ok else 0.0)
+            h["latency"] = latency if not h["latency"] else (1 - ALPHA) * h["latency"] + ALPHA * latency
+            h["checked_at"] = time.time()
+            if ok:
+                h["failures"] = 0
+                h["open_until"] = 0.0
+                h.pop("last_error", None)
+            else:
+                h["failures"] += 1
+                h["last_error"] = (error or "")[:300]
+                if h["failures"] >= self.failure_threshold:
+                    h["open_until"] = time.time() + self.cooldown
+
+    def save(self):
+        with self._lock:
+            if self._feeds is None:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._feeds, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+
+def _tracked(book: HealthBook, name: str, fn: Callable, valid: Callable):
+    t0 = time.monotonic()
+    try:
+        result = fn()
+        if not valid(result):
+            raise ValueError("invalid result")
+    except Exception as e:
+        book.record(name, False, time.monotonic() - t0, f"{type(e).__name__}: {e}")
+        raise
+    book.record(name, True, time.monotonic() - t0)
+    return result
+
+def _save_when_done(book: HealthBook, futures: list):
+    """Save `book` once every one of `futures` (feeds still running after race returned) has finished."""
+    left = [len(futures)]
+    lock = threading.Lock()
+
+    def settled(_):
+        with lock:
+            left[0] -= 1
+            last = left[0] == 0
+        if last:
+            book.save()
+
+    for fut in futures:
+        fut.add_done_callback(settled)
+
+def gather(candidates: List[Tuple[str, Callable]], book: HealthBook, timeout: float = 60.0,
+           valid: Callable = lambda r: r is not None) -> Dict[str, object]:
+    """
+    Run every available feed of `candidates` at once and wait up to `timeout` seconds for all of
+    them; returns feed name -> valid result, healthiest first (the first entry is the one race()
+    would have preferred). Raises FeedsFailed like race() when no feed succeeds.
+    """
+    fns = dict(candidates)
+    queue = book.order(list(fns))
+    errors = {name: "circuit open" for name in fns if name not in queue}
+    if not queue:
+        raise FeedsFailed(errors)
+    pool = ThreadPoolExecutor(max_workers=len(queue), thread_name_prefix="hedge")
+    futures = {pool.submit(_tracked, book, name, fns[name], valid): name for name in queue}
+    pending = set()
+    try:
+        done, pending = wait(futures, timeout=timeout)
+        results = {}
+        for fut in done:
+            try:
+                results[futures[fut]] = fut.result()
+            except Exception as e:
+                errors[futures[fut]] = f"{type(e).__name__}: {e}"
+        for fut in pending:
+            errors[futures[fut]] = f"timeout after {timeout:g}s"
+        if not results:
+            raise FeedsFailed(errors)
+        return {name: results[name] for name in queue if name in results}
+    finally:
+        if pending:
+            _save_when_done(book, list(pending))
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def race(candidates: List[Tuple[str, Callable]], book: HealthBook, delay: float = 2.0,
+         timeout: float = 60.0, valid: Callable = lambda r: r is not None):
+    """
+    Run `candidates` ([(feed name, no-arg callable)]) as hedged requests; returns (name, result) of
+    the first valid result. Feeds with an open circuit are skipped. Raises FeedsFailed with each
+    feed's error (or "timeout" / "circuit open") when none succeeds within `timeout` seconds.
+    """
+    fns = dict(candidates)
+    queue = book.order(list(fns))
+    errors = {name: "circuit open" for name in fns if name not in queue}
+    if not queue:
+        raise FeedsFailed(errors)
+    pool = ThreadPoolExecutor(max_workers=len(queue), thread_name_prefix="hedge")
+    pending = {}
+    deadline = time.monotonic() + timeout
+
+    def launch():
+        name = queue.pop(0)
+        pending[pool.submit(_tracked, book, name, fns[name], valid)] = name
+
+    try:
+        launch()
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = wait(pending, timeout=min(delay, remaining) if queue else remaining,
+                           return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = pending.pop(fut)
+                try:
+                    return name, fut.result()
+                except Exception as e:
+                    errors[name] = f"{type(e).__name__}: {e}"
+            # no winner yet: the delay passed or a feed failed, so hedge with the next one
+            if queue:
+                launch()
+        for name in pending.values():
+            errors[name] = f"timeout after {timeout:g}s"
+        for name in queue:
+            errors.setdefault(name, "not started")
+        raise FeedsFailed(errors)
+    finally:
+        if pending:
+            # losers record their outcome when they finish; persist it then, not just the winner's
+            _save_when_done(book, list(pending))
+        pool.shutdown(wait=False, cancel_futures=True)
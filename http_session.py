@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Shared HTTP layer for update_data.py, goods.py and app.py
+- One keep-alive requests.Session per host (connection pooling across retries and loaders)
+- Conditional revalidation with If-None-Match / If-Modified-Since
+- On-disk response cache with a TTL under ./.cache/http (override with HTTP_CACHE_DIR)
+- Network requests (not cache hits) pass through the per-host token buckets in ratelimit.py
+- Bytes received and cache hit/miss are reported to the open metrics stage (metrics.py)
+
+Responses served from the cache carry `from_cache=True` (the body is one the caller has
+already seen, so it can skip re-parsing); a 304 revalidation additionally sets `not_modified=True`.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+import metrics
+import ratelimit
+
+CACHE_DIR = os.getenv("HTTP_CACHE_DIR", os.path.join(".cache", "http"))
+DEFAULT_TTL = int(os.getenv("HTTP_CACHE_TTL", "3600"))
+DEFAULT_UA = "PE-Dashboard/1.0 (+https://example.com)"
+
+_SESSIONS = {}
+_LOCK = threading.Lock()
+
+def get_session(host: str) -> requests.Session:
+    """Pooled keep-alive session for `host`, created on first use."""
+    with _LOCK:
+        sess = _SESSIONS.get(host)
+        if sess is None:
+            sess = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=8)
+            sess.mount("http://", adapter)
+            sess.mount("https://", adapter)
+            sess.headers["User-Agent"] = DEFAULT_UA
+            _SESSIONS[host] = sess
+        return sess
+
+def yf_session():
+    """
+    Session to hand to yfinance. Recent yfinance releases only accept curl_cffi sessions,
+    so use one when curl_cffi is installed and fall back to the pooled requests session.
+    """
+    host = "query1.finance.yahoo.com"
+    with _LOCK:
+        if ("curl_cffi", host) in _SESSIONS:
+            return _SESSIONS[("curl_cffi", host)]
+    try:
+        from curl_cffi import requests as curl_requests
+    except ImportError:
+        return get_session(host)
+    with _LOCK:
+        return _SESSIONS.setdefault(("curl_cffi", host), curl_requests.Session(impersonate="chrome"))
+
+def _cache_paths(url: str, params) -> tuple:
+    key = url + "?" + json.dumps(params or {}, sort_keys=True, default=str)
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    base = os.path.join(CACHE_DIR, digest)
+    return base + ".json", base + ".body"
+
+def _load_cached(meta_path: str, body_path: str) -> Optional[tuple]:
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(body_path, "rb") as f:
+            body = f.read()
+        return meta, body
+    except (OSError, ValueError):
+        return None
+
+def _write_atomic(path: str, data: bytes):
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def _conditional_headers(headers, cached) -> dict:
+    """Copy of `headers` plus If-None-Match / If-Modified-Since from a cached entry."""
+    headers = dict(headers or {})
+    if cached is not None:
+        meta, _ = cached
+        if meta.get("etag"):
+            headers.setdefault("If-None-Match", meta["etag"])
+        if meta.get("last_modified"):
+            headers.setdefault("If-Modified-Since", meta["last_modified"])
+    return headers
+
+def _store(meta_path: str, body_path: str, url: str, resp, body: bytes):
+    meta = {
+        "url": url,
+        "status": 200,
+        "fetched_at": time.time(),
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+        "encoding": resp.encoding,
+        "headers": {k: v for k, v in resp.headers.items() if k.lower() in ("content-type", "etag", "last-modified")},
+    }
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    _write_atomic(body_path, body)
+    _write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+
+def _response_from_cache(meta: dict, body: bytes, not_modified: bool) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = meta.get("status", 200)
+    resp._content = body
+    resp.headers = CaseInsensitiveDict(meta.get("headers", {}))
+    resp.url = meta.get("url", "")
+    resp.encoding = meta.get("encoding")
+    resp.from_cache = True
+    resp.not_modified = not_modified
+    return resp
+
+def cached_get(url: str, params=None, headers=None, ttl: int = DEFAULT_TTL, timeout=20, **kwargs) -> requests.Response:
+    """
+    GET through the pooled session for the URL's host.
+    - Cached and younger than `ttl` seconds: served from disk without any request.
+    - Cached but stale: revalidated with ETag / Last-Modified; a 304 serves the disk copy.
+    - Otherwise: a normal GET whose 200 response is stored for next time.
+    Does not raise on HTTP errors; callers decide (e.g. raise_for_status()).
+    """
+    meta_path, body_path = _cache_paths(url, params)
+    cached = _load_cached(meta_path, body_path) if ttl > 0 else None
+    if cached is not None:
+        meta, body = cached
+        if time.time() - meta.get("fetched_at", 0) < ttl:
+            metrics.note_http(0, cached=True)
+            return _response_from_cache(meta, body, not_modified=False)
+
+    headers = _conditional_headers(headers, cached)
+
+    sess = get_session(urlsplit(url).netloc)
+    ratelimit.acquire(url)
+    resp = sess.get(url, params=params, headers=headers, timeout=timeout, **kwargs)
+    ratelimit.report(url, resp.status_code, resp.headers.get("Retry-After"))
+
+    if resp.status_code == 304 and cached is not None:
+        meta, body = cached
+        meta["fetched_at"] = time.time()
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        _write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+        metrics.note_http(0, cached=True)
+        return _response_from_cache(meta, body, not_modified=True)
+
+    metrics.note_http(len(resp.content), cached=False)
+    resp.from_cache = False
+    resp.not_modified = False
+    if resp.status_code == 200 and ttl > 0:
+        _store(meta_path, body_path, url, resp, resp.content)
+    return resp
+
+def stream_get(url: str, params=None, headers=None, ttl: int = DEFAULT_TTL, timeout=20, chunk_size=16384):
+    """
+    Generator of body chunks, for consumers that may stop reading early (e.g. once the part of
+    a page they need has arrived). Fresh or 304-revalidated bodies come from the disk cache.
+    A downloaded body is cached only when read to the end; stopping early closes the connection
+    and skips the cache write. Raises requests.HTTPError on non-2xx responses.
+    """
+    meta_path, body_path = _cache_paths(url, params)
+    cached = _load_cached(meta_path, body_path) if ttl > 0 else None
+    if cached is not None and time.time() - cached[0].get("fetched_at", 0) < ttl:
+        metrics.note_http(0, cached=True)
+        body = cached[1]
+        for i in range(0, len(body), chunk_size):
+            yield body[i:i + chunk_size]
+        return
+
+    headers = _conditional_headers(headers, cached)
+
+    sess = get_session(urlsplit(url).netloc)
+    ratelimit.acquire(url)
+    resp = sess.get(url, params=params, headers=headers, timeout=timeout, stream=True)
+    ratelimit.report(url, resp.status_code, resp.headers.get("Retry-After"))
+    received = None
+    try:
+        if resp.status_code == 304 and cached is not None:
+            meta, body = cached
+            meta["fetched_at"] = time.time()
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            _write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+            metrics.note_http(0, cached=True)
+            for i in range(0, len(body), chunk_size):
+                yield body[i:i + chunk_size]
+            return
+        resp.raise_for_status()
+        parts, received = [], 0
+        for chunk in resp.iter_content(chunk_size):
+            parts.append(chunk)
+            received += len(chunk)
+            yield chunk
+        if resp.status_code == 200 and ttl > 0:
+            _store(meta_path, body_path, url, resp, b"".join(parts))
+    finally:
+        resp.close()
+        if received is not None:
+            metrics.note_http(received, cached=False)
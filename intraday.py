@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Intraday quote poller (asyncio) for the indices in symbols.json
+- Every `interval` seconds the symbols whose market is open (scheduler.is_open, plus a grace period
+  for the closing print) are polled, least recently polled first, with at most `concurrency`
+  requests in flight and at most `budget` requests per minute (token bucket). When the budget is
+  smaller than the open symbols they are served round-robin instead of exceeding it.
+- Only the latest price is requested (Yahoo chart meta, one small response per symbol).
+  change_percent is computed against the cached previous_close: seeded from data.json and rolled
+  over to the last price when a quote from a new session arrives, so no history is downloaded.
+- Updates are coalesced for `flush_every` seconds; then only symbols whose price changed are merged
+  into data.json (written and re-published via publish.py in a worker thread) and passed to an
+  optional sink on the event loop, e.g. the dashboard server's SSE broadcast (server.py --intraday).
+
+Usage: python cli.py quotes --intraday [--interval 15] [--budget 120] [--concurrency 8]
+"""
+import os
+import json
+import time
+import asyncio
+import datetime as dt
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+import ratelimit
+import symbols
+import validation
+from scheduler import Market, is_open
+
+YAHOO_HOST = "query1.finance.yahoo.com"
+CHART_URL = f"https://{YAHOO_HOST}/v8/finance/chart/{{symbol}}"
+CLOSE_GRACE_MIN = 15
+
+@dataclass
+class Quote:
+    price: float
+    time: int                             # exchange timestamp of the price, epoch seconds
+    volume: Optional[float] = None
+    previous_close: Optional[float] = None  # provider's value, only used when nothing is cached
+
+def fetch_quote(symbol: str) -> Quote:
+    """Latest price of `symbol` from the Yahoo chart endpoint (blocking; run in a worker thread)."""
+    from http_session import get_session
+    ratelimit.acquire(YAHOO_HOST)
+    resp = get_session(YAHOO_HOST).get(CHART_URL.format(symbol=symbol),
+                                       params={"range": "1d", "interval": "1d"}, timeout=10)
+    ratelimit.report(YAHOO_HOST, resp.status_code, resp.headers.get("Retry-After"))
+    resp.raise_for_status()
+    meta = resp.json()["chart"]["result"][0]["meta"]
+    return Quote(float(meta["regularMarketPrice"]), int(meta.get("regularMarketTime") or time.time()),
+                 meta.get("regularMarketVolume"), meta.get("chartPreviousClose"))
+
+class Budget:
+    """Async token bucket: `per_minute` requests per minute, bursting to at most one poll cycle's share."""
+    def __init__(self, per_minute: float, interval: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * interval)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self, wanted: int) -> int:
+        """Take up to `wanted` whole tokens without waiting; returns how many were granted."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        granted = min(wanted, int(self.tokens))
+        self.tokens -= granted
+        return granted
+
+@dataclass
+class SymbolState:
+    name: str
+    symbol: str
+    market: Market
+    session: Optional[str] = None         # ISO date of the session last_price belongs to
+    last_price: Optional[float] = None
+    previous_close: Optional[float] = None
+    polled_at: float = 0.0                # monotonic
+
+def _seed(name: str, meta: dict, doc: dict) -> SymbolState:
+    market = Market(meta["calendar"], meta["timezone"], meta["close"])
+    state = SymbolState(name, meta["symbol"], market)
+    entry = doc.get(name) or {}
+    if entry.get("current_price") is None:
+        return state
+    session = entry.get("as_of")
+    if not session and doc.get("last_updated"):
+        # snapshots written before as_of existed: the session date at the time of the snapshot
+        stamp = dt.datetime.fromisoformat(doc["last_updated"]).replace(tzinfo=dt.timezone.utc)
+        session = stamp.astimezone(ZoneInfo(market.timezone)).date().isoformat()
+    state.session = session
+    state.last_price = entry["current_price"]
+    state.previous_close = entry.get("previous_close")
+    return state
+
+def load_doc(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+class QuotePoller:
+    def __init__(self, doc: dict, interval: float = 15.0, budget: float = 120.0, concurrency: int = 8,
+                 flush_every: float = 5.0, path: str = "data.json", publish: bool = True,
+                 fetch: Callable[[str], Quote] = fetch_quote, sink: Optional[Callable[[dict, dict], None]] = None):
+        self.doc = doc
+        self.interval = interval
+        self.budget = Budget(budget, interval)
+        self.concurrency = concurrency
+        self.flush_every = flush_every
+        self.path = path
+        self.publish = publish
+        self.fetch = fetch
+        self.sink = sink
+        self.states: Dict[str, SymbolState] = {name: _seed(name, meta, doc) for name, meta in symbols.get_indices().items()}
+        self.pending: Dict[str, dict] = {}
+        self.errors = 0
+
+    def due(self, now: Optional[dt.datetime] = None) -> list:
+        """Open-market symbols not polled within the interval, least recently polled first."""
+        cutoff = time.monotonic() - self.interval
+        ready = [s for s in self.states.values() if s.polled_at <= cutoff and is_open(s.market, now, CLOSE_GRACE_MIN)]
+        return sorted(ready, key=lambda s: s.polled_at)
+
+    def apply(self, state: SymbolState, quote: Quote) -> Optional[dict]:
+        """Fold a quote into the cached state; returns the updated data.json entry when the price changed."""
+        session = dt.datetime.fromtimestamp(quote.time, ZoneInfo(state.market.timezone)).date().isoformat()
+        if state.session is not None and session < state.session:
+            return None  # late response from an earlier session
+        if state.session != session:
+            # first quote of a new session: yesterday's last price becomes the previous close
+            state.previous_close = state.last_price if state.last_price is not None else quote.previous_close
+            state.session = session
+        elif state.previous_close is None:
+            state.previous_close = quote.previous_close
+        changed = quote.price != state.last_price
+        state.last_price = quote.price
+        if not changed and state.name not in self.pending:
+            return None
+        entry = dict(self.doc.get(state.name) or {}, region=symbols.get_indices()[state.name]["region"])
+        entry.update(current_price=round(quote.price, 2), as_of=session,
+                     updated_at=dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
+        entry.setdefault("currency", symbols.get_indices()[state.name]["currency"])
+        if quote.volume:
+            entry["volume"] = int(quote.volume)
+        prev = state.previous_close
+        if prev:
+            entry["previous_close"] = round(prev, 2)
+            entry["change_percent"] = round((quote.price / prev - 1) * 100, 2)
+        for key, better in (("fifty_two_week_high", max), ("fifty_two_week_low", min)):
+            if entry.get(key) is not None:
+                entry[key] = round(better(entry[key], quote.price), 2)
+        flags = validation.flag_names(validation.check(None, [prev or np.nan, quote.price], validation.RULES["price"])[-1])
+        entry.update(data_quality="warning" if flags else "good", quality_flags=flags)
+        entry.pop("error", None)
+        return entry
+
+    async def poll_once(self, now: Optional[dt.datetime] = None) -> int:
+        """One cycle: poll as many due symbols as the budget allows; returns the number polled."""
+        due = self.due(now)
+        batch = due[:self.budget.take(len(due))]
+        if not batch:
+            return 0
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def one(state: SymbolState):
+            async with sem:
+                state.polled_at = time.monotonic()
+                try:
+                    quote = await asyncio.to_thread(self.fetch, state.symbol)
+                except Exception as e:
+                    self.errors += 1
+                    print(f"[WARN] quote {state.symbol} failed: {type(e).__name__}: {e}")
+                    return
+                entry = self.apply(state, quote)
+                if entry is not None:
+                    self.pending[state.name] = entry  # coalesced: the newest entry per symbol wins
+
+        await asyncio.gather(*(one(s) for s in batch))
+        return len(batch)
+
+    def _write(self, doc: dict):
+        """Write data.json and re-publish it (blocking: file I/O, hashing and compression)."""
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(doc, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+        if self.publish:
+            from publish import publish_file
+            publish_file(os.path.dirname(os.path.abspath(self.path)), os.path.basename(self.path), self.path)
+
+    async def flush(self) -> dict:
+        """
+        Merge the coalesced changes into data.json (and the sink); returns them. The write and the
+        publish run in a worker thread so the event loop (and a server sharing it) keeps serving;
+        the sink is called back on the loop.
+        """
+        changed, self.pending = self.pending, {}
+        if not changed:
+            return {}
+        self.doc.update(changed)
+        # naive UTC ISO time, the format app.py writes
+        self.doc["last_updated"] = dt.datetime.now(dt.timezone.utc).replace(tzinfo=None).isoformat()
+        # entries are replaced, never mutated, so a shallow copy is a stable snapshot for the thread
+        await asyncio.to_thread(self._write, dict(self.doc))
+        if self.sink is not None:
+            self.sink(self.doc, changed)
+        return changed
+
+    async def run(self, stop: Optional[asyncio.Event] = None):
+        stop = stop or asyncio.Event()
+        last_flush = time.monotonic()
+        tick = min(self.interval, self.flush_every)
+        while not stop.is_set():
+            started = time.monotonic()
+            polled = await self.poll_once()
+            if time.monotonic() - last_flush >= self.flush_every:
+                changed = await self.flush()
+                last_flush = time.monotonic()
+                if changed:
+                    print(f"{dt.datetime.now():%H:%M:%S} polled={polled} published={len(changed)}: {', '.join(changed)}")
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=max(0.0, tick - (time.monotonic() - started)))
+            except asyncio.TimeoutError:
+                pass
+        await self.flush()
+
+def main(interval: float = 15.0, budget: float = 120.0, concurrency: int = 8, path: str = "data.json"):
+    poller = QuotePoller(load_doc(path), interval=interval, budget=budget, concurrency=concurrency, path=path)
+    print(f"Polling {len(poller.states)} symbols every {interval:g}s, budget {budget:g} requests/min")
+    try:
+        asyncio.run(poller.run())
+    except KeyboardInterrupt:
+        asyncio.run(poller.flush())
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Lightweight per-stage instrumentation shared by update_data.py, app.py and goods.py
+- start_run(pipeline) ... finish_run(): one run of a pipeline ("pe", "quotes", "macro")
+- `with stage("fetch", source, key) as rec:` times a stage; rec.rows / rec.bytes can be set by the caller,
+  and HTTP calls made on the same thread (http_session) add bytes, cache hit/miss and retries to it
+- finish_run() appends one JSON line per stage event to <METRICS_DIR>/metrics.jsonl and rewrites
+  <METRICS_DIR>/pe_dashboard_<pipeline>.prom (Prometheus textfile format, node_exporter compatible).
+  Gauges are labelled by pipeline / stage / source only; the per-series `key` stays in the JSON lines
+  so hundreds of indices do not turn into hundreds of label sets
+
+Stages opened outside a run (benchmarks, ad-hoc calls) are timed but not recorded.
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(".cache", "metrics"))
+PREFIX = "pe_dashboard"
+
+# Prometheus gauge -> (record field, help text); values are summed per (pipeline, stage, source)
+GAUGES = {
+    "stage_duration_seconds": ("duration", "Wall time spent in the stage during the last run"),
+    "stage_calls": ("calls", "Stage executions during the last run"),
+    "stage_bytes": ("bytes", "Bytes transferred or written by the stage"),
+    "stage_rows": ("rows", "Rows produced by the stage"),
+    "stage_retries": ("retries", "HTTP retries within the stage"),
+    "stage_cache_hits": ("cache_hits", "Responses served from cache or revalidated (304)"),
+    "stage_cache_misses": ("cache_misses", "Responses downloaded in full"),
+    "stage_errors": ("errors", "Stage executions that raised"),
+}
+
+class Record:
+    __slots__ = ("pipeline", "stage", "source", "key", "started", "duration", "bytes", "rows",
+                 "retries", "cache_hits", "cache_misses", "error")
+
+    def __init__(self, pipeline: Optional[str], stage: str, source: str, key: str = ""):
+        self.pipeline = pipeline
+        self.stage = stage
+        self.source = source
+        self.key = key
+        self.started = time.time()
+        self.duration = 0.0
+        self.bytes = 0
+        self.rows = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.error = None
+
+    def as_dict(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+_local = threading.local()
+_lock = threading.Lock()
+_run = None  # {"pipeline", "started", "records"}
+
+def start_run(pipeline: str):
+    global _run
+    with _lock:
+        _run = {"pipeline": pipeline, "started": time.time(), "records": []}
+
+def current() -> Optional[Record]:
+    """Innermost open stage on this thread, if any."""
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+@contextmanager
+def stage(name: str, source: str = "", key: str = ""):
+    run = _run
+    rec = Record(run["pipeline"] if run else None, name, source, key)
+    stack = _local.__dict__.setdefault("stack", [])
+    stack.append(rec)
+    t0 = time.perf_counter()
+    try:
+        yield rec
+    except BaseException as e:
+        rec.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        rec.duration = time.perf_counter() - t0
+        stack.pop()
+        if run is not None:
+            with _lock:
+                run["records"].append(rec)
+
+def note_http(nbytes: int, cached: bool):
+    """Called by http_session for every response; attributed to the open stage on this thread."""
+    rec = current()
+    if rec is None:
+        return
+    rec.bytes += nbytes
+    if cached:
+        rec.cache_hits += 1
+    else:
+        rec.cache_misses += 1
+
+def note_retry(*_):
+    """tenacity before_sleep hook: count a retry against the open stage."""
+    rec = current()
+    if rec is not None:
+        rec.retries += 1
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+def _prometheus(pipeline: str, records, started: float, finished: float) -> str:
+    totals = {}
+    for rec in records:
+        t = totals.setdefault((rec.stage, rec.source), dict.fromkeys(
+            ("duration", "calls", "bytes", "rows", "retries", "cache_hits", "cache_misses", "errors"), 0))
+        t["duration"] += rec.duration
+        t["calls"] += 1
+        t["errors"] += rec.error is not None
+        for field in ("bytes", "rows", "retries", "cache_hits", "cache_misses"):
+            t[field] += getattr(rec, field)
+    lines = []
+    for gauge, (field, help_text) in GAUGES.items():
+        lines += [f"# HELP {PREFIX}_{gauge} {help_text}", f"# TYPE {PREFIX}_{gauge} gauge"]
+        for (stage_name, source), t in sorted(totals.items()):
+            labels = f'pipeline="{_label(pipeline)}",stage="{_label(stage_name)}",source="{_label(source)}"'
+            lines.append(f"{PREFIX}_{gauge}{{{labels}}} {round(t[field], 6)}")
+    lines += [
+        f"# HELP {PREFIX}_run_duration_seconds Wall time of the last run",
+        f"# TYPE {PREFIX}_run_duration_seconds gauge",
+        f'{PREFIX}_run_duration_seconds{{pipeline="{_label(pipeline)}"}} {round(finished - started, 6)}',
+        f"# HELP {PREFIX}_run_timestamp_seconds Unix time the last run finished",
+        f"# TYPE {PREFIX}_run_timestamp_seconds gauge",
+        f'{PREFIX}_run_timestamp_seconds{{pipeline="{_label(pipeline)}"}} {round(finished, 3)}',
+    ]
+    return "\n".join(lines) + "\n"
+
+def finish_run(out_dir: Optional[str] = None) -> list:
+    """Write the run's stage events (JSON lines) and Prometheus textfile; returns the records."""
+    global _run
+    with _lock:
+        run, _run = _run, None
+    if run is None:
+        return []
+    out_dir = out_dir or METRICS_DIR
+    os.makedirs(out_dir, exist_ok=True)
+    finished = time.time()
+    records = sorted(run["records"], key=lambda r: r.started)
+    with open(os.path.join(out_dir, "metrics.jsonl"), "a", encoding="utf-8") as f:
+        for rec in records:
+            f.write(json.dumps(rec.as_dict(), ensure_ascii=False) + "\n")
+    # Textfile collectors read *.prom; write to a temp name and rename so scrapes never see half a file
+    path = os.path.join(out_dir, f"{PREFIX}_{run['pipeline']}.prom")
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(_prometheus(run["pipeline"], records, run["started"], finished))
+    os.replace(tmp, path)
+    return records
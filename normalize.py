@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Single normalization stage for loader output (update_data.run_batch)
+Loaders hand back raw frames: a "date" column (ISO strings, datetime64, datetime.date objects) and
+metric columns of any dtype, in source order (ascending, or newest first). canonical() converts
+such a frame once into the layout everything downstream expects:
+- "date": whole days, ascending and unique (pandas keeps datetime64[D] arrays as datetime64[s])
+- one float32 column per metric, values failing a HARD validation rule set to NaN
+
+Dates are parsed once into a datetime64[D] array. The history window, incremental cutoff and
+backfill chunk bounds select row indices before anything is converted; one stable argsort of the
+selected days then orders them (any source order: ascending, newest first, shuffled), and each
+metric is gathered once into a float32 block (metrics x days) holding, per repeated date, the last
+non-NaN value (validation.day_groups / last_per_day). HARD rejections are written into the block
+in place afterwards. The output frame wraps the block without copying it; WideStore.merge widens
+it to float64 once (widen()).
+"""
+from dataclasses import replace
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import validation
+
+def day_array(col: pd.Series) -> np.ndarray:
+    """A date column -> datetime64[D] (NaT where unparseable), parsing it at most once."""
+    if pd.api.types.is_datetime64_any_dtype(col.dtype):
+        if getattr(col.dtype, "tz", None) is not None:
+            col = col.dt.tz_localize(None)
+        return col.to_numpy().astype("datetime64[D]")
+    try:
+        # ISO dates and datetime.date objects convert directly
+        return col.to_numpy(dtype="datetime64[D]")
+    except (TypeError, ValueError):
+        return pd.to_datetime(col, errors="coerce").to_numpy().astype("datetime64[D]")
+
+def _day(value) -> np.datetime64:
+    return np.datetime64(pd.Timestamp(value).date(), "D")
+
+def canonical(df: pd.DataFrame, metrics: Iterable[str], start=None, after=None, end=None,
+              rules=validation.rules_for_column) -> Tuple[pd.DataFrame, Dict[str, Dict[str, int]]]:
+    """
+    Raw loader frame -> canonical frame of the rows with start <= date <= end and date > after
+    (each bound optional), plus the HARD-flag counts per metric ({metric: {flag: rows}}, non-zero only).
+    Rows left without any value are dropped.
+    """
+    metrics = [m for m in metrics if m in df.columns]
+    if "date" not in df.columns or df.empty:
+        return pd.DataFrame({"date": np.array([], "datetime64[s]"),
+                             **{m: np.array([], np.float32) for m in metrics}}), {}
+    days = day_array(df["date"])
+    rows = np.flatnonzero(~np.isnat(days))
+    if start is not None:
+        rows = rows[days[rows] >= _day(start)]
+    if after is not None:
+        rows = rows[days[rows] > _day(after)]
+    if end is not None:
+        rows = rows[days[rows] <= _day(end)]
+    if len(rows) > 1 and (np.diff(days[rows].view("int64")) <= 0).any():
+        order, starts = validation.day_groups(days[rows])
+        rows = rows[order]
+    else:
+        starts = None  # already ascending and unique (the common case): no gather needed
+    days = days[rows] if starts is None else days[rows][starts]
+
+    block = np.empty((len(metrics), len(days)), np.float32)
+    rejected = {}
+    for j, m in enumerate(metrics):
+        col = df[m]
+        if not pd.api.types.is_numeric_dtype(col.dtype):
+            col = pd.to_numeric(col, errors="coerce")
+        values = col.to_numpy(dtype="float64", na_value=np.nan)[rows]
+        block[j] = values if starts is None else validation.last_per_day(values, starts)
+        # HARD rules only: jump / outlier / staleness annotate the stored series later (write_quality)
+        flags = validation.check(days, block[j], replace(rules(m), max_jump=None, mad_window=None,
+                                                          stale_days=None)) & validation.HARD
+        if flags.any():
+            block[j][flags != 0] = np.nan
+            counts = {name: int(np.count_nonzero(flags & bit)) for name, bit in validation.FLAGS.items()
+                      if bit & validation.HARD}
+            rejected[m] = {k: n for k, n in counts.items() if n}
+
+    keep = ~np.isnan(block).all(axis=0)
+    if not keep.all():
+        days, block = days[keep], block[:, keep]
+    out = pd.DataFrame(block.T, columns=metrics, copy=False)
+    out.insert(0, "date", days.astype("datetime64[s]"))
+    return out, rejected
+
+def widen(values: np.ndarray) -> np.ndarray:
+    """
+    float32 -> float64 rounded to the 7 significant digits float32 carries, so 12.34 stays 12.34
+    instead of becoming 12.340000152587891 in the store, the CSV and the JSON payloads.
+    """
+    values = values.astype("float64")
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        scale = 10.0 ** (6 - np.floor(np.log10(np.abs(values))))
+        rounded = np.round(values * scale) / scale
+    return np.where(np.isfinite(rounded), rounded, values)
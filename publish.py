@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Content-hashed static asset publishing
+- Copies an artifact to <root>/assets/<stem>.<sha256[:12]><ext> so it can be cached forever
+- Writes precompressed .gz (and .br when the `brotli` package is installed) next to it
+- Records logical name -> hashed path in <root>/manifest.json, the only file clients revalidate.
+  Writers committed by different workflows pass their own manifest name (goods.py:
+  goods.manifest.json), so two jobs never rewrite and push the same file
+- Keeps the current hashed copy of each artifact plus the one the previous manifest listed (still
+  referenced by clients holding that manifest); older copies are removed
+
+Pages fetch manifest.json with cache:"no-cache" and then the hashed URLs with normal caching,
+so a repeat visitor downloads only the manifest until the data actually changes.
+"""
+import os
+import json
+import gzip
+import glob
+import hashlib
+import datetime as dt
+
+ASSET_DIR = "assets"
+MANIFEST = "manifest.json"
+DIGEST_CHARS = 12
+
+def _write_atomic(path: str, data: bytes):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def _hashed_name(logical: str, digest: str) -> str:
+    stem, ext = os.path.splitext(logical.replace("/", "_"))
+    return f"{stem}.{digest}{ext}"
+
+def _compress(path: str, data: bytes):
+    _write_atomic(path + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        return
+    _write_atomic(path + ".br", brotli.compress(data, quality=11))
+
+def _prune(asset_dir: str, logical: str, keep: set):
+    """Drop the hashed copies of `logical` whose file names are not in `keep`."""
+    stem, ext = os.path.splitext(logical.replace("/", "_"))
+    size = len(_hashed_name(logical, "0" * DIGEST_CHARS))
+    versions = [p for p in glob.glob(os.path.join(asset_dir, f"{glob.escape(stem)}.*{ext}"))
+                if len(os.path.basename(p)) == size]
+    for old in versions:
+        if os.path.basename(old) in keep:
+            continue
+        for p in (old, old + ".gz", old + ".br"):
+            if os.path.exists(p):
+                os.remove(p)
+
+def load_manifest(root: str, manifest: str = MANIFEST) -> dict:
+    try:
+        with open(os.path.join(root, manifest), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"files": {}}
+
+def publish_files(root: str, files: dict, manifest_name: str = MANIFEST) -> dict:
+    """
+    Publish {logical_name: source_path} under `root` and update root/<manifest_name> in one write.
+    Returns {logical_name: hashed path relative to root}.
+    """
+    asset_dir = os.path.join(root, ASSET_DIR)
+    os.makedirs(asset_dir, exist_ok=True)
+    manifest = load_manifest(root, manifest_name)
+    previous = manifest.get("files", {})
+    published = {}
+    for logical, src in files.items():
+        with open(src, "rb") as f:
+            data = f.read()
+        name = _hashed_name(logical, hashlib.sha256(data).hexdigest()[:DIGEST_CHARS])
+        path = os.path.join(asset_dir, name)
+        if not os.path.exists(path):
+            _write_atomic(path, data)
+            _compress(path, data)
+        # the previous manifest, not file mtimes (all equal after a fresh checkout), names the copy to keep
+        keep = {name}
+        if previous.get(logical):
+            keep.add(os.path.basename(previous[logical]))
+        _prune(asset_dir, logical, keep)
+        published[logical] = f"{ASSET_DIR}/{name}"
+    manifest.setdefault("files", {}).update(published)
+    manifest["generated_at"] = dt.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    _write_atomic(os.path.join(root, manifest_name),
+                  json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode("utf-8"))
+    return published
+
+def publish_file(root: str, logical: str, src: str, manifest_name: str = MANIFEST) -> str:
+    """Publish a single artifact; see publish_files."""
+    return publish_files(root, {logical: src}, manifest_name)[logical]
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Per-host token-bucket rate limiting shared by all pipelines
+- Each host gets a bucket (rate tokens/sec, burst capacity); acquire() blocks only as long as needed
+- 429 / 5xx responses halve the host's rate and pause it (Retry-After when given, else exponential);
+  successes restore the configured rate additively (AIMD)
+
+Requests to different hosts never wait on each other, so fixed sleeps between calls are not needed.
+"""
+import time
+import threading
+from typing import Optional
+from urllib.parse import urlsplit
+
+# host -> (tokens per second, burst capacity)
+HOST_LIMITS = {
+    "finance.sina.com.cn": (0.5, 2),
+    "query1.finance.yahoo.com": (2.0, 5),
+    "query2.finance.yahoo.com": (2.0, 5),
+    "data.nasdaq.com": (1.0, 3),
+    "www.gurufocus.com": (0.5, 1),
+}
+DEFAULT_LIMIT = (1.0, 2)
+MIN_RATE_FRACTION = 1 / 16
+MAX_BACKOFF = 120.0
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens: float = 1.0):
+        """Block until `tokens` are available (and any backoff pause has passed), then take them."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = max(0.0, self.blocked_until - now)
+                if wait == 0.0:
+                    if self.tokens >= tokens:
+                        self.tokens -= tokens
+                        return
+                    wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.rate = min(self.base_rate, self.rate + self.base_rate / 4)
+
+    def throttle(self, retry_after: Optional[float] = None):
+        with self.lock:
+            self.failures += 1
+            self.rate = max(self.base_rate * MIN_RATE_FRACTION, self.rate / 2)
+            pause = retry_after if retry_after is not None else min(MAX_BACKOFF, 2.0 ** self.failures)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+            self.tokens = 0.0
+
+_BUCKETS = {}
+_LOCK = threading.Lock()
+
+def _host(url_or_host: str) -> str:
+    return urlsplit(url_or_host).netloc if "://" in url_or_host else url_or_host
+
+def bucket_for(url_or_host: str) -> TokenBucket:
+    host = _host(url_or_host)
+    with _LOCK:
+        if host not in _BUCKETS:
+            _BUCKETS[host] = TokenBucket(*HOST_LIMITS.get(host, DEFAULT_LIMIT))
+        return _BUCKETS[host]
+
+def acquire(url_or_host: str, tokens: float = 1.0):
+    bucket_for(url_or_host).acquire(tokens)
+
+def report(url_or_host: str, status: int, retry_after: Optional[str] = None):
+    """Feed a response status back into the host's bucket (429/5xx back off, others recover)."""
+    bucket = bucket_for(url_or_host)
+    if status == 429 or status >= 500:
+        try:
+            delay = float(retry_after) if retry_after is not None else None
+        except ValueError:
+            delay = None
+        bucket.throttle(delay)
+    else:
+        bucket.success()
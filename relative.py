@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Cross-index relative valuation (e.g. CSI300 vs SP500 PE), maintained one business day at a time
+- Calendar alignment: every index's PE is carried onto one Monday-Friday grid; a print on a
+  holiday / weekend lands on the next grid day and values are forward-filled for at most
+  ffill_limit_days grid days (monthly sources stay usable, dead feeds drop out)
+- Per ordered pair (i, j): spread pe_i - pe_j, ratio pe_i / pe_j, the ratio's percentile rank and
+  z-score within the trailing `window_days` grid days, and the correlation of daily PE log changes
+  over the trailing `corr_window_days`
+- RelativeEngine.step() folds in one grid day: running sums (N x N, vectorized) get the new day
+  added and the day leaving each window subtracted, and each pair's sorted ratio window gets one
+  insertion and one removal, so a day costs O(N²) (times log W for the rank), independent of
+  how much history exists
+- State (the trailing grid rows and forward-fill state) is kept in data/relative/state.npz; sums
+  and sorted windows are rebuilt from it on load. Outputs: data/relative/matrix.json (latest
+  matrices, served as GET /relative) and data/relative/history.csv (one row per pair and day)
+
+A grid day is only committed once every live daily index has printed up to it (settled_date), so a
+source publishing a day late does not freeze stale values in; sparse (monthly) sources are filled.
+"""
+import os
+import json
+import bisect
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+WINDOW_DAYS = 756        # ~3 years of business days
+CORR_WINDOW_DAYS = 252   # ~1 year
+FFILL_LIMIT_DAYS = 25    # ~5 weeks, covers monthly sources
+HISTORY_COLUMNS = ["date", "a", "b", "spread", "ratio", "ratio_pct", "ratio_z", "corr"]
+
+class RelativeEngine:
+    def __init__(self, keys: List[str], window: int = WINDOW_DAYS, corr_window: int = CORR_WINDOW_DAYS,
+                 ffill_limit: int = FFILL_LIMIT_DAYS):
+        self.keys = list(keys)
+        self.window = window
+        self.corr_window = min(corr_window, window)
+        self.ffill_limit = ffill_limit
+        n = len(self.keys)
+        self.last_date: Optional[pd.Timestamp] = None
+        self.last = np.full(n, np.nan)        # last print per index
+        self.age = np.full(n, np.inf)         # grid days since that print
+        self.buffer = np.full((window + 1, n), np.nan)  # aligned PE of the trailing grid days (ring)
+        self.pos = 0                          # ring slot of the next day
+        self.steps = 0
+        self._reset_sums()
+
+    # ---- running state ----
+    def _reset_sums(self):
+        n = len(self.keys)
+        z = lambda: np.zeros((n, n))
+        self.r_n, self.r_sum, self.r_sq = z(), z(), z()
+        self.c_n, self.c_x, self.c_xx, self.c_xy = z(), z(), z(), z()
+        self.sorted = {(i, j): [] for i in range(n) for j in range(i + 1, n)}  # upper-triangle ratios
+
+    def _row(self, back: int) -> np.ndarray:
+        """Aligned row `back` grid days before the newest (0 = newest); NaN before the start."""
+        if back >= min(self.steps, len(self.buffer)):
+            return np.full(len(self.keys), np.nan)
+        return self.buffer[(self.pos - 1 - back) % len(self.buffer)]
+
+    @staticmethod
+    def _ratio(row: np.ndarray) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r = row[:, None] / row[None, :]
+        r[~np.isfinite(r) | ~(row[:, None] > 0) | ~(row[None, :] > 0)] = np.nan
+        return r
+
+    @staticmethod
+    def _change(row: np.ndarray, prev: np.ndarray) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x = np.log(row / prev)
+        x[~np.isfinite(x)] = np.nan
+        return x
+
+    def _ratio_terms(self, row: np.ndarray, sign: float):
+        r = self._ratio(row)
+        ok = ~np.isnan(r)
+        rz = np.where(ok, r, 0.0)
+        self.r_n += sign * ok
+        self.r_sum += sign * rz
+        self.r_sq += sign * rz * rz
+        for (i, j), values in self.sorted.items():
+            v = r[i, j]
+            if v != v:
+                continue
+            if sign > 0:
+                bisect.insort(values, v)
+            else:
+                del values[bisect.bisect_left(values, v)]
+
+    def _corr_terms(self, x: np.ndarray, sign: float):
+        m = (~np.isnan(x)).astype("float64")
+        xz = np.where(m > 0, x, 0.0)
+        self.c_n += sign * np.outer(m, m)
+        self.c_x += sign * np.outer(xz, m)          # sum of x_i over days where j is present too
+        self.c_xx += sign * np.outer(xz * xz, m)
+        self.c_xy += sign * np.outer(xz, xz)
+
+    def step(self, day, prints: np.ndarray):
+        """Fold in grid day `day`; `prints` holds each index's PE printed for it (NaN: none)."""
+        fresh = ~np.isnan(prints)
+        self.last = np.where(fresh, prints, self.last)
+        self.age = np.where(fresh, 0, self.age + 1)
+        row = np.where(self.age <= self.ffill_limit, self.last, np.nan)
+        prev = self._row(0)
+        leaving = self._row(self.window - 1)  # drops out of the ratio window with this day
+        if self.steps >= self.window:
+            self._ratio_terms(leaving, -1.0)
+        if self.steps > self.corr_window:
+            self._corr_terms(self._change(self._row(self.corr_window - 1), self._row(self.corr_window)), -1.0)
+        self.buffer[self.pos] = row
+        self.pos = (self.pos + 1) % len(self.buffer)
+        self.steps += 1
+        self._ratio_terms(row, 1.0)
+        if self.steps > 1:
+            self._corr_terms(self._change(row, prev), 1.0)
+        self.last_date = pd.Timestamp(day)
+
+    # ---- results ----
+    def matrices(self) -> Dict[str, np.ndarray]:
+        row = self._row(0)
+        n = len(self.keys)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            spread = row[:, None] - row[None, :]
+            ratio = self._ratio(row)
+            mean = self.r_sum / self.r_n
+            std = np.sqrt(np.maximum(self.r_sq / self.r_n - mean * mean, 0.0))
+            ratio_z = (ratio - mean) / np.where(std > 0, std, np.nan)
+            cov = self.c_n * self.c_xy - self.c_x * self.c_x.T
+            var = (self.c_n * self.c_xx - self.c_x ** 2) * (self.c_n * self.c_xx.T - self.c_x.T ** 2)
+            corr = np.where((self.c_n >= 20) & (var > 0), cov / np.sqrt(var), np.nan)
+        pct = np.full((n, n), np.nan)
+        for (i, j), values in self.sorted.items():
+            v = ratio[i, j]
+            if v == v and values:
+                pct[i, j] = bisect.bisect_right(values, v) / len(values)
+                # ratio_ji = 1 / ratio_ij ranks in reverse
+                pct[j, i] = (len(values) - bisect.bisect_left(values, v)) / len(values)
+        return {"spread": spread, "ratio": ratio, "ratio_pct": pct, "ratio_z": ratio_z, "corr": corr}
+
+    def history_rows(self, mats: Dict[str, np.ndarray]) -> list:
+        """History rows of the newest day, one per pair (a before b in `keys`) with a ratio."""
+        day = self.last_date.strftime("%Y-%m-%d")
+        rows = []
+        for i, a in enumerate(self.keys):
+            for j, b in enumerate(self.keys[i + 1:], i + 1):
+                if mats["ratio"][i, j] == mats["ratio"][i, j]:
+                    rows.append([day, a, b] + [mats[k][i, j] for k in HISTORY_COLUMNS[3:]])
+        return rows
+
+    # ---- persistence ----
+    def settings(self) -> dict:
+        return {"keys": self.keys, "window": self.window, "corr_window": self.corr_window,
+                "ffill_limit": self.ffill_limit}
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, settings=json.dumps(self.settings()), last_date=str(self.last_date.date()),
+                 last=self.last, age=self.age, buffer=self.buffer, pos=self.pos, steps=self.steps)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, keys: List[str], window: int, corr_window: int, ffill_limit: int) -> Optional["RelativeEngine"]:
+        """Saved engine with the same settings (sums and sorted windows rebuilt), else None."""
+        engine = cls(keys, window, corr_window, ffill_limit)
+        try:
+            with np.load(path) as z:
+                if json.loads(str(z["settings"])) != engine.settings():
+                    return None
+                engine.last_date = pd.Timestamp(str(z["last_date"]))
+                engine.last, engine.age, engine.buffer = z["last"], z["age"], z["buffer"]
+                engine.pos, engine.steps = int(z["pos"]), int(z["steps"])
+        except (OSError, KeyError, ValueError):
+            return None
+        # replay the retained rows into fresh sums: O(window · N²) once per load, not per day
+        rows = [engine._row(b) for b in range(min(engine.steps, window + 1) - 1, -1, -1)]
+        for k, row in enumerate(rows):
+            if len(rows) - k <= window:
+                engine._ratio_terms(row, 1.0)
+            if k > 0 and len(rows) - k <= engine.corr_window:
+                engine._corr_terms(engine._change(row, rows[k - 1]), 1.0)
+        return engine
+
+def _grid_prints(frame: pd.DataFrame, grid: pd.DatetimeIndex) -> np.ndarray:
+    """Raw prints -> (grid days x indices); a non-grid date lands on the next grid day, latest print wins."""
+    out = np.full((len(grid), frame.shape[1]), np.nan)
+    pos = grid.searchsorted(frame.index)
+    inside = pos < len(grid)
+    for j in range(frame.shape[1]):
+        values = frame.iloc[:, j].to_numpy(dtype="float64")
+        ok = inside & ~np.isnan(values)
+        out[pos[ok], j] = values[ok]
+    return out
+
+def settled_date(frame: pd.DataFrame, ffill_limit: int) -> Optional[pd.Timestamp]:
+    """
+    Latest date every daily index has printed up to. Sparse indices (fewer than 10 prints in the
+    last 4 weeks, e.g. monthly sources) and indices silent for over ffill_limit grid days do not
+    hold it back; they are forward-filled like any other gap.
+    """
+    printed = frame.index[frame.notna().to_numpy().any(axis=1)]
+    if not len(printed):
+        return None
+    newest = printed.max()
+    recent = frame[frame.index > newest - pd.Timedelta(days=28)]
+    awaited = []
+    for col in frame.columns:
+        last = frame[col].last_valid_index()
+        if last is not None and recent[col].count() >= 10 and len(pd.bdate_range(last, newest)) - 1 <= ffill_limit:
+            awaited.append(last)
+    return min(awaited) if awaited else newest
+
+def update_relative(pe: pd.DataFrame, out_dir: str, window: int = WINDOW_DAYS, corr_window: int = CORR_WINDOW_DAYS,
+                    ffill_limit: int = FFILL_LIMIT_DAYS, incremental: bool = True) -> Optional[dict]:
+    """
+    Advance the engine over the grid days after its last date from `pe` (date-indexed, one PE
+    column per index key) and write matrix.json / history.csv / state.npz under `out_dir`.
+    Returns the matrix document, or None with fewer than two indices.
+    """
+    keys = list(pe.columns)
+    if len(keys) < 2:
+        return None
+    state_path = os.path.join(out_dir, "state.npz")
+    history_path = os.path.join(out_dir, "history.csv")
+    engine = RelativeEngine.load(state_path, keys, window, corr_window, ffill_limit) if incremental else None
+    if engine is not None and not os.path.exists(history_path):
+        engine = None
+    end = settled_date(pe, ffill_limit)
+    if end is None:
+        return None
+    if engine is None:
+        engine, after, mode = RelativeEngine(keys, window, corr_window, ffill_limit), None, "w"
+        grid = pd.bdate_range(pe.dropna(how="all").index[0], end)
+    else:
+        after, mode = engine.last_date, "a"
+        grid = pd.bdate_range(after + pd.offsets.BDay(1), end)
+    rows = []
+    if len(grid):
+        # prints after the last committed day (weekend / holiday prints land on the next grid day)
+        span = pe[pe.index <= grid[-1]]
+        if after is not None:
+            span = span[span.index > after]
+        for day, prints in zip(grid, _grid_prints(span, grid)):
+            engine.step(day, prints)
+            rows += engine.history_rows(engine.matrices())
+    if engine.last_date is None:
+        return None
+    mats = engine.matrices()
+    os.makedirs(out_dir, exist_ok=True)
+    if rows or mode == "w":
+        pd.DataFrame(rows, columns=HISTORY_COLUMNS).to_csv(history_path, mode=mode, header=mode == "w",
+                                                           index=False, float_format="%.6g")
+    engine.save(state_path)
+    doc = {
+        "as_of": engine.last_date.strftime("%Y-%m-%d"),
+        "keys": keys,
+        "window_days": window,
+        "corr_window_days": engine.corr_window,
+        **{name: [[None if v != v else round(float(v), 4) for v in r] for r in m] for name, m in mats.items()},
+    }
+    tmp = os.path.join(out_dir, "matrix.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(doc, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, os.path.join(out_dir, "matrix.json"))
+    print(f"Wrote {out_dir}/matrix.json  as_of={doc['as_of']} days={len(grid)} pairs={len(rows)}")
+    return doc
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Trading-calendar-aware scheduler for the three pipelines
+- pe:     update_data.py, one entry per registered index (calendar / timezone / close / publish_delay_min,
+          usually inherited from its source block in config.json, see sources.py)
+- quotes: app.py, due when any exchange in symbols.json has closed a new session
+- macro:  goods.py, due when the Shanghai market has closed a new session
+A job only runs for markets whose latest session has closed (plus the source's publish delay) and has
+not been refreshed yet, so holidays, weekends and repeated cron ticks never hit a source.
+The last refreshed session per job and market is kept in the state file (.cache/schedule.json).
+
+Exchange holidays and half days come from `exchange_calendars` when installed; without it every
+weekday counts as a session and the configured close time is used.
+
+Usage: python scheduler.py [pe|quotes|macro|all] [--dry-run] [--force]
+"""
+import os
+import json
+import datetime as dt
+from dataclasses import dataclass
+from typing import Dict, Optional
+from zoneinfo import ZoneInfo
+
+from sources import load_config, index_specs
+
+JOBS = ("pe", "quotes", "macro")
+
+@dataclass(frozen=True)
+class Market:
+    calendar: str          # ISO 10383 MIC, e.g. XSHG, XHKG, XNYS, XNAS
+    timezone: str
+    close: str             # regular session close, local "HH:MM"
+    delay_min: int = 0     # minutes after the close before the source publishes
+
+_CALENDARS = {}
+
+def _exchange_calendar(mic: str):
+    """exchange_calendars calendar for `mic`, or None when the package (or the calendar) is missing."""
+    if mic not in _CALENDARS:
+        try:
+            import exchange_calendars as xcals
+            _CALENDARS[mic] = xcals.get_calendar(mic)
+        except ImportError:
+            _CALENDARS[mic] = None
+        except Exception as e:
+            print(f"[WARN] calendar {mic} unavailable, using weekdays: {e}")
+            _CALENDARS[mic] = None
+    return _CALENDARS[mic]
+
+def session_close(market: Market, day: dt.date) -> Optional[dt.datetime]:
+    """UTC close of the session on `day`, or None when the market is shut that day."""
+    cal = _exchange_calendar(market.calendar)
+    if cal is not None:
+        label = day.isoformat()
+        if not cal.is_session(label):
+            return None
+        return cal.session_close(label).to_pydatetime()
+    if day.weekday() >= 5:
+        return None
+    hh, mm = map(int, market.close.split(":"))
+    local = dt.datetime.combine(day, dt.time(hh, mm), ZoneInfo(market.timezone))
+    return local.astimezone(dt.timezone.utc)
+
+def last_closed_session(market: Market, now: Optional[dt.datetime] = None,
+                        lookback_days: int = 14) -> Optional[dt.date]:
+    """Most recent session whose close + publish delay is at or before `now` (UTC)."""
+    now = now or dt.datetime.now(dt.timezone.utc)
+    ready = now - dt.timedelta(minutes=market.delay_min)
+    today = now.astimezone(ZoneInfo(market.timezone)).date()
+    for back in range(lookback_days):
+        day = today - dt.timedelta(days=back)
+        close = session_close(market, day)
+        if close is not None and close <= ready:
+            return day
+    return None
+
+def is_open(market: Market, now: Optional[dt.datetime] = None, grace_min: int = 0) -> bool:
+    """
+    Whether `market` is in a regular session at `now` (UTC) or was `grace_min` minutes earlier
+    (so the closing print is still picked up). Without exchange_calendars: weekdays, from 8 hours
+    before the configured close until the close.
+    """
+    now = now or dt.datetime.now(dt.timezone.utc)
+    cal = _exchange_calendar(market.calendar)
+    for t in (now, now - dt.timedelta(minutes=grace_min)) if grace_min else (now,):
+        if cal is not None:
+            import pandas as pd
+            try:
+                if cal.is_open_on_minute(pd.Timestamp(t).floor("min")):
+                    return True
+            except ValueError:  # outside the calendar's range
+                pass
+            continue
+        close = session_close(market, t.astimezone(ZoneInfo(market.timezone)).date())
+        if close is not None and close - dt.timedelta(hours=8) <= t <= close:
+            return True
+    return False
+
+def job_markets(job: str, config: dict) -> Dict[str, Market]:
+    """Name -> Market for every unit the job refreshes (index key for pe, MIC for quotes/macro)."""
+    if job == "pe":
+        return {key: Market(c["calendar"], c["timezone"], c["close"], c.get("publish_delay_min", 0))
+                for key, c in index_specs(config).items()}
+    if job == "quotes":
+        import symbols
+        markets = {}
+        for meta in symbols.get_indices().values():
+            markets.setdefault(meta["calendar"], Market(meta["calendar"], meta["timezone"], meta["close"]))
+        return markets
+    if job == "macro":
+        return {"XSHG": Market("XSHG", "Asia/Shanghai", "15:00")}
+    raise ValueError(f"unknown job: {job}")
+
+def load_state(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_state(path: str, state: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+def due(job: str, config: dict, state: dict, now: Optional[dt.datetime] = None,
+        force: bool = False) -> Dict[str, str]:
+    """Name -> latest closed session (ISO date) for the units of `job` that have something new."""
+    lookback = config.get("schedule", {}).get("lookback_days", 14)
+    done = state.get(job, {})
+    out = {}
+    for name, market in job_markets(job, config).items():
+        session = last_closed_session(market, now, lookback)
+        if session is None:
+            continue
+        if force or done.get(name, "") < session.isoformat():
+            out[name] = session.isoformat()
+    return out
+
+def run_job(job: str, sessions: Dict[str, str]) -> list:
+    """
+    Run the pipeline for `job` (sessions: name -> due session); returns the names that are up to
+    date. An index counts only once its stored PE reaches the session: a source that has not
+    published yet (empty fetch, no error) stays due and is retried on the next tick.
+    """
+    names = list(sessions)
+    if job == "pe":
+        import update_data
+        failures = update_data.main(keys=names)
+        failed = {key for key, _ in failures}
+        store = update_data.WideStore(update_data.DATA_DIR)
+        out = []
+        for name in names:
+            last = store.last_date(name, ["pe"])
+            if name not in failed and last is not None and last.isoformat() >= sessions[name]:
+                out.append(name)
+            elif name not in failed:
+                print(f"[pe] {name}: latest stored {last}, session {sessions[name]} not published yet")
+        return out
+    if job == "quotes":
+        import app
+        app.main()
+    elif job == "macro":
+        import goods
+        goods.main()
+    return list(names)
+
+def main(jobs=JOBS, dry_run: bool = False, force: bool = False) -> int:
+    config = load_config()
+    state_path = config.get("schedule", {}).get("state_path", os.path.join(".cache", "schedule.json"))
+    state = load_state(state_path)
+    ran = 0
+    for job in jobs:
+        todo = due(job, config, state, force=force)
+        if not todo:
+            print(f"[{job}] nothing new since the last refresh, skipping")
+            continue
+        print(f"[{job}] due: " + ", ".join(f"{n} ({s})" for n, s in todo.items()))
+        if dry_run:
+            continue
+        for name in run_job(job, todo):
+            state.setdefault(job, {})[name] = todo[name]
+        save_state(state_path, state)
+        ran += 1
+    return ran
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Refresh only the series whose markets have closed a new session.")
+    ap.add_argument("jobs", nargs="*", choices=JOBS + ("all",), default="all")
+    ap.add_argument("--dry-run", action="store_true", help="print what is due without fetching")
+    ap.add_argument("--force", action="store_true", help="refresh every market with a closed session")
+    args = ap.parse_args()
+    # an omitted positional yields the default string itself, not a list
+    names = [args.jobs] if isinstance(args.jobs, str) else args.jobs
+    jobs = JOBS if "all" in names else tuple(names)
+    main(jobs, dry_run=args.dry_run, force=args.force)
@@ -1,12 +1,18 @@
 #!/usr/bin/env bash
-# Cron entry (Beijing time): 0 15 * * 1-5 /path/to/project/scripts/cron_run.sh >> /path/to/project/cron.log 2>&1
+# Cron entry (any timezone; the scheduler exits at once when no market has closed a new session):
+#   15 * * * * /path/to/project/scripts/cron_run.sh >> /path/to/project/cron.log 2>&1
 set -euo pipefail
 cd "$(dirname "$0")/.."
 export NASDAQ_API_KEY="${NASDAQ_API_KEY:-YOUR_DATALINK_API_KEY}"
 # export HSI_JSON_URL="https://YOUR_VALID_JSON_ENDPOINT"   # optional
 # export NASDAQ_COMP_CSV="https://YOUR_OWN_CSV_WITH_DATE_PE_COLUMNS.csv"  # required until you provide Composite feed
-python3 -m venv .venv
+# Reuse the venv; reinstall only when requirements.txt changes
+[ -x .venv/bin/python3 ] || python3 -m venv .venv
 source .venv/bin/activate
-pip -q install -U pip
-pip -q install -r requirements.txt
-python3 update_data.py
\ No newline at end of file
+REQ_HASH="$(sha256sum requirements.txt | cut -d' ' -f1)"
+if [ "$(cat .venv/.requirements.sha256 2>/dev/null || true)" != "$REQ_HASH" ]; then
+  pip -q install -U pip
+  pip -q install -r requirements.txt
+  echo "$REQ_HASH" > .venv/.requirements.sha256
+fi
+python3 scheduler.py pe "$@"
@@ -1,4 +1,5 @@
 #!/usr/bin/env bash
+# In-memory dashboard server with range queries and SSE push (see server.py)
 set -euo pipefail
-cd site
-python3 -m http.server 8000
\ No newline at end of file
+cd "$(dirname "$0")/.."
+python3 server.py --port "${PORT:-8000}"
\ No newline at end of file
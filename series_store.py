@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Consolidated wide store for every valuation series (data/series.csv)
+- One row per date, one float column per series named "<KEY>.<metric>" (e.g. CSI300.pb)
+- Per-index frames (date + metric columns) are queued with merge(); flush() overlays them in one
+  pass, newer values winning, so the table is rebuilt once per run, not once per index
+- save() is append-only: rows after the last stored date are appended to the file. The file is
+  rewritten only when stored rows changed (revisions, backfills, --full), the set of series changed,
+  or its oldest row is more than TRIM_SLACK_DAYS past the history window (the windowed cut)
+- Columnar copies live in the indexed store (tsdb.py) and the per-index .bin/.parquet views
+"""
+import os
+import threading
+import datetime as dt
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from normalize import widen
+
+STORE_NAME = "series"
+TRIM_SLACK_DAYS = 365  # rows older than the history window tolerated in the file before a rewrite
+
+def column(key: str, metric: str) -> str:
+    return f"{key}.{metric}"
+
+class WideStore:
+    def __init__(self, data_dir: str):
+        self.csv_path = os.path.join(data_dir, STORE_NAME + ".csv")
+        self.frame = self._read()
+        self._pending = []
+        self._last_index = None
+        self._lock = threading.Lock()
+        self._cutoff = None
+        self._mark_saved(first=self._first())
+
+    def _first(self) -> Optional[pd.Timestamp]:
+        return self.frame.index[0] if len(self.frame) else None
+
+    def _mark_saved(self, first: Optional[pd.Timestamp] = None):
+        """
+        Remember what the file holds, so save() can tell an append from a rewrite. An append keeps
+        the file's first date (`first` None): it still holds the rows trim() dropped from memory.
+        """
+        self._saved_columns = list(self.frame.columns)
+        if first is not None or not len(self.frame):
+            self._saved_first = first
+        self._saved_last = self.frame.index[-1] if len(self.frame) else None
+        self._rewrite = False
+
+    def _read(self) -> pd.DataFrame:
+        if not os.path.exists(self.csv_path):
+            return pd.DataFrame(index=pd.DatetimeIndex([], name="date"), dtype="float64")
+        df = pd.read_csv(self.csv_path, index_col="date", parse_dates=["date"])
+        return df.astype("float64")
+
+    def keys(self, metric: str = "pe") -> List[str]:
+        suffix = "." + metric
+        return [c[:-len(suffix)] for c in self.frame.columns if c.endswith(suffix)]
+
+    def last_dates(self, key: str, metrics: Iterable[str]) -> Dict[str, dt.date]:
+        """Metric -> last stored date of `key`, for the metrics that have data."""
+        out = {}
+        for metric in metrics:
+            col = column(key, metric)
+            stamp = self.frame[col].last_valid_index() if col in self.frame.columns else None
+            if stamp is not None:
+                out[metric] = stamp.date()
+        return out
+
+    def last_date(self, key: str, metrics: Iterable[str]) -> Optional[dt.date]:
+        """
+        Earliest of the per-metric last dates of `key`; None when no metric has data yet. Metrics a
+        source never fills are ignored rather than forcing a full download.
+        """
+        return min(self.last_dates(key, metrics).values(), default=None)
+
+    def series(self, key: str, metric: str = "pe") -> pd.Series:
+        """Date-indexed values of one series (NaNs dropped)."""
+        col = column(key, metric)
+        if col not in self.frame.columns:
+            return pd.Series(dtype="float64", index=pd.DatetimeIndex([], name="date"), name=metric)
+        return self.frame[col].dropna().rename(metric)
+
+    def merge(self, key: str, df: pd.DataFrame, replace: bool = False):
+        """
+        Queue a date + metric-columns frame for `key` (thread-safe; applied by flush()).
+        With replace=True the key's stored columns are dropped first (full rebuild).
+        """
+        # canonical frames (normalize.canonical) are queued as they are: no re-parsing, no copy,
+        # float32 until flush()
+        index = pd.DatetimeIndex(df["date"], name="date")
+        with self._lock:
+            # a batch of indices usually shares one calendar: keep one copy of its dates
+            if self._last_index is not None and self._last_index.equals(index):
+                index = self._last_index
+            self._last_index = index
+        part = df.drop(columns="date").set_axis(index, axis=0)
+        if not index.is_unique:
+            part = part[~index.duplicated(keep="last")]
+        text = [m for m, dtype in part.dtypes.items() if not pd.api.types.is_numeric_dtype(dtype)]
+        if text:
+            part = part.assign(**{m: pd.to_numeric(part[m], errors="coerce") for m in text})
+        part = part.set_axis([column(key, m) for m in part.columns], axis=1)
+        with self._lock:
+            self._pending.append((key, part, replace))
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        frame = self.frame
+        drop = [c for key, _, replace in pending if replace for c in frame.columns if c.startswith(key + ".")]
+        if drop:
+            frame = frame.drop(columns=drop)
+            self._rewrite = True
+        parts = [part for _, part, _ in pending if len(part.columns)]
+        del pending
+        if parts:
+            update = self._combine(parts)
+            if not self._rewrite and self._revises(frame, update):
+                self._rewrite = True
+            cols = list(frame.columns) + [c for c in update.columns if c not in frame.columns]
+            frame = update.combine_first(frame)[cols]
+        self.frame = frame.sort_index()
+
+    @staticmethod
+    def _combine(parts: list) -> pd.DataFrame:
+        """
+        Queued parts -> one float64 frame on the union of their dates (a repeated column: the last
+        part wins). float32 parts are widened one at a time, each replacing its float32 original,
+        and concat keeps the widened parts' blocks instead of copying them into one.
+        """
+        for i, part in enumerate(parts):
+            if any(dtype == "float32" for dtype in part.dtypes):
+                parts[i] = pd.DataFrame({c: widen(v.to_numpy()) if v.dtype == "float32" else v
+                                         for c, v in part.items()}, index=part.index)
+        update = pd.concat(parts, axis=1)
+        return update.loc[:, ~update.columns.duplicated(keep="last")]
+
+    def _revises(self, frame: pd.DataFrame, update: pd.DataFrame) -> bool:
+        """
+        True when `update` sets a value on or before the last saved date that the file does not hold
+        already (a stored value is compared at the file's 6 significant digits).
+        """
+        if self._saved_last is None:
+            return False
+        head = update[update.index <= self._saved_last]
+        if not len(head):
+            return False
+        new = head.to_numpy()
+        old = frame.reindex(index=head.index, columns=head.columns).to_numpy()
+        return bool((~np.isnan(new) & ~np.isclose(new, old, rtol=1e-5, atol=0.0)).any())
+
+    def trim(self, years: int):
+        self._cutoff = pd.Timestamp.today().normalize() - pd.DateOffset(years=years)
+        self.frame = self.frame[self.frame.index >= self._cutoff].dropna(how="all")
+
+    def save(self) -> int:
+        """Append the rows after the last saved date, or rewrite the file (see module docstring); returns bytes written."""
+        os.makedirs(os.path.dirname(self.csv_path) or ".", exist_ok=True)
+        aged = (self._cutoff is not None and self._saved_first is not None
+                and self._saved_first < self._cutoff - pd.Timedelta(days=TRIM_SLACK_DAYS))
+        if (self._rewrite or aged or self._saved_last is None or not os.path.exists(self.csv_path)
+                or list(self.frame.columns) != self._saved_columns):
+            tmp = self.csv_path + ".tmp"
+            self.frame.to_csv(tmp, date_format="%Y-%m-%d", float_format="%.6g", encoding="utf-8")
+            os.replace(tmp, self.csv_path)
+            written, appended = os.path.getsize(self.csv_path), False
+            print(f"Wrote {self.csv_path}  rows={len(self.frame)} series={len(self.frame.columns)}")
+        else:
+            rows = self.frame[self.frame.index > self._saved_last]
+            text = rows.to_csv(header=False, date_format="%Y-%m-%d", float_format="%.6g").encode("utf-8")
+            with open(self.csv_path, "r+b") as f:
+                size = f.seek(0, os.SEEK_END)
+                try:
+                    f.write(text)
+                    f.flush()
+                    os.fsync(f.fileno())
+                except BaseException:
+                    # never leave a half-written row behind
+                    f.truncate(size)
+                    raise
+            written, appended = len(text), True
+            print(f"Appended {self.csv_path}  new_rows={len(rows)} series={len(self.frame.columns)}")
+        self._mark_saved(first=None if appended else self._first())
+        return written
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Long-lived dashboard server (stdlib asyncio, one event loop for all connections)
+- Loads the PE columns of data/series.csv, data.json and goods.json into memory once; reloads when
+  the files change
+- GET /pe                          -> available PE series
+- GET /pe/<KEY>?from=YYYY-MM-DD&to=YYYY-MM-DD
+                                   -> {"key", "dates", "pe"} sliced by binary search on the date index
+- GET /quotes, GET /macro          -> data.json / goods.json (pre-serialized, gzip when accepted)
+- GET /relative                    -> cross-index PE spread / ratio / percentile / correlation matrices
+                                      (data/relative/matrix.json, see relative.py)
+- GET /events                      -> Server-Sent Events: "pe" (new rows), "quotes" (changed symbols), "macro",
+                                      "relative" (changed matrices)
+- Static files: index.html, goods.html, manifest.json, goods.manifest.json, assets/, site/ only;
+  data/ (the SQLite store, caches) is never served directly (hashed assets/ are served immutable;
+  precompressed .gz variants are used when present)
+- Reloads read and parse the files in a worker thread (asyncio.to_thread); only swapping the results
+  in runs on the event loop, so SSE clients are not stalled by a large CSV. A file that fails to
+  parse (caught mid-write) is retried on the next poll
+
+- --intraday runs the quote poller (intraday.py) on the same loop and pushes its changes directly
+
+Usage: python3 server.py [--host 127.0.0.1] [--port 8000] [--poll 5] [--intraday]
+(binds to localhost by default; pass --host 0.0.0.0 to expose it)
+"""
+import os
+import csv
+import json
+import gzip
+import asyncio
+import argparse
+import mimetypes
+import datetime as dt
+from typing import Optional
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import numpy as np
+
+from sources import load_config
+
+DATA_DIR = "data"
+STORE_FILE = "series.csv"
+STATIC_ROOTS = ("assets/", "site/")
+STATIC_FILES = ("index.html", "goods.html", "manifest.json", "goods.manifest.json")
+SSE_QUEUE_SIZE = 64
+MAX_HEADER_BYTES = 16 * 1024
+
+def history_start() -> str:
+    """First date of the history window (config.json history_years), ISO formatted."""
+    today, years = dt.date.today(), load_config().get("history_years", 10)
+    try:
+        return today.replace(year=today.year - years).isoformat()
+    except ValueError:  # Feb 29
+        return today.replace(year=today.year - years, day=28).isoformat()
+
+class Series:
+    """One PE series as sorted datetime64[D] dates plus float64 values."""
+    def __init__(self, dates: np.ndarray, values: np.ndarray):
+        self.dates = dates
+        self.values = values
+
+    @classmethod
+    def from_wide_csv(cls, path: str, metric: str = "pe", start: str = "") -> dict:
+        """
+        Key -> Series for every "<KEY>.<metric>" column of the wide store (empty cells skipped).
+        Rows dated before `start` (ISO) are skipped: the append-only file may still hold rows that
+        aged out of the history window.
+        """
+        suffix = "." + metric
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            cols = {i: name[:-len(suffix)] for i, name in enumerate(header) if name.endswith(suffix)}
+            dates, values = [], {i: [] for i in cols}
+            for row in reader:
+                if not row or row[0][:10] < start:
+                    continue
+                dates.append(row[0][:10])
+                for i in cols:
+                    try:
+                        values[i].append(float(row[i]) if row[i] else np.nan)
+                    except (IndexError, ValueError):
+                        values[i].append(np.nan)
+        d = np.array(dates, dtype="datetime64[D]")
+        order = np.argsort(d, kind="stable")
+        out = {}
+        for i, key in cols.items():
+            v = np.array(values[i], dtype=np.float64)[order]
+            keep = ~np.isnan(v)
+            out[key] = cls(d[order][keep], v[keep])
+        return out
+
+    def slice(self, start=None, end=None) -> dict:
+        lo = 0 if start is None else int(np.searchsorted(self.dates, np.datetime64(start, "D"), "left"))
+        hi = len(self.dates) if end is None else int(np.searchsorted(self.dates, np.datetime64(end, "D"), "right"))
+        return {"dates": self.dates[lo:hi].astype(str).tolist(), "pe": np.round(self.values[lo:hi], 4).tolist()}
+
+class Store:
+    """In-memory artifacts, reloaded by mtime polling; changes are broadcast to SSE subscribers."""
+    def __init__(self, root: str):
+        self.root = root
+        self.series = {}
+        self.docs = {}          # "quotes" / "macro" -> parsed JSON
+        self.blobs = {}         # "quotes" / "macro" -> (raw bytes, gzip bytes)
+        self.mtimes = {}
+        self.subscribers = set()
+
+    def _path(self, rel: str) -> str:
+        return os.path.join(self.root, rel)
+
+    def _changed(self, rel: str) -> Optional[int]:
+        """The file's mtime when it differs from the one last loaded, else None (also when missing)."""
+        try:
+            m = os.stat(self._path(rel)).st_mtime_ns
+        except OSError:
+            return None
+        return None if self.mtimes.get(rel) == m else m
+
+    def load(self) -> tuple:
+        """
+        Read and parse the changed files (blocking: run it off the event loop). Returns
+        (series, pe events, docs, mtimes) for apply(): the reloaded PE series (None when unchanged),
+        their new rows as ("pe", payload) events, doc -> (parsed, raw, gzip bytes), and the mtimes
+        of the files parsed. A file that fails to parse (half-written, corrupt) keeps its previous
+        mtime, so the next poll retries it.
+        """
+        series, events, mtimes = None, [], {}
+        rel = os.path.join(DATA_DIR, STORE_FILE)
+        m = self._changed(rel)
+        if m is not None:
+            try:
+                series = Series.from_wide_csv(self._path(rel), start=history_start())
+                mtimes[rel] = m
+            except (OSError, ValueError, csv.Error) as e:
+                print(f"[WARN] {rel} not reloaded, retrying on the next poll: {e}")
+        for key, new in (series or {}).items():
+            old = self.series.get(key)
+            if old is not None and len(old.dates):
+                delta = new.slice(start=old.dates[-1] + np.timedelta64(1, "D"))
+            else:
+                delta = new.slice()
+            if delta["dates"]:
+                first = str(new.dates[0]) if len(new.dates) else None
+                events.append(("pe", {"key": key, "first": first, **delta}))
+        docs = {}
+        for doc, rel in (("quotes", "data.json"), ("macro", "goods.json"),
+                         ("relative", os.path.join(DATA_DIR, "relative", "matrix.json"))):
+            m = self._changed(rel)
+            if m is None:
+                continue
+            try:
+                with open(self._path(rel), "rb") as f:
+                    raw = f.read()
+                docs[doc] = (json.loads(raw), raw, gzip.compress(raw, 6))
+                mtimes[rel] = m
+            except (OSError, ValueError) as e:
+                print(f"[WARN] {rel} not reloaded, retrying on the next poll: {e}")
+        return series, events, docs, mtimes
+
+    def apply(self, loaded: tuple) -> list:
+        """Swap in what load() read; returns (event, payload) pairs describing the deltas."""
+        series, events, docs, mtimes = loaded
+        if series is not None:
+            self.series.update(series)
+        for doc, (parsed, raw, gz) in docs.items():
+            old = self.docs.get(doc) or {}
+            self.docs[doc] = parsed
+            self.blobs[doc] = (raw, gz)
+            changed = {k: v for k, v in parsed.items() if old.get(k) != v}
+            if changed:
+                events.append((doc, changed))
+        self.mtimes.update(mtimes)
+        return events
+
+    def refresh(self) -> list:
+        """Reload changed files synchronously (startup, scripts)."""
+        return self.apply(self.load())
+
+    def push(self, doc: str, parsed: dict, changed: dict) -> None:
+        """In-process update (intraday poller): swap the document and broadcast only `changed`."""
+        raw = json.dumps(parsed, ensure_ascii=False, indent=2).encode("utf-8")
+        self.docs[doc] = parsed
+        self.blobs[doc] = (raw, gzip.compress(raw, 6))
+        self.broadcast(doc, changed)
+
+    def broadcast(self, event: str, payload) -> None:
+        msg = f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False, separators=(',', ':'))}\n\n".encode("utf-8")
+        for q in list(self.subscribers):
+            try:
+                q.put_nowait(msg)
+            except asyncio.QueueFull:
+                # Slow client: drop it rather than buffer without bound
+                self.subscribers.discard(q)
+
+    async def watch(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                for event, payload in self.apply(await asyncio.to_thread(self.load)):
+                    self.broadcast(event, payload)
+            except Exception as e:
+                print(f"[WARN] reload failed: {e}")
+
+def _response(status: str, body: bytes, ctype: str, extra=None, keep_alive=True) -> bytes:
+    headers = [f"HTTP/1.1 {status}", f"Content-Type: {ctype}", f"Content-Length: {len(body)}",
+               f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    headers += [f"{k}: {v}" for k, v in (extra or {}).items()]
+    return ("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body
+
+def _json(obj, accept_gzip: bool, keep_alive: bool, cache="no-cache") -> bytes:
+    body = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    extra = {"Cache-Control": cache}
+    if accept_gzip and len(body) > 1024:
+        body = gzip.compress(body, 6)
+        extra["Content-Encoding"] = "gzip"
+    return _response("200 OK", body, "application/json; charset=utf-8", extra, keep_alive)
+
+class Server:
+    def __init__(self, store: Store):
+        self.store = store
+
+    def _static(self, path: str, accept_gzip: bool, keep_alive: bool) -> bytes:
+        rel = path.lstrip("/") or "index.html"
+        if rel.endswith("/"):
+            rel += "index.html"
+        if ".." in rel.split("/") or not (rel in STATIC_FILES or rel.startswith(STATIC_ROOTS)):
+            return _response("404 Not Found", b"not found", "text/plain", keep_alive=keep_alive)
+        full = os.path.join(self.store.root, rel)
+        if not os.path.isfile(full):
+            return _response("404 Not Found", b"not found", "text/plain", keep_alive=keep_alive)
+        ctype = mimetypes.guess_type(full)[0] or "application/octet-stream"
+        if ctype.startswith("text/") or ctype == "application/json":
+            ctype += "; charset=utf-8"
+        immutable = rel.startswith("assets/") or "/assets/" in rel
+        extra = {"Cache-Control": "public, max-age=31536000, immutable" if immutable else "no-cache"}
+        if accept_gzip and os.path.isfile(full + ".gz"):
+            full += ".gz"
+            extra["Content-Encoding"] = "gzip"
+        with open(full, "rb") as f:
+            body = f.read()
+        return _response("200 OK", body, ctype, extra, keep_alive)
+
+    def route(self, method: str, target: str, headers: dict) -> bytes:
+        url = urlsplit(target)
+        path = unquote(url.path)
+        keep_alive = headers.get("connection", "").lower() != "close"
+        accept_gzip = "gzip" in headers.get("accept-encoding", "")
+        if method not in ("GET", "HEAD"):
+            return _response("405 Method Not Allowed", b"", "text/plain", keep_alive=keep_alive)
+        if path == "/pe":
+            return _json(sorted(self.store.series), accept_gzip, keep_alive)
+        if path.startswith("/pe/"):
+            key = path[4:]
+            series = self.store.series.get(key)
+            if series is None:
+                return _response("404 Not Found", b"unknown series", "text/plain", keep_alive=keep_alive)
+            q = parse_qs(url.query)
+            try:
+                out = series.slice(q.get("from", [None])[0], q.get("to", [None])[0])
+            except ValueError:
+                return _response("400 Bad Request", b"bad date", "text/plain", keep_alive=keep_alive)
+            return _json({"key": key, **out}, accept_gzip, keep_alive)
+        if path in ("/quotes", "/macro", "/relative"):
+            blob = self.store.blobs.get(path[1:])
+            if blob is None:
+                return _response("404 Not Found", b"not loaded", "text/plain", keep_alive=keep_alive)
+            raw, gz = blob
+            extra = {"Cache-Control": "no-cache"}
+            if accept_gzip:
+                extra["Content-Encoding"] = "gzip"
+                return _response("200 OK", gz, "application/json; charset=utf-8", extra, keep_alive)
+            return _response("200 OK", raw, "application/json; charset=utf-8", extra, keep_alive)
+        return self._static(path, accept_gzip, keep_alive)
+
+    async def sse(self, writer: asyncio.StreamWriter) -> None:
+        q = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+        self.store.subscribers.add(q)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Connection: keep-alive\r\n\r\nretry: 5000\n\n")
+        try:
+            await writer.drain()
+            while q in self.store.subscribers:
+                try:
+                    msg = await asyncio.wait_for(q.get(), timeout=25)
+                except asyncio.TimeoutError:
+                    msg = b": ping\n\n"
+                writer.write(msg)
+                await writer.drain()
+        finally:
+            self.store.subscribers.discard(q)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                parts = lines[0].split(" ")
+                if len(parts) != 3:
+                    break
+                method, target, _ = parts
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        k, v = line.split(":", 1)
+                        headers[k.strip().lower()] = v.strip()
+                if urlsplit(target).path == "/events":
+                    await self.sse(writer)
+                    break
+                resp = self.route(method, target, headers)
+                if method == "HEAD":
+                    resp = resp.split(b"\r\n\r\n", 1)[0] + b"\r\n\r\n"
+                writer.write(resp)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(host: str, port: int, poll: float, root: str, intraday: bool = False) -> None:
+    store = Store(root)
+    store.apply(await asyncio.to_thread(store.load))
+    print(f"Loaded {len(store.series)} PE series, docs={sorted(store.docs)}")
+    app = Server(store)
+    server = await asyncio.start_server(app.handle, host, port, limit=MAX_HEADER_BYTES, backlog=2048)
+    asyncio.create_task(store.watch(poll))
+    if intraday:
+        # same loop: polled quotes reach SSE clients on flush; the file watcher then sees no diff
+        from intraday import QuotePoller
+        poller = QuotePoller(store.docs.get("quotes") or {}, path=os.path.join(root, "data.json"),
+                             sink=lambda doc, changed: store.push("quotes", dict(doc), changed))
+        asyncio.create_task(poller.run())
+    print(f"Serving on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    ap = argparse.ArgumentParser(description="PE dashboard server")
+    ap.add_argument("--host", default="127.0.0.1", help="interface to bind (0.0.0.0 exposes the server)")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--poll", type=float, default=5.0, help="seconds between artifact change checks")
+    ap.add_argument("--root", default=os.path.dirname(os.path.abspath(__file__)))
+    ap.add_argument("--intraday", action="store_true", help="also poll index quotes (intraday.py) in this process")
+    args = ap.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.poll, args.root, args.intraday))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
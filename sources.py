@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Source registry for the valuation series in config.json
+- "sources": one block per upstream (loader, host, batch_size, default metrics, trading calendar)
+- "indices": one entry per index; any field overrides its source's default
+index_specs() merges the two, so hundreds of indices can share a source block and an index entry
+only needs its source plus an identifier (e.g. a CSIndex code).
+"""
+import os
+import json
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+DEFAULT_METRICS = ["pe"]
+
+@lru_cache(maxsize=None)
+def load_config(path: str = CONFIG_PATH) -> dict:
+    """Parsed config.json, read once per process (callers must not mutate it)."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def index_specs(config: dict) -> Dict[str, dict]:
+    """Index key -> source defaults overlaid with the index entry (plus "key" and "source")."""
+    sources = config.get("sources", {})
+    specs = {}
+    for key, meta in config["indices"].items():
+        name = meta["source"]
+        if name not in sources:
+            raise KeyError(f"index {key}: unknown source {name!r}")
+        spec = dict(sources[name], **meta)
+        spec["key"] = key
+        spec.setdefault("host", name)
+        spec.setdefault("metrics", list(DEFAULT_METRICS))
+        spec.setdefault("label", meta.get("name", key))
+        specs[key] = spec
+    return specs
+
+def batches(specs: Dict[str, dict], keys) -> List[Tuple[str, List[str]]]:
+    """Group `keys` by source (first-seen order) and split each group into batch_size chunks."""
+    groups = {}
+    for key in keys:
+        groups.setdefault(specs[key]["source"], []).append(key)
+    out = []
+    for name, group in groups.items():
+        size = max(1, int(specs[group[0]].get("batch_size", 1)))
+        out += [(name, group[i:i + size]) for i in range(0, len(group), size)]
+    return out
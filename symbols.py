@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Local symbol metadata registry (symbols.json)
+- Per index: symbol, region, currency, exchange, timezone, trading calendar (MIC) and session close
+- Loaded lazily on first use and cached for the process
+- refresh_in_background() re-reads currency / exchange / timezone from the provider at most every
+  REFRESH_DAYS, on a separate thread, so the quote refresh path never waits on it
+"""
+import os
+import json
+import threading
+import datetime as dt
+from typing import Callable, Optional
+
+REGISTRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "symbols.json")
+REFRESH_DAYS = 7
+
+# provider info key -> registry field
+INFO_FIELDS = {"currency": "currency", "exchange": "exchange", "exchangeTimezoneName": "timezone"}
+
+_registry = None
+_lock = threading.Lock()
+
+def get_registry() -> dict:
+    global _registry
+    with _lock:
+        if _registry is None:
+            with open(REGISTRY_PATH, "r", encoding="utf-8") as f:
+                _registry = json.load(f)
+        return _registry
+
+def get_indices() -> dict:
+    """Display name -> metadata, in registry order."""
+    return get_registry()["indices"]
+
+def by_symbol(symbol: str) -> Optional[dict]:
+    for name, meta in get_indices().items():
+        if meta["symbol"] == symbol:
+            return dict(meta, name=name)
+    return None
+
+def is_stale(today: Optional[dt.date] = None) -> bool:
+    stamp = get_registry().get("refreshed_at")
+    if not stamp:
+        return True
+    today = today or dt.date.today()
+    return (today - dt.date.fromisoformat(stamp)).days >= REFRESH_DAYS
+
+def _save(registry: dict):
+    tmp = REGISTRY_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(registry, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, REGISTRY_PATH)
+
+def refresh(fetch_info: Callable[[str], dict]) -> int:
+    """
+    Update currency / exchange / timezone for every symbol from `fetch_info(symbol)` (e.g. yfinance
+    Ticker.info). Symbols whose lookup fails keep their current values. Returns the number updated.
+    """
+    registry = json.loads(json.dumps(get_registry()))
+    updated = 0
+    for meta in registry["indices"].values():
+        try:
+            info = fetch_info(meta["symbol"]) or {}
+        except Exception as e:
+            print(f"[WARN] metadata refresh failed for {meta['symbol']}: {e}")
+            continue
+        for src, dst in INFO_FIELDS.items():
+            if info.get(src):
+                meta[dst] = info[src]
+        updated += 1
+    registry["refreshed_at"] = dt.date.today().isoformat()
+    _save(registry)
+    global _registry
+    with _lock:
+        _registry = registry
+    return updated
+
+def refresh_in_background(fetch_info: Callable[[str], dict]) -> Optional[threading.Thread]:
+    """Start a refresh thread when the registry is older than REFRESH_DAYS; returns it (or None)."""
+    if not is_stale():
+        return None
+    t = threading.Thread(target=refresh, args=(fetch_info,), name="symbols-refresh")
+    t.start()
+    return t
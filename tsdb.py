@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Embedded time-series store (SQLite) shared by the three pipelines
+- points(series, date, value), primary key (series, date), so every query below is an index range
+  scan over one series instead of a full file parse
+- series names: "<KEY>.<metric>" for valuation series (same as the wide store, e.g. CSI300.pb),
+  "quotes.<index name>.<field>" for app.py snapshots, "macro.<indicator>" for goods.py (monthly,
+  dated the first of the month)
+- range(), asof() and resample() (W / M / Q / Y buckets, last / first / mean / min / max) answer in
+  milliseconds; upsert_frame() / upsert_rows() take whole batches in one transaction
+
+The file lives next to the wide store (data/timeseries.sqlite; override with TSDB_PATH).
+"""
+import os
+import re
+import sqlite3
+import threading
+import datetime as dt
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+DB_PATH = os.getenv("TSDB_PATH", os.path.join("data", "timeseries.sqlite"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS points (
+    series TEXT NOT NULL,
+    date   TEXT NOT NULL,
+    value  REAL,
+    PRIMARY KEY (series, date)
+) WITHOUT ROWID
+"""
+
+# bucket expressions over the ISO date column; weeks run Monday..Sunday (1970-01-05 was a Monday)
+BUCKETS = {
+    "W": "CAST((julianday(date) - julianday('1970-01-05')) / 7 AS INTEGER)",
+    "M": "substr(date, 1, 7)",
+    "Q": "substr(date, 1, 4) || ((CAST(substr(date, 6, 2) AS INTEGER) + 2) / 3)",
+    "Y": "substr(date, 1, 4)",
+}
+# aggregate -> (value expression, label expression); SQLite returns the row of MAX()/MIN() for bare columns
+AGGREGATES = {
+    "last": ("value", "MAX(date)"),
+    "first": ("value", "MIN(date)"),
+    "mean": ("AVG(value)", "MAX(date)"),
+    "min": ("MIN(value)", "MAX(date)"),
+    "max": ("MAX(value)", "MAX(date)"),
+}
+
+def _iso(day) -> str:
+    return pd.Timestamp(day).strftime("%Y-%m-%d")
+
+def month_start(period: str) -> Optional[str]:
+    """'2024.10' / '2024年10月' / '2024-10' -> '2024-10-01' (None when no year and month are found)."""
+    m = re.search(r"(\d{4})\D+(\d{1,2})", period or "")
+    if not m or not 1 <= int(m.group(2)) <= 12:
+        return None
+    return f"{m.group(1)}-{int(m.group(2)):02d}-01"
+
+class TimeSeriesDB:
+    def __init__(self, path: str = DB_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(SCHEMA)
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---- writes ----
+    def upsert_rows(self, rows: Iterable[Tuple[str, str, Optional[float]]], replace_series: Iterable[str] = ()) -> int:
+        """Insert or replace (series, ISO date, value) rows in one transaction; `replace_series` are cleared first."""
+        rows = list(rows)
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM points WHERE series = ?", [(s,) for s in replace_series])
+            self.conn.executemany("INSERT OR REPLACE INTO points VALUES (?,?,?)", rows)
+        return len(rows)
+
+    def upsert_frame(self, frame: pd.DataFrame, replace: bool = False) -> int:
+        """
+        Bulk upsert a date-indexed frame with one column per series (e.g. the wide store); NaNs are
+        skipped. With replace=True the frame's series are cleared first.
+        """
+        dates = pd.DatetimeIndex(frame.index).strftime("%Y-%m-%d")
+        rows = []
+        for col in frame.columns:
+            values = frame[col].to_numpy(dtype="float64")
+            keep = values == values
+            rows += zip([col] * int(keep.sum()), dates[keep], values[keep].tolist())
+        return self.upsert_rows(rows, replace_series=frame.columns if replace else ())
+
+    # ---- reads ----
+    def series_names(self, prefix: str = "") -> List[str]:
+        with self.lock:
+            # DISTINCT over the primary key prefix is an index skip scan
+            rows = self.conn.execute("SELECT DISTINCT series FROM points WHERE series >= ? AND series < ?",
+                                     (prefix, prefix + "\uffff")).fetchall()
+        return [r[0] for r in rows]
+
+    def last_dates(self, prefix: str = "") -> Dict[str, dt.date]:
+        with self.lock:
+            rows = self.conn.execute("SELECT series, MAX(date) FROM points WHERE series >= ? AND series < ? "
+                                     "GROUP BY series", (prefix, prefix + "\uffff")).fetchall()
+        return {s: dt.date.fromisoformat(d) for s, d in rows}
+
+    def range(self, series: str, start=None, end=None) -> pd.Series:
+        """Values of `series` with start <= date <= end (either bound optional), date-indexed."""
+        sql = "SELECT date, value FROM points WHERE series = ?"
+        args = [series]
+        if start is not None:
+            sql += " AND date >= ?"
+            args.append(_iso(start))
+        if end is not None:
+            sql += " AND date <= ?"
+            args.append(_iso(end))
+        with self.lock:
+            rows = self.conn.execute(sql + " ORDER BY date", args).fetchall()
+        return self._to_series(rows, series)
+
+    def asof(self, series: str, when=None) -> Optional[Tuple[dt.date, float]]:
+        """Latest (date, value) of `series` on or before `when` (default: latest overall)."""
+        with self.lock:
+            row = self.conn.execute("SELECT date, value FROM points WHERE series = ? AND date <= ? "
+                                    "ORDER BY date DESC LIMIT 1",
+                                    (series, _iso(when) if when is not None else "9999-12-31")).fetchone()
+        return (dt.date.fromisoformat(row[0]), row[1]) if row else None
+
+    def asof_many(self, series: Iterable[str], when=None) -> Dict[str, Tuple[dt.date, float]]:
+        out = {}
+        for name in series:
+            hit = self.asof(name, when)
+            if hit is not None:
+                out[name] = hit
+        return out
+
+    def resample(self, series: str, rule: str = "M", how: str = "last", start=None, end=None) -> pd.Series:
+        """
+        Daily -> weekly / monthly / quarterly / yearly buckets (rule W / M / Q / Y), aggregated in SQL.
+        Each bucket is labelled with its last observed date (its first one for how="first").
+        """
+        value_expr, label_expr = AGGREGATES[how]
+        sql = f"SELECT {label_expr}, {value_expr} FROM points WHERE series = ?"
+        args = [series]
+        if start is not None:
+            sql += " AND date >= ?"
+            args.append(_iso(start))
+        if end is not None:
+            sql += " AND date <= ?"
+            args.append(_iso(end))
+        sql += f" GROUP BY {BUCKETS[rule]} ORDER BY 1"
+        with self.lock:
+            rows = self.conn.execute(sql, args).fetchall()
+        return self._to_series(rows, series)
+
+    @staticmethod
+    def _to_series(rows, name: str) -> pd.Series:
+        if not rows:
+            return pd.Series(dtype="float64", index=pd.DatetimeIndex([], name="date"), name=name)
+        dates, values = zip(*rows)
+        return pd.Series(values, index=pd.DatetimeIndex(dates, name="date"), name=name, dtype="float64")
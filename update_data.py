@@ -4,14 +4,22 @@
 
 """
 PE Dashboard Updater
-- Fetches/refreshes 10-year TTM P/E time series for: S&P 500, CSI 300, Hang Seng Index, Nasdaq Composite
-- Writes CSVs under ./data and renders a static ECharts dashboard under ./site
+- Fetches/refreshes 10-year valuation series (PE TTM, plus PB / dividend yield where the source has them)
+  for every index registered in config.json (see sources.py), batched per source
+- Writes one wide store (data/series.csv, see series_store.py), mirrors it into the indexed store
+  (data/timeseries.sqlite, see tsdb.py) and writes per-index PE views under ./data
+  and renders a static ECharts dashboard under ./site
+- Maintains cross-index relative valuation (PE spread / ratio / percentile / correlation matrices on a
+  common business-day grid, data/relative/, see relative.py)
+- Fetched rows are put in date order (a repeated date keeps its last non-NaN value) and values failing
+  the range checks are dropped; the stored series get a quality mask (jump, outlier, staleness,
+  cross-source outliers between the feeds of cross-checked indices; data/quality.csv, see validation.py)
 
 Important:
 - S&P 500: uses Nasdaq Data Link (MULTPL datasets). Set NASDAQ_API_KEY in env.
-- CSI 300: uses AkShare to pull CSIndex valuation (市盈率TTM).
-- HSI: tries Hang Seng Indexes valuation JSON (if reachable), else tries GuruFocus econ indicator page scrape (may require cookies/login).
-- NASDAQ Composite: No stable free API; function provided to plug your own CSV URL or use GuruFocus if available.
+- CSI 300 and other CSIndex indices: uses AkShare to pull CSIndex valuation (市盈率TTM / 市净率 / 股息率).
+- HSI: races Hang Seng Indexes valuation JSON (if HSI_JSON_URL is set) against a GuruFocus econ indicator page scrape (may require cookies/login), see hedge.py.
+- NASDAQ Composite: No stable free API; plug your own CSV and/or JSON feed URLs (raced the same way).
 """
 import os
 import io
@@ -20,19 +28,37 @@ import json
 import time
 import math
 import csv
+import threading
 import datetime as dt
+from concurrent.futures import Future, wait, FIRST_COMPLETED
 from dataclasses import dataclass
 from typing import Optional
 
 import pandas as pd
-import requests
 from tenacity import retry, stop_after_attempt, wait_fixed
 
-CONFIG = json.load(open("config.json", "r", encoding="utf-8"))
+from http_session import cached_get
+from chart_payload import build_chart_payload
+from publish import publish_files
+from analytics import update_analytics
+from series_store import WideStore, column
+from relative import update_relative, WINDOW_DAYS, CORR_WINDOW_DAYS, FFILL_LIMIT_DAYS
+from sources import load_config, index_specs, batches
+import metrics
+import validation
+from normalize import canonical
+from tsdb import TimeSeriesDB
+from hedge import HealthBook, FeedsFailed, STATE_PATH, gather, race
+
+CONFIG = load_config()
+SPECS = index_specs(CONFIG)
+HISTORY_YEARS = CONFIG.get("history_years", 10)
 DATA_DIR = CONFIG["output"]["data_dir"]
 SITE_DIR = CONFIG["output"]["site_dir"]
-os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs(SITE_DIR, exist_ok=True)
+
+def ensure_dirs():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    os.makedirs(SITE_DIR, exist_ok=True)
 
 def to_date(x):
     if pd.isna(x): return None
@@ -42,151 +68,404 @@ def to_date(x):
     except Exception:
         return None
 
-def last_n_years(df: pd.DataFrame, n=10, date_col="date"):
-    if df.empty: return df
-    df = df.copy()
-    df[date_col] = pd.to_datetime(df[date_col])
-    cutoff = pd.Timestamp.today().normalize() - pd.DateOffset(years=n)
-    return df[df[date_col] >= cutoff].sort_values(date_col)
+def history_start(years: int = HISTORY_YEARS) -> pd.Timestamp:
+    """First date kept in the history window."""
+    return pd.Timestamp.today().normalize() - pd.DateOffset(years=years)
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
+@retry(stop=stop_after_attempt(3), wait=wait_fixed(2), before_sleep=metrics.note_retry)
 def http_get(url, **kwargs):
+    """
+    GET via the shared pooled/cached session (see http_session.cached_get).
+    `resp.from_cache` is True when the body is unchanged since the last run.
+    """
     headers = kwargs.pop("headers", {})
     headers.setdefault("User-Agent", "PE-Dashboard/1.0 (+https://example.com)")
-    resp = requests.get(url, headers=headers, timeout=20, **kwargs)
+    resp = cached_get(url, headers=headers, timeout=20, **kwargs)
     resp.raise_for_status()
     return resp
 
-def save_csv(df: pd.DataFrame, path: str):
-    df = df.copy()
-    df["date"] = pd.to_datetime(df["date"]).dt.date
-    df.to_csv(path, index=False, encoding="utf-8")
-    print(f"Wrote {path}  rows={len(df)}")
+def fetch_url(url, source: str, key: str = "", **kwargs):
+    """http_get inside a metrics "fetch" stage (bytes, cache hit/miss and retries are recorded)."""
+    with metrics.stage("fetch", source, key):
+        return http_get(url, **kwargs)
 
-# ---------- Loaders ----------
+EPOCH = dt.date(1970, 1, 1)
 
-def sp500_from_nasdaq_datalink(api_key: Optional[str] = None) -> pd.DataFrame:
+def write_columnar(pe: pd.Series, base: str):
     """
-    MULTPL/SP500_PE_RATIO_DAILY (preferred) or MULTPL/SP500_PE_RATIO_MONTH fallback
-    Columns usually: Date, Value
+    Write compact columnar copies of a date-indexed PE series:
+    - <base>.bin: raw little-endian blob, n int32 day offsets from 1970-01-01 followed by
+      n float32 PE values (n = byteLength / 8), viewable as two typed arrays in the page
+    - <base>.parquet: date32 + float32 columns for Python consumers (needs pyarrow; skipped if absent)
     """
-    api_key = api_key or os.getenv("NASDAQ_API_KEY")
-    if not api_key:
-        raise RuntimeError("Set NASDAQ_API_KEY env for S&P 500 loader.")
-    def fetch(dataset):
-        url = f"https://data.nasdaq.com/api/v3/datasets/{dataset}.csv"
-        params = {"api_key": api_key}
-        r = http_get(url, params=params)
-        df = pd.read_csv(io.StringIO(r.text))
-        # Normalize
-        date_col = [c for c in df.columns if c.lower().startswith("date")][0]
-        value_col = [c for c in df.columns if c.lower() in ("value","pe_ratio","ratio")][0]
-        return df.rename(columns={date_col:"date", value_col:"pe"})
+    import numpy as np
+    days = (pd.DatetimeIndex(pe.index).values.astype("datetime64[D]").astype("<i4")
+            if len(pe) else np.empty(0, dtype="<i4"))
+    values = pe.to_numpy(dtype="<f4")
+    tmp = base + ".bin.tmp"
+    with open(tmp, "wb") as f:
+        f.write(days.tobytes())
+        f.write(values.tobytes())
+    os.replace(tmp, base + ".bin")
     try:
-        df = fetch(CONFIG["indices"]["SP500"]["datalink_dataset_daily"])
-    except Exception:
-        df = fetch(CONFIG["indices"]["SP500"]["datalink_dataset_monthly"])
-    df = df[["date","pe"]].dropna()
-    return last_n_years(df, n=10)
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        return
+    table = pa.table({"date": pa.array(days, pa.int32()).cast(pa.date32()), "pe": pa.array(values, pa.float32())})
+    pq.write_table(table, base + ".parquet")
+
+# ---------- Sources ----------
+# Every loader takes the resolved specs of one batch of indices sharing a source (see
+# sources.index_specs) plus key -> {metric: last stored date} (None on a full run), and returns
+# key -> frame (date + one column per metric) or the exception that index failed with. Trimming to history_years and
+# to rows after the stored date is left to run_batch, so loaders only fetch and normalize.
+
+DATALINK_URL = "https://data.nasdaq.com/api/v3/datasets/{dataset}.csv"
+
+# CSIndex column names by metric, preferred first (AkShare versions label them differently)
+CSINDEX_COLUMNS = {
+    "pe": ("市盈率TTM", "市盈率(TTM)", "市盈率2"),
+    "pb": ("市净率", "市净率2"),
+    "dy": ("股息率", "股息率2"),
+}
 
-def csi300_from_csindex_via_akshare() -> pd.DataFrame:
+def parse_datalink_csv(text: str, metric: str = "pe") -> pd.DataFrame:
+    """Nasdaq Data Link dataset CSV -> date,<metric> (column names vary between datasets)."""
+    df = pd.read_csv(io.StringIO(text))
+    date_col = [c for c in df.columns if c.lower().startswith("date")][0]
+    value_col = [c for c in df.columns if c.lower() in ("value","pe_ratio","ratio")][0]
+    return df.rename(columns={date_col:"date", value_col:metric})
+
+def normalize_csindex(df: pd.DataFrame) -> pd.DataFrame:
+    """CSIndex valuation table (as returned by AkShare) -> date + pe (市盈率TTM), pb (市净率), dy (股息率)."""
+    # Expected columns: ['日期','市盈率1','市盈率2','市盈率TTM','市净率','股息率']
+    cols = {"日期": "date"}
+    for metric, names in CSINDEX_COLUMNS.items():
+        found = [c for c in names if c in df.columns]
+        if metric == "pe" and not found:
+            # Some ak versions label 市盈率(TTM) slightly differently, try fuzzy match
+            found = [c for c in df.columns if "TTM" in str(c) and "市盈" in str(c)] or ["市盈率TTM"]
+        if found:
+            cols[found[0]] = metric
+    # dates are parsed, filtered and ordered once, in run_batch (normalize.canonical)
+    return df.rename(columns=cols)[list(cols.values())]
+
+def parse_gurufocus_data(text: str, metric: str = "pe") -> Optional[pd.DataFrame]:
+    """Extract the embedded "data": [[date,value],...] array from a GuruFocus indicator page."""
+    m = re.search(r'"data"\s*:\s*\[', text)
+    if not m:
+        return None
+    # raw_decode reads the nested array to its matching bracket
+    arr, _ = json.JSONDecoder().raw_decode(text, m.end() - 1)
+    return pd.DataFrame(arr, columns=["date",metric])
+
+def join_metrics(parts) -> pd.DataFrame:
+    """Outer-join date,<metric> frames into one date + metrics frame, ordered by date."""
+    if len(parts) == 1:
+        return parts[0]
+    out = None
+    for part in parts:
+        part = part.assign(date=pd.to_datetime(part["date"]))
+        out = part if out is None else out.merge(part, on="date", how="outer", sort=True)
+    return out
+
+def load_datalink(specs, since) -> dict:
+    """
+    Nasdaq Data Link datasets, one per metric (spec["datasets"]: metric -> datasets, preferred
+    first, e.g. MULTPL daily then monthly). Each metric is requested from the day after its own
+    last stored date, so a quarterly dataset does not pull its daily siblings back with it.
     """
-    Uses AkShare to download CSIndex valuation table and extract 市盈率(TTM). Daily frequency.
+    out = {}
+    for spec in specs:
+        last = since.get(spec["key"]) or {}
+        out[spec["key"]] = datalink_range(spec, {m: d + dt.timedelta(days=1) for m, d in last.items()},
+                                          skip_unchanged=True)
+    return out
+
+def fetch_datalink(dataset: str, metric: str, start: Optional[dt.date] = None, end: Optional[dt.date] = None,
+                   skip_unchanged: bool = False) -> pd.DataFrame:
+    """
+    One Data Link dataset as date,<metric>, limited to start..end (inclusive) when given. With
+    skip_unchanged, a body unchanged since the last run yields no rows without being parsed.
+    """
+    api_key = os.getenv("NASDAQ_API_KEY")
+    if not api_key:
+        raise RuntimeError("Set NASDAQ_API_KEY env for Nasdaq Data Link series.")
+    params = {"api_key": api_key}
+    if start is not None:
+        params["start_date"] = start.isoformat()
+    if end is not None:
+        params["end_date"] = end.isoformat()
+    r = fetch_url(DATALINK_URL.format(dataset=dataset), "datalink", dataset, params=params)
+    if r.from_cache and skip_unchanged:
+        # Unchanged since the last run: nothing new to append, skip parsing
+        return pd.DataFrame({"date": [], metric: []})
+    with metrics.stage("parse", "datalink", dataset) as st:
+        df = parse_datalink_csv(r.text, metric)[["date", metric]]
+        st.rows = len(df)
+    return df
+
+def datalink_range(spec, start=None, end: Optional[dt.date] = None, skip_unchanged: bool = False,
+                   metrics=None, failed: Optional[dict] = None):
+    """
+    The metrics of one index (default: all of spec["metrics"]) for start..end, each from its first
+    dataset that answers; or the last error. `start` is one date or metric -> date (metrics missing
+    from it are fetched whole, and skip_unchanged only applies to metrics with a start). Metrics no
+    dataset answered for are skipped with a warning and, when `failed` is given, added to it
+    (metric -> error).
+    """
+    parts, error = [], None
+    for metric in metrics or spec["metrics"]:
+        lo = start.get(metric) if isinstance(start, dict) else start
+        err = None
+        for dataset in spec["datasets"].get(metric, []):
+            try:
+                parts.append(fetch_datalink(dataset, metric, lo, end, skip_unchanged and lo is not None))
+                break
+            except Exception as e:
+                error = err = e
+        else:
+            err = err or RuntimeError(f"no dataset configured for {metric}")
+            print(f"[WARN] {spec['key']}.{metric}: no Data Link dataset succeeded ({err})")
+            if failed is not None:
+                failed[metric] = err
+    return join_metrics(parts) if parts else (error or RuntimeError(f"{spec['key']}: no datasets configured"))
+
+def load_csindex(specs, since) -> dict:
+    """
+    CSIndex valuation tables via AkShare; one call per index code returns PE TTM, PB and dividend
+    yield together. Daily frequency.
     """
     import akshare as ak
-    code = CONFIG["indices"]["CSI300"]["csindex_code"]
-    # ak.stock_zh_index_value_csindex(symbol="000300")
-    df = ak.stock_zh_index_value_csindex(symbol=code)
-    # Expected columns: ['日期','市盈率1','市盈率2','市盈率TTM','市净率','股息率']
-    # Standardize to date & pe (TTM)
-    # Some ak versions label 市盈率(TTM) slightly differently, try fuzzy match
-    pe_col = None
-    for c in df.columns:
-        if "TTM" in str(c) and "市盈" in str(c):
-            pe_col = c; break
-    if pe_col is None:
-        # fallback to a typical column name
-        pe_col = "市盈率TTM"
-    out = df.rename(columns={"日期":"date", pe_col:"pe"})[["date","pe"]]
-    out["date"] = pd.to_datetime(out["date"]).dt.date
-    out = out.dropna().sort_values("date")
-    return last_n_years(out, n=10)
-
-def hsi_from_hkex_or_gurufocus() -> pd.DataFrame:
-    """
-    Strategy A: Use Hang Seng Indexes valuation JSON that powers hsi.com.hk charts (if reachable).
-    Strategy B: Scrape GuruFocus 'PE Ratio (TTM) for the Hang Seng Index' table (may require cookies).
-    Both are best-effort; for production, consider licensed feeds from HSIL/CEIC.
-    """
-    # Strategy A placeholder (endpoint patterns change often; left as optional)
-    try:
-        # Example pattern (subject to change): this block is defensive and may fail gracefully
-        # If you have a stable JSON endpoint, set HSI_JSON_URL env to override.
-        json_url = os.getenv("HSI_JSON_URL")
-        if json_url:
-            r = http_get(json_url)
-            js = r.json()
-            # Expect ['data'] list of [timestamp, value]
-            if isinstance(js, dict) and "data" in js:
-                arr = js["data"]
-                df = pd.DataFrame(arr, columns=["ts","pe"])
-                df["date"] = pd.to_datetime(df["ts"], unit="ms").dt.date
-                out = df[["date","pe"]].dropna()
-                return last_n_years(out, 10)
-    except Exception as e:
-        pass
-    # Strategy B: GuruFocus HTML table scrape
-    try:
-        url = "https://www.gurufocus.com/economic_indicators/5732/pe-ratio-ttm-for-the-hang-seng-index"
-        r = http_get(url)
-        # Parse simple JSON embedded or table CSV
-        # Look for "data": [[date,value],...]
-        m = re.search(r'"data"\s*:\s*(\[[^\]]+\])', r.text)
-        if m:
-            arr = json.loads(m.group(1))
-            df = pd.DataFrame(arr, columns=["date","pe"])
-            df["date"] = pd.to_datetime(df["date"]).dt.date
-            return last_n_years(df, 10)
-    except Exception:
-        pass
-    raise RuntimeError("HSI loader could not fetch data automatically; please configure HSI_JSON_URL or a licensed source.")
+    out = {}
+    for spec in specs:
+        try:
+            with metrics.stage("fetch", spec["source"], spec["key"]) as st:
+                raw = ak.stock_zh_index_value_csindex(symbol=spec["code"])
+                st.rows = len(raw)
+            with metrics.stage("parse", spec["source"], spec["key"]) as st:
+                out[spec["key"]] = normalize_csindex(raw)
+                st.rows = len(out[spec["key"]])
+        except Exception as e:
+            out[spec["key"]] = e
+    return out
 
-def nasdaq_composite_from_gurufocus_or_proxy() -> pd.DataFrame:
+def _feed_url(feed: dict) -> Optional[str]:
+    return os.getenv(feed.get("url_env", "")) or feed.get("url")
+
+def feed_json(spec, feed, since):
     """
-    There is no stable free Composite TTM P/E feed. Try GuruFocus if available, else allow user-provided CSV.
-    To use your own CSV URL with 'date,pe' columns, set NASDAQ_COMP_CSV env.
+    A JSON feed {"data": [[timestamp_ms, value], ...]} for one metric, URL from feed["url_env"] (e.g.
+    the Hang Seng Indexes valuation JSON that powers hsi.com.hk charts, if reachable).
     """
-    # User-provided CSV
-    csv_url = os.getenv("NASDAQ_COMP_CSV")
-    if csv_url:
-        r = http_get(csv_url)
+    js = fetch_url(_feed_url(feed), spec["source"], spec["key"]).json()
+    if not isinstance(js, dict) or not js.get("data"):
+        raise ValueError("no 'data' list in JSON feed")
+    metric = feed.get("metric", "pe")
+    df = pd.DataFrame(js["data"], columns=["ts", metric])
+    return pd.DataFrame({"date": pd.to_datetime(df["ts"], unit="ms"), metric: df[metric]})
+
+def feed_pages(spec, feed, since):
+    """GuruFocus indicator pages (feed["pages"]: metric -> URL; may require cookies), one page per metric."""
+    parts, errors = [], []
+    for metric, url in feed["pages"].items():
+        try:
+            text = fetch_url(url, spec["source"], spec["key"]).text
+            with metrics.stage("parse", spec["source"], spec["key"]) as st:
+                df = parse_gurufocus_data(text, metric)
+                st.rows = 0 if df is None else len(df)
+            if df is None:
+                raise ValueError(f"no {metric} series found on page")
+            parts.append(df)
+        except Exception as e:
+            errors.append(f"{metric}: {e}")
+    if not parts:
+        raise RuntimeError("; ".join(errors))
+    return join_metrics(parts)
+
+def feed_csv(spec, feed, since):
+    """A CSV with a date column and metric columns (pe / pb / dy), URL from feed["url_env"] (or feed["url"])."""
+    r = fetch_url(_feed_url(feed), spec["source"], spec["key"])
+    if r.from_cache and since:
+        # Unchanged since the last run: nothing new to append
+        return pd.DataFrame({"date": []})
+    with metrics.stage("parse", spec["source"], spec["key"]) as st:
         df = pd.read_csv(io.StringIO(r.text))
-        df = df.rename(columns={"Date":"date","DATE":"date","PE":"pe","Pe":"pe","Pe_ttm":"pe"})
-        df["date"] = pd.to_datetime(df["date"]).dt.date
-        return last_n_years(df, 10)
-    # Attempt GuruFocus? (No public composite P/E page; likely to fail)
-    raise RuntimeError("Nasdaq Composite P/E feed not configured. Set NASDAQ_COMP_CSV to a CSV with columns date,pe.")
+        df = df.rename(columns=lambda c: str(c).lower()).rename(columns={"pe_ttm":"pe"})
+        st.rows = len(df)
+    return df
+
+FEED_KINDS = {"json": feed_json, "pages": feed_pages, "csv": feed_csv}
+HEDGE = CONFIG.get("hedge", {})
+HEALTH = HealthBook(HEDGE.get("state_path", STATE_PATH), HEDGE.get("failure_threshold", 3),
+                    HEDGE.get("cooldown_min", 360) * 60)
+
+def load_hedged(specs, since) -> dict:
+    """
+    Indices with alternative feeds (spec["feeds"], e.g. HSI: valuation JSON / GuruFocus pages;
+    NASDAQ: CSV / JSON). Configured feeds are raced as hedged requests (hedge.race): the healthiest
+    starts first, the next after hedge_delay_sec or as soon as one fails, and the first feed that
+    returns rows wins. Feeds without a URL set are skipped.
+    With cross_check set (per index, or in the "hedge" config) every feed is fetched instead
+    (hedge.gather): the healthiest one still supplies the series, and each feed's values are also
+    returned as "<metric>@<feed>" columns, which the quality mask cross-checks (validation.cross_check).
+    These feeds are best-effort; for production, consider licensed feeds from HSIL/CEIC.
+    """
+    out = {}
+    for spec in specs:
+        key = spec["key"]
+        feeds = [f for f in spec.get("feeds", []) if f["kind"] == "pages" or _feed_url(f)]
+        if not feeds:
+            envs = [f["url_env"] for f in spec.get("feeds", []) if f.get("url_env")]
+            out[key] = RuntimeError(f"{spec['name']} feed not configured. Set {' or '.join(envs) or 'a feed URL'} "
+                                    "(JSON [[ts, value], ...] or CSV with columns date,pe).")
+            continue
+        candidates = [(f"{key}/{f['name']}", (lambda f=f: FEED_KINDS[f["kind"]](spec, f, since.get(key))))
+                      for f in feeds]
+        valid = lambda df: isinstance(df, pd.DataFrame) and "date" in df.columns
+        timeout = spec.get("hedge_timeout_sec", HEDGE.get("timeout_sec", 60.0))
+        if len(feeds) > 1 and spec.get("cross_check", HEDGE.get("cross_check", False)):
+            try:
+                results = gather(candidates, HEALTH, timeout=timeout, valid=valid)
+            except FeedsFailed as e:
+                out[key] = e
+                continue
+            name = next(iter(results))
+            print(f"{key}: using feed {name}, cross-checked against {len(results) - 1} other(s)")
+            # one row per date in every part, so the outer join cannot multiply repeated dates
+            parts = [df.assign(date=pd.to_datetime(df["date"])).drop_duplicates("date", keep="last")
+                     for df in results.values()]
+            copies = [df[["date"] + [m for m in spec["metrics"] if m in df.columns]]
+                      .rename(columns=lambda c, feed=feed.split("/", 1)[1]: c if c == "date" else f"{c}@{feed}")
+                      for feed, df in zip(results, parts) if len(df)]
+            out[key] = join_metrics(parts[:1] + copies)
+            continue
+        try:
+            name, df = race(candidates, HEALTH, delay=spec.get("hedge_delay_sec", HEDGE.get("delay_sec", 2.0)),
+                            timeout=timeout, valid=valid)
+            print(f"{key}: using feed {name}")
+            out[key] = df
+        except FeedsFailed as e:
+            out[key] = e
+    HEALTH.save()
+    return out
 
 LOADER_MAP = {
-    "sp500_from_nasdaq_datalink": sp500_from_nasdaq_datalink,
-    "csi300_from_csindex_via_akshare": csi300_from_csindex_via_akshare,
-    "hsi_from_hkex_or_gurufocus": hsi_from_hkex_or_gurufocus,
-    "nasdaq_composite_from_gurufocus_or_proxy": nasdaq_composite_from_gurufocus_or_proxy,
+    "datalink": load_datalink,
+    "csindex": load_csindex,
+    "hedged": load_hedged,
 }
 
-def run_one(key: str) -> Optional[pd.DataFrame]:
-    meta = CONFIG["indices"][key]
-    loader_name = meta["loader"]
-    fn = LOADER_MAP[loader_name]
-    print(f"Fetching {meta['name']} via {loader_name} ...")
-    df = fn()  # may raise
-    df = df.sort_values("date")
-    save_csv(df, os.path.join(DATA_DIR, f"{key}.csv"))
-    return df
+def run_batch(source: str, keys, store: WideStore, incremental: bool = True) -> dict:
+    """
+    Fetch one batch of indices sharing `source`. In incremental mode loaders get, per index, the
+    last stored date of each metric that has data (key -> {metric: date}; None on a full run) and
+    only rows after the earliest of them are kept. Returns key -> new rows (canonical frames, see
+    normalize.py, within the history window), or the exception the key failed with.
+    """
+    specs = [SPECS[k] for k in keys]
+    loader = specs[0]["loader"]
+    since = {k: store.last_dates(k, SPECS[k]["metrics"]) if incremental else None for k in keys}
+    print(f"Fetching {', '.join(keys)} from {source} via {loader} ...")
+    raw = LOADER_MAP[loader](specs, since)  # may raise for the whole batch
+    out = {}
+    for spec in specs:
+        key = spec["key"]
+        df = raw.get(key, RuntimeError(f"{loader} returned nothing for {key}"))
+        if not isinstance(df, Exception):
+            with metrics.stage("validate", source, key) as st:
+                cols = [m for m in spec["metrics"] if m in df.columns]
+                # rows after the earliest per-metric last date, or every row when a fetched metric
+                # has nothing stored yet
+                last = since[key] or {}
+                unseen = [m for m in cols if m not in last and df[m].notna().any()]
+                # per-feed copies of cross-checked indices (load_hedged) ride along with their metric
+                cols += [c for c in df.columns if c.partition("@")[0] in spec["metrics"] and "@" in c]
+                after = min(last.values()) if last and not unseen else None
+                # One pass: window, date order / dedupe, range rejection, float32 layout
+                df, rejected = canonical(df, cols, start=history_start(), after=after)
+                st.rows = len(df)
+            for metric, counts in rejected.items():
+                print(f"[WARN] {key}.{metric} rejected: " + ", ".join(f"{k}={n}" for k, n in counts.items()))
+            print(f"{key}: new_rows={len(df)} metrics={','.join(cols)}")
+        out[key] = df
+    return out
+
+def write_series_views(store: WideStore, keys):
+    """Per-index PE views the page loads directly (<KEY>.bin / .parquet, see write_columnar)."""
+    for key in keys:
+        write_columnar(store.series(key, "pe"), os.path.join(DATA_DIR, key))
+
+def sync_tsdb(store: WideStore, keys, dfs: dict, incremental: bool = True) -> int:
+    """
+    Mirror the refreshed keys' columns into the indexed store (tsdb.py). Incremental runs upsert
+    only the dates from the earliest new row on; --full replaces the keys' series.
+    """
+    cols = [c for c in store.frame.columns if c.split(".", 1)[0] in set(keys)]
+    frame = store.frame[cols]
+    if incremental:
+        starts = [df["date"].iloc[0] for df in dfs.values() if len(df)]
+        if not starts:
+            return 0
+        frame = frame[frame.index >= min(starts)]
+    with TimeSeriesDB() as db:
+        return db.upsert_frame(frame, replace=not incremental)
+
+def write_quality(store: WideStore) -> dict:
+    """
+    Quality mask of every stored series (validation.check_frame), saved as the flagged cells only
+    (data/quality.csv: date,series,flags bitmask). Returns series -> {flag: count}.
+    """
+    mask = validation.check_frame(store.frame, asof=dt.date.today())
+    validation.to_long(mask).to_csv(os.path.join(DATA_DIR, "quality.csv"), index=False, date_format="%Y-%m-%d")
+    summary = validation.summary(mask)
+    for col, counts in summary.items():
+        print(f"[QC] {col}: " + ", ".join(f"{k}={n}" for k, n in counts.items()))
+    return summary
+
+def write_relative(store: WideStore, incremental: bool = True) -> Optional[dict]:
+    """
+    Cross-index relative valuation (relative.py) of the PE series listed under config "relative"
+    (default: every charted index), advanced over the days since the last run.
+    """
+    cfg = CONFIG.get("relative", {})
+    keys = [k for k in cfg.get("keys", [k for k in ALL_KEYS if SPECS[k].get("chart", True)])
+            if column(k, "pe") in store.frame.columns]
+    pe = store.frame[[column(k, "pe") for k in keys]].set_axis(keys, axis=1)
+    return update_relative(pe, os.path.join(DATA_DIR, "relative"), window=cfg.get("window_days", WINDOW_DAYS),
+                           corr_window=cfg.get("corr_window_days", CORR_WINDOW_DAYS),
+                           ffill_limit=cfg.get("ffill_limit_days", FFILL_LIMIT_DAYS), incremental=incremental)
+
+def write_chart_payload(store: WideStore, keys):
+    """Precompute the merged date axis and downsampled zoom levels from the stored PE series."""
+    frames = {key: store.series(key, "pe").reset_index() for key in keys}
+    labels = {key: SPECS[key]["label"] for key in keys}
+    index = build_chart_payload(frames, labels, os.path.join(DATA_DIR, "chart"))
+    print(f"Wrote {DATA_DIR}/chart  levels={len(index['levels'])}")
 
-def generate_site(dfs: dict):
+def publish_site_assets(keys):
+    """Copy series and chart payload into site/assets under content-hashed names (site/manifest.json)."""
+    files = {}
+    for key in keys:
+        path = os.path.join(DATA_DIR, f"{key}.bin")
+        if os.path.exists(path):
+            files[f"{key}.bin"] = path
+    chart_dir = os.path.join(DATA_DIR, "chart")
+    index_path = os.path.join(chart_dir, "index.json")
+    if os.path.exists(index_path):
+        index = json.load(open(index_path, "r", encoding="utf-8"))
+        files["chart/index.json"] = index_path
+        for level in index["levels"]:
+            for tile in level["tiles"]:
+                files[f"chart/{tile['file']}"] = os.path.join(chart_dir, tile["file"])
+    published = publish_files(SITE_DIR, files)
+    print(f"Published {len(published)} assets to {SITE_DIR}/assets")
+
+def generate_site(keys):
     # Assemble site/index.html using ECharts and Plotly fallback
     # We will produce ECharts line chart with responsive layout.
+    series_keys = [[key, SPECS[key]["label"]] for key in keys]
     html = f"""<!doctype html>
 <html lang="zh-CN">
 <head>
@@ -219,29 +498,57 @@ def generate_site(dfs: dict):
   </header>
   <main>
     <div id="chart"></div>
-    <div class="legend-note">指数：沪深300 · 标普500 · 恒生指数 · 纳斯达克综合</div>
+    <div class="legend-note">指数：{" · ".join(label for _, label in series_keys)}</div>
   </main>
   <div class="footer" id="footer"></div>
   <script>
-    async function loadCSV(path) {{
-      const res = await fetch(path + "?v=" + Date.now());
-      const txt = await res.text();
-      const rows = txt.trim().split(/\\n/).slice(1).map(r=>r.split(","));
-      return rows.map(r=>({{date:r[0], pe: parseFloat(r[1])}})).filter(x=>!isNaN(x.pe));
+    // Content-hashed assets listed in manifest.json (see publish.py); cache-busted paths otherwise
+    let MANIFEST = null;
+    const assetURL = (name, fallback)=> (MANIFEST && MANIFEST.files && MANIFEST.files[name]) || (fallback + "?v=" + Date.now());
+    // <KEY>.bin: n int32 day offsets followed by n float32 PE values (little-endian), returned as
+    // two typed-array views over the one buffer (no per-point objects; NaN values are gaps)
+    async function loadBin(url) {{
+      const res = await fetch(url);
+      if (!res.ok) throw new Error(res.status);
+      const buf = await res.arrayBuffer();
+      const n = buf.byteLength / 8;
+      return {{ day: new Int32Array(buf, 0, n), pe: new Float32Array(buf, 4 * n, n) }};
+    }}
+    const dayLabel = (day)=> new Date(day * 86400000).toISOString().slice(0, 10);
+    const loadSeries = (key)=> loadBin(assetURL(`${{key}}.bin`, `../data/${{key}}.bin`));
+    // Precomputed payload (see chart_payload.py): merged date axis + LTTB zoom levels
+    const CHART_DIR = "../data/chart/";
+    const tileCache = new Map();
+    function loadTile(file) {{
+      if (!tileCache.has(file)) tileCache.set(file, fetch(assetURL("chart/" + file, CHART_DIR + file)).then(r=>r.json()));
+      return tileCache.get(file);
+    }}
+    // Fallback when the payload is missing: one dataset per raw series, its typed-array columns
+    // handed to the chart as they are (x = day offsets, labelled on demand by dayLabel)
+    async function clientPayload() {{
+      const keys = {json.dumps(series_keys, ensure_ascii=False)};
+      const loaded = await Promise.all(keys.map(([k])=>loadSeries(k).catch(_=>null)));
+      const present = keys.map((k,i)=>[k, loaded[i]]).filter(([,cols])=> cols && cols.day.length);
+      return {{
+        index: {{ series: present.map(([[key,name]])=>({{key, name}})), levels: [] }},
+        datasets: present.map(([,cols])=>({{ dimensions: ['day', 'pe'], source: cols }})),
+      }};
+    }}
+    function tilePoints(tile, key, lo, hi) {{
+      const vals = tile.series[key] || [];
+      const out = [];
+      tile.dates.forEach((d,i)=>{{ if (vals[i] != null && d >= lo && d <= hi) out.push([d, vals[i]]); }});
+      return out;
     }}
     async function main(){{
-      const sp = await loadCSV("../data/SP500.csv");
-      const csi = await loadCSV("../data/CSI300.csv");
-      const hsi = await loadCSV("../data/HSI.csv").catch(_=>[]);
-      const nas = await loadCSV("../data/NASDAQ.csv").catch(_=>[]);
-      const series = [
-        {{ name: "标普500", data: sp.map(x=>[x.date, x.pe]) }},
-        {{ name: "沪深300", data: csi.map(x=>[x.date, x.pe]) }},
-      ];
-      if (hsi.length) series.push({{ name: "恒生指数", data: hsi.map(x=>[x.date, x.pe]) }});
-      if (nas.length) series.push({{ name: "纳斯达克综合", data: nas.map(x=>[x.date, x.pe]) }});
-
-      const dates = [...new Set(series.flatMap(s=>s.data.map(d=>d[0])) )].sort();
+      MANIFEST = await fetch("manifest.json", {{cache: "no-cache"}}).then(r=> r.ok ? r.json() : null).catch(_=>null);
+      let index, base, datasets = null;
+      try {{
+        index = await fetch(assetURL("chart/index.json", CHART_DIR + "index.json")).then(r=>{{ if (!r.ok) throw new Error(r.status); return r.json(); }});
+        base = index.levels.length ? await loadTile(index.levels[0].tiles[0].file) : {{ dates: [], series: {{}} }};
+      }} catch (_) {{
+        ({{ index, datasets }} = await clientPayload());
+      }}
       const el = document.getElementById('chart');
       const chart = echarts.init(el, null, {{renderer:'canvas'}});
       const option = {{
@@ -256,24 +563,58 @@ def generate_site(dfs: dict):
           top: 10
         }},
         grid: {{ left: 40, right: 24, top: 50, bottom: 60 }},
-        xAxis: {{
-          type: 'category', data: dates, boundaryGap: false, axisLabel: {{ formatter: (v)=> v.slice(0,10) }}
+        dataZoom: [{{ type: 'inside' }}, {{ type: 'slider', bottom: 16 }}],
+        xAxis: datasets ? {{
+          type: 'value', min: 'dataMin', max: 'dataMax',
+          axisLabel: {{ formatter: dayLabel }},
+          axisPointer: {{ label: {{ formatter: (p)=> dayLabel(p.value) }} }}
+        }} : {{
+          type: 'time', boundaryGap: false
         }},
+        dataset: datasets || [],
         yAxis: {{
           type: 'value',
           name: 'PE（TTM）',
           nameGap: 18,
           splitLine: {{ show: true }}
         }},
-        series: series.map((s)=>({{
+        series: index.series.map((s,i)=>({{
+          id: s.key,
           type: 'line',
           name: s.name,
           showSymbol: false,
           smooth: false,
-          data: s.data,
+          connectNulls: true,
+          ...(datasets ? {{ datasetIndex: i, encode: {{ x: 'day', y: 'pe' }} }} : {{ data: tilePoints(base, s.key, "", "9999") }}),
         }}))
       }};
       chart.setOption(option);
+
+      // On zoom, swap in the deepest level whose tile still covers the visible span
+      let zoomTimer = null;
+      async function refine() {{
+        const dz = chart.getOption().dataZoom[0];
+        const start = dz.startValue, end = dz.endValue;
+        if (!index.levels.length || start == null || end == null) return;
+        const spanDays = (end - start) / 86400000;
+        let level = 0;
+        index.levels.forEach((l,i)=>{{ if (l.tile_days >= spanDays) level = i; }});
+        const tiles = index.levels[level].tiles.filter(t=> Date.parse(t.end) >= start - 86400000 && Date.parse(t.start) <= end + 86400000);
+        if (!tiles.length) return;
+        const fine = await Promise.all(tiles.map(t=>loadTile(t.file)));
+        const lo = tiles[0].start, hi = tiles[tiles.length - 1].end;
+        chart.setOption({{
+          series: index.series.map((s)=>({{
+            id: s.key,
+            data: level === 0 ? tilePoints(base, s.key, "", "9999") : [
+              ...tilePoints(base, s.key, "", lo).filter(p=>p[0] < lo),
+              ...fine.flatMap(t=>tilePoints(t, s.key, lo, hi)),
+              ...tilePoints(base, s.key, hi, "9999").filter(p=>p[0] > hi),
+            ],
+          }}))
+        }});
+      }}
+      chart.on('datazoom', ()=>{{ clearTimeout(zoomTimer); zoomTimer = setTimeout(refine, 150); }});
       window.addEventListener("resize", ()=> chart.resize());
       const sourceNote = `数据来源： 
         标普500：Nasdaq Data Link (MULTPL)；
@@ -291,26 +632,142 @@ def generate_site(dfs: dict):
     open(os.path.join(SITE_DIR, "index.html"), "w", encoding="utf-8").write(html)
     print("Wrote site/index.html")
 
-def main():
-    failures = []
-    dfs = {}
-    for key in ["SP500","CSI300","HSI","NASDAQ"]:
-        try:
-            df = run_one(key)
+def _spawn(fn, *args) -> Future:
+    """
+    Run fn(*args) in a daemon thread. Unlike executor workers, which the interpreter joins at exit,
+    a loader that hangs past its timeout can be abandoned without holding up the process.
+    """
+    fut = Future()
+    def body():
+        if fut.set_running_or_notify_cancel():
+            try:
+                fut.set_result(fn(*args))
+            except BaseException as e:
+                fut.set_exception(e)
+    threading.Thread(target=body, name="loader", daemon=True).start()
+    return fut
+
+def run_keys(keys, store: WideStore, incremental: bool = True):
+    """
+    Run the loaders for `keys` concurrently, one daemon thread per source batch (see
+    sources.batches), at most concurrency.max_workers at a time and concurrency.per_host per
+    upstream host. A batch that runs longer than concurrency.loader_timeout_sec (or its source's
+    own loader_timeout_sec) is reported as failed and abandoned; its host stays taken, so batches
+    still queued for that host fail too instead of waiting on it.
+    Returns (dfs, failures) ordered like `keys`, matching a sequential run.
+    """
+    conc = CONFIG.get("concurrency", {})
+    max_workers, per_host = conc.get("max_workers", 4), conc.get("per_host", 1)
+    queue = [(s, tuple(k)) for s, k in batches(SPECS, keys)]
+    host = lambda unit: SPECS[unit[1][0]]["host"]
+    running, busy = {}, {}
+    results, errors = {}, {}
+    while queue or running:
+        for unit in list(queue):
+            if len(running) >= max_workers:
+                break
+            if busy.get(host(unit), 0) < per_host:
+                queue.remove(unit)
+                busy[host(unit)] = busy.get(host(unit), 0) + 1
+                running[_spawn(run_batch, unit[0], unit[1], store, incremental)] = (unit, time.monotonic())
+        if not running:
+            # what is left waits on hosts held by abandoned loaders
+            for unit in queue:
+                errors.update({key: TimeoutError(f"{host(unit)} still busy with a timed-out loader") for key in unit[1]})
+            break
+        done, _ = wait(list(running), timeout=0.5, return_when=FIRST_COMPLETED)
+        for fut in done:
+            unit, _ = running.pop(fut)
+            busy[host(unit)] -= 1
+            try:
+                results.update(fut.result())
+            except Exception as e:
+                errors.update({key: e for key in unit[1]})
+        now = time.monotonic()
+        for fut, (unit, started) in list(running.items()):
+            timeout = SPECS[unit[1][0]].get("loader_timeout_sec", conc.get("loader_timeout_sec", 120))
+            if now - started > timeout:
+                del running[fut]
+                errors.update({key: TimeoutError(f"loader exceeded {timeout}s") for key in unit[1]})
+
+    dfs, failures = {}, []
+    for key in keys:
+        df = results.get(key, errors.get(key))
+        if isinstance(df, pd.DataFrame):
             dfs[key] = df
+            continue
+        # Keep any stored history for the failed index
+        print(f"[WARN] {key} failed: {df}")
+        failures.append((key, str(df)))
+    return dfs, failures
+
+ALL_KEYS = list(SPECS)
+
+def build_site(store: Optional[WideStore] = None, keys=None):
+    """
+    Rebuild the per-index views of `keys` (default: all), the chart payload, hashed assets and
+    site/index.html from the wide store, without fetching anything.
+    """
+    ensure_dirs()
+    if store is None:
+        store = WideStore(DATA_DIR)
+        store.trim(HISTORY_YEARS)
+    write_series_views(store, ALL_KEYS if keys is None else keys)
+    chart_keys = [k for k in ALL_KEYS if SPECS[k].get("chart", True)]
+    write_chart_payload(store, chart_keys)
+    publish_site_assets(chart_keys)
+    generate_site(chart_keys)
+
+def main(incremental: bool = True, keys=None):
+    """
+    Refresh `keys` (default: every registered index) into the wide store, then rebuild the
+    per-index views, chart payload, assets and site. Returns the (key, error) failures.
+    """
+    keys = [k for k in ALL_KEYS if k in keys] if keys is not None else ALL_KEYS
+    ensure_dirs()
+    metrics.start_run("pe")
+    try:
+        store = WideStore(DATA_DIR)
+        dfs, failures = run_keys(keys, store, incremental=incremental)
+        with metrics.stage("write", "series") as st:
+            for key, df in dfs.items():
+                # --full replaces the stored columns; otherwise new rows overlay the stored ones
+                store.merge(key, df, replace=not incremental)
+            store.flush()
+            store.trim(HISTORY_YEARS)
+            st.bytes = store.save()
+            st.rows = len(store.frame)
+        with metrics.stage("write", "tsdb") as st:
+            st.rows = sync_tsdb(store, keys, dfs, incremental)
+        with metrics.stage("validate", "series") as st:
+            quality = write_quality(store)
+            st.rows = int(store.frame.notna().to_numpy().sum())
+        try:
+            with metrics.stage("write", "relative"):
+                write_relative(store, incremental)
         except Exception as e:
-            print(f"[WARN] {key} failed: {e}")
-            # Create an empty placeholder CSV so the site still loads
-            pd.DataFrame({"date":[], "pe":[]}).to_csv(os.path.join(DATA_DIR, f"{key}.csv"), index=False)
-            failures.append((key, str(e)))
-    generate_site(dfs)
-    # Write a small status json
-    status = {
-        "updated_at_beijing": dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC"),
-        "failures": failures
-    }
-    open(os.path.join(SITE_DIR, "status.json"), "w").write(json.dumps(status, ensure_ascii=False, indent=2))
+            print(f"[WARN] relative valuation failed: {e}")
+        for key in keys:
+            try:
+                with metrics.stage("write", "analytics", key):
+                    update_analytics(key, store.series(key, "pe"), DATA_DIR, incremental=incremental)
+            except Exception as e:
+                print(f"[WARN] {key} analytics failed: {e}")
+        with metrics.stage("write", "site"):
+            build_site(store, keys)
+        # Write a small status json
+        status = {
+            "updated_at_beijing": dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC"),
+            "failures": failures,
+            "quality": quality,
+        }
+        open(os.path.join(SITE_DIR, "status.json"), "w").write(json.dumps(status, ensure_ascii=False, indent=2))
+    finally:
+        metrics.finish_run()
     print("Done.")
+    return failures
 
 if __name__ == "__main__":
-    main()
+    import sys
+    # --full re-downloads every series instead of appending rows after the last stored date
+    main(incremental="--full" not in sys.argv[1:])
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Columnar validation for every series the pipelines produce (PE / PB / DY, index closes, CPI / PPI)
+check() runs over a whole (rows x series) block at once and returns a uint8 quality mask of the same
+shape, one bit per rule:
+- RANGE          value outside the metric's bounds (or not finite)
+- DUPLICATE      date repeated later in the block (the last occurrence is kept)
+- NON_MONOTONIC  date earlier than a date above it
+- JUMP           more than max_jump away from the previous valid value (the ±20% daily rule)
+- OUTLIER        isolated spike: the log change into the value is more than mad_k robust sigmas
+                 (rolling MAD of the series' log changes) from their median and the next change
+                 reverts it the same way; the newest value only needs the first condition
+- STALE          last valid value older than stale_days at `asof` (set on that last row)
+- CROSS          (check_frame / cross_check only) cross-source outlier: the log deviation of one source's value from the median of
+                 every source of the same series on that date is more than mad_k robust sigmas
+                 (rolling MAD of that source's deviations) from its usual offset
+RANGE (HARD) marks values that must not be stored; the others only annotate. Missing values (NaN)
+are not flagged. Rows out of date order are NON_MONOTONIC; among the rest every repeated date but
+the last is a DUPLICATE. Neither drops anything: loaders hand rows over in source order (often
+newest first), and dedupe() puts them in date order first, keeping the last non-NaN value of a
+repeated date. JUMP and OUTLIER look only at values that passed the HARD rules, in row order.
+
+Log changes rather than levels make the MAD test work on trending series (PE drifts for years),
+and requiring the reversion keeps level shifts (restatements, regime changes) out of OUTLIER.
+The rolling median / MAD is evaluated once per `mad_step` rows over the `mad_window` rows before
+the block and shared by the block, which keeps the whole check at a few hundred microseconds per
+series for 20 years of daily data (see check_frame) instead of a full per-row rolling median.
+
+CROSS needs the same series from several sources. The wide store keeps those as
+"<KEY>.<metric>@<feed>" columns next to "<KEY>.<metric>" (indices with cross_check set, see
+update_data.load_hedged); check_frame compares every such group with cross_check() and also flags
+the "<KEY>.<metric>" cell whose value came from a flagged source. The median of the deviations
+absorbs a steady offset between sources (different earnings bases), so only a source breaking away
+from the others is flagged; with two sources both are flagged, since either may be the wrong one.
+"""
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+RANGE, DUPLICATE, NON_MONOTONIC, JUMP, OUTLIER, STALE, CROSS = 1, 2, 4, 8, 16, 32, 64
+HARD = RANGE
+ORDER = DUPLICATE | NON_MONOTONIC
+FLAGS = {"range": RANGE, "duplicate": DUPLICATE, "non_monotonic": NON_MONOTONIC,
+         "jump": JUMP, "outlier": OUTLIER, "stale": STALE, "cross_source": CROSS}
+MAD_SCALE = 1.4826  # MAD -> sigma for normally distributed data
+
+@dataclass(frozen=True)
+class Rules:
+    low: float = -np.inf
+    high: float = np.inf
+    positive: bool = False              # reject values <= 0 (prices, valuation ratios)
+    max_jump: Optional[float] = 0.20    # relative change vs the previous valid value; None disables
+    mad_window: Optional[int] = 63      # rows in the trailing median window; None disables OUTLIER
+    mad_step: int = 63                  # rows sharing one window evaluation
+    mad_k: float = 6.0
+    mad_min_rel: float = 0.02           # ignore log changes smaller than this
+    stale_days: Optional[int] = 10      # calendar days; None disables STALE
+
+DEFAULT = Rules()
+RULES = {
+    "pe": Rules(high=1000.0, positive=True),
+    "pb": Rules(high=100.0, positive=True),
+    "dy": Rules(high=30.0, positive=True, max_jump=0.5),
+    "price": Rules(positive=True, stale_days=7),
+    "macro": Rules(max_jump=None, mad_window=None, stale_days=None),
+}
+
+def rules_for_column(column: str) -> Rules:
+    """Rules for a wide-store column "<KEY>.<metric>" (series_store.column), a source copy "<KEY>.<metric>@<feed>" or a bare metric."""
+    return RULES.get(column.partition("@")[0].rsplit(".", 1)[-1], DEFAULT)
+
+def _order_flags(dates: np.ndarray) -> np.ndarray:
+    days = dates.astype("datetime64[D]").view("int64")
+    flags = np.zeros(len(days), np.uint8)
+    if len(days) < 2:
+        return flags
+    back = np.zeros(len(days), bool)
+    back[1:] = days[1:] < np.maximum.accumulate(days)[:-1]
+    flags[back] |= NON_MONOTONIC
+    ordered = np.flatnonzero(~back)
+    repeated = days[ordered][:-1] == days[ordered][1:]
+    flags[ordered[:-1][repeated]] |= DUPLICATE
+    return flags
+
+def day_groups(days: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Stable date order of datetime64[D] rows (NaT-free) and the position in that order where each
+    distinct day starts: rows[order][starts] are the unique days, ascending.
+    """
+    order = np.argsort(days.view("int64"), kind="stable")
+    ordered = days[order]
+    starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]]) if len(days) else np.zeros(0, np.int64)
+    return order, starts
+
+def last_per_day(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Per day run (see day_groups) and column, the last non-NaN value of date-ordered `values` (NaN when none)."""
+    if not len(starts):
+        return values[:0]
+    idx = np.where(np.isnan(values), -1, np.arange(len(values)).reshape((-1,) + (1,) * (values.ndim - 1)))
+    last = np.maximum.reduceat(idx, starts, axis=0)
+    picked = np.take_along_axis(values, np.maximum(last, 0), axis=0)
+    return np.where(last >= 0, picked, np.nan)
+
+def dedupe(dates, values) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rows in any order -> (unique ascending days, values): one stable sort by date, then for every
+    date and series the last non-NaN value in source order. Rows without a date are dropped.
+    """
+    days = np.asarray(dates, dtype="datetime64[D]")
+    values = np.asarray(values, dtype="float64")
+    dated = ~np.isnat(days)
+    days, values = days[dated], values[dated]
+    order, starts = day_groups(days)
+    return days[order][starts], last_per_day(values[order], starts)
+
+def _last_valid(ok: np.ndarray) -> np.ndarray:
+    """Row index of the last valid value at or before each row, per column (-1 when none)."""
+    idx = np.where(ok, np.arange(len(ok))[:, None], -1)
+    return np.maximum.accumulate(idx, axis=0)
+
+def _next_valid(ok: np.ndarray) -> np.ndarray:
+    """Row index of the first valid value after each row, per column (len(ok) when none)."""
+    n = len(ok)
+    idx = np.where(ok, np.arange(n)[:, None], n)
+    at_or_after = np.minimum.accumulate(idx[::-1], axis=0)[::-1]
+    return np.vstack([at_or_after[1:], np.full((1, ok.shape[1]), n)])
+
+def _sorted_median(windows: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Median along the last axis of NaN-padded windows already sorted ascending (NaNs last)."""
+    lo = np.take_along_axis(windows, np.maximum((counts - 1) // 2, 0)[..., None], axis=-1)[..., 0]
+    hi = np.take_along_axis(windows, np.maximum(counts // 2, 0)[..., None], axis=-1)[..., 0]
+    return (lo + hi) / 2
+
+def _block_mad(values: np.ndarray, window: int, step: int, min_periods: int):
+    """
+    Median and MAD of the `window` rows before each block of `step` rows, broadcast to the
+    block's rows (NaN where fewer than `min_periods` values are available).
+    """
+    n, m = values.shape
+    padded = np.vstack([np.full((window, m), np.nan), values])
+    # (blocks, series, window) views: block b covers rows [b*step, (b+1)*step), window rows [b*step-window, b*step)
+    windows = np.sort(np.lib.stride_tricks.sliding_window_view(padded[:n + window - 1], window, axis=0)[::step], axis=-1)
+    counts = np.count_nonzero(~np.isnan(windows), axis=-1)
+    median = _sorted_median(windows, counts)
+    mad = _sorted_median(np.sort(np.abs(windows - median[..., None]), axis=-1), counts)
+    thin = counts < min_periods
+    median[thin] = np.nan
+    mad[thin] = np.nan
+    return np.repeat(median, step, axis=0)[:n], np.repeat(mad, step, axis=0)[:n]
+
+def check(dates, values, rules: Rules = DEFAULT, asof=None) -> np.ndarray:
+    """
+    Quality mask for `values` (1-D, or 2-D rows x series sharing `dates`). `dates` may be None when
+    the rows carry no dates (ordering and staleness are then skipped).
+    """
+    values = np.asarray(values, dtype="float64")
+    flat = values.ndim == 1
+    if flat:
+        values = values[:, None]
+    n = len(values)
+    present = ~np.isnan(values)
+    mask = np.zeros(values.shape, np.uint8)
+    if n == 0:
+        return mask[:, 0] if flat else mask
+
+    with np.errstate(invalid="ignore"):
+        bad = ~np.isfinite(values) | (values < rules.low) | (values > rules.high)
+        if rules.positive:
+            bad |= values <= 0
+    mask[present & bad] |= RANGE
+    if dates is not None:
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        mask |= np.where(present, _order_flags(dates)[:, None], 0).astype(np.uint8)
+
+    ok = present & (mask == 0)
+    clean = np.where(ok, values, np.nan)
+    last = _last_valid(ok)
+    prev_idx = np.vstack([np.full((1, values.shape[1]), -1), last[:-1]])
+    prev = np.where(prev_idx >= 0, np.take_along_axis(clean, np.maximum(prev_idx, 0), axis=0), np.nan)
+    if rules.max_jump is not None and n > 1:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            jump = np.abs(clean / prev - 1.0) > rules.max_jump
+        mask[ok & jump] |= JUMP
+    if rules.mad_window is not None and n > rules.mad_window // 2:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            change = np.log(clean / prev)
+        median, mad = _block_mad(change, rules.mad_window, rules.mad_step, max(5, rules.mad_window // 2))
+        dev = change - median
+        with np.errstate(invalid="ignore"):
+            big = (np.abs(dev) > rules.mad_k * MAD_SCALE * mad) & (np.abs(change) > rules.mad_min_rel)
+        nxt = _next_valid(ok)
+        has_next = nxt < n
+        nxt = np.minimum(nxt, n - 1)
+        reverts = np.take_along_axis(big, nxt, axis=0) & (np.sign(np.take_along_axis(dev, nxt, axis=0)) == -np.sign(dev))
+        mask[ok & big & (reverts | ~has_next)] |= OUTLIER
+    if dates is not None and asof is not None and rules.stale_days is not None:
+        tail = last[-1]
+        cols = np.flatnonzero(tail >= 0)
+        age = (np.datetime64(pd.Timestamp(asof).date(), "D") - dates[tail[cols]]).astype("int64")
+        stale = cols[age > rules.stale_days]
+        mask[tail[stale], stale] |= STALE
+    return mask[:, 0] if flat else mask
+
+def _deviations(logs: np.ndarray) -> np.ndarray:
+    """Per row with two or more values, each value minus the row's median (NaN elsewhere)."""
+    counts = np.count_nonzero(~np.isnan(logs), axis=1)
+    dev = logs - _sorted_median(np.sort(logs, axis=1), counts)[:, None]
+    dev[counts < 2] = np.nan
+    return dev
+
+def cross_check(values, rules: Rules = DEFAULT) -> np.ndarray:
+    """
+    CROSS mask for rows x sources of one series (e.g. the same index's PE from every feed, aligned
+    on dates). Each source's log values are first shifted by its usual offset from the others (the
+    rolling median of its deviations), so a source joining, leaving or spiking does not move the
+    centre the rest are measured against; a source is compared once it has that history.
+    """
+    values = np.asarray(values, dtype="float64")
+    mask = np.zeros(values.shape, np.uint8)
+    if values.ndim != 2 or values.shape[1] < 2 or rules.mad_window is None or not len(values):
+        return mask
+    with np.errstate(invalid="ignore", divide="ignore"):
+        logs = np.log(np.where(values > 0, values, np.nan))
+    min_periods = max(5, rules.mad_window // 2)
+    offset, _ = _block_mad(_deviations(logs), rules.mad_window, rules.mad_step, min_periods)
+    dev = _deviations(logs - offset)
+    median, mad = _block_mad(dev, rules.mad_window, rules.mad_step, min_periods)
+    off = np.abs(dev - median)
+    with np.errstate(invalid="ignore"):
+        mask[(off > rules.mad_k * MAD_SCALE * mad) & (off > rules.mad_min_rel)] = CROSS
+    return mask
+
+def check_frame(frame: pd.DataFrame, rules: Union[Rules, Callable[[str], Rules], None] = None,
+                asof=None) -> pd.DataFrame:
+    """
+    Quality mask (uint8 frame, same shape) for a date-indexed frame of series, e.g. the wide store.
+    `rules` is one Rules for every column or a column -> Rules function (default rules_for_column);
+    columns sharing rules are checked together in one block. Source copies "<series>@<feed>" of a
+    series are cross-checked against each other (cross_check), see the module docstring.
+    """
+    rules = rules or rules_for_column
+    pick = rules if callable(rules) else (lambda _: rules)
+    groups: Dict[Rules, list] = {}
+    for i, col in enumerate(frame.columns):
+        groups.setdefault(pick(col), []).append(i)
+    out = np.zeros(frame.shape, np.uint8)
+    dates = frame.index.values
+    for group_rules, idx in groups.items():
+        out[:, idx] = check(dates, frame.iloc[:, idx].to_numpy(dtype="float64"), group_rules, asof)
+    sources: Dict[str, list] = {}
+    for i, col in enumerate(frame.columns):
+        base, sep, _ = col.partition("@")
+        if sep:
+            sources.setdefault(base, []).append(i)
+    for base, idx in sources.items():
+        if len(idx) < 2:
+            continue
+        block = frame.iloc[:, idx].to_numpy(dtype="float64")
+        cross = cross_check(block, pick(base))
+        out[:, idx] |= cross
+        if base in frame.columns:
+            # the series itself holds one source's value per date: flag it where that source was flagged
+            value = frame[base].to_numpy(dtype="float64")[:, None]
+            hit = (cross != 0) & np.isclose(block, value, rtol=1e-6, atol=0.0)
+            out[hit.any(axis=1), frame.columns.get_loc(base)] |= CROSS
+    return pd.DataFrame(out, index=frame.index, columns=frame.columns)
+
+def flag_names(bits: int) -> list:
+    return [name for name, bit in FLAGS.items() if int(bits) & bit]
+
+def summary(mask: pd.DataFrame) -> Dict[str, Dict[str, int]]:
+    """Column -> {flag name: flagged rows}, for columns with at least one flag."""
+    arr = mask.to_numpy()
+    out = {}
+    for name, bit in FLAGS.items():
+        counts = np.count_nonzero(arr & bit, axis=0)
+        for col, count in zip(mask.columns, counts):
+            if count:
+                out.setdefault(col, {})[name] = int(count)
+    return out
+
+def to_long(mask: pd.DataFrame) -> pd.DataFrame:
+    """Flagged cells only, as date / series / flags rows (the stored form of the quality mask)."""
+    rows, cols = np.nonzero(mask.to_numpy())
+    return pd.DataFrame({
+        "date": mask.index[rows],
+        "series": mask.columns[cols],
+        "flags": mask.to_numpy()[rows, cols],
+    })